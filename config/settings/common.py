@@ -54,7 +54,11 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Serves health_check/ and robots.txt, except on HOST_URLCONFS hosts, without the
+    # middleware below.
+    "core.middleware.FastPathMiddleware",
     "core.middleware.RequestIDMiddleware",
+    "core.middleware.QueryStatsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -67,6 +71,7 @@ MIDDLEWARE = [
     "core.middleware.SetRemoteAddrFromForwardedFor",
     "core.middleware.HostUrlconfMiddleware",
     "core.middleware.InertiaUserMiddleware",
+    "core.middleware.RequestProfileMiddleware",
 ]
 
 
@@ -141,6 +146,11 @@ ADMIN_URL_PATH = env("ADMIN_URL_PATH", default="admin/")
 
 REQUEST_ID_HEADER = None
 
+# Staff users can profile a request by sending this header or query parameter.
+# See core.middleware.RequestProfileMiddleware.
+REQUEST_PROFILE_HEADER = "X-Profile"
+REQUEST_PROFILE_PARAM = "_profile"
+
 # EMAIL
 # If there's a POSTMARK_API_KEY (for the Sandbox server), use the Postmark backend.
 # Otherwise, output to the console.
@@ -151,7 +161,22 @@ if POSTMARK_API_KEY:
     EMAIL_BACKEND = "postmark.django_backend.EmailBackend"
     POSTMARK_TEST_MODE = False
     POSTMARK_RETURN_MESSAGE_ID = True
+# Simulated round trips of core.backends.LatencyEmailBackend, for benchmarking offline.
+EMAIL_BACKEND_CONNECT_LATENCY = 0.1
+EMAIL_BACKEND_REQUEST_LATENCY = 0.05
 MAX_SUBJECT_LENGTH = 78
+# Sent EmailMessages can also be counted in sliding windows kept in Redis (a redis:// url)
+# or in memory ("memory://"). Cooldown checks of periods up to the retention are then
+# answered without SQL. Unset, they query EmailMessage. "memory://" counts only what each
+# process sent itself, so it isn't a global cooldown once there is more than one worker
+# or Celery process. Use it only in development or benchmarks.
+EMAIL_MESSAGE_COOLDOWN_COUNTER_URL = env(
+    "EMAIL_MESSAGE_COOLDOWN_COUNTER_URL", default=None
+)
+EMAIL_MESSAGE_COOLDOWN_COUNTER_RETENTION = 60 * 60 * 24
+# EmailMessages queued together are sent in batches of this many, each by one task over
+# one email backend connection. Postmark's batch endpoint allows at most 500.
+EMAIL_MESSAGE_QUEUE_CHUNK_SIZE = 100
 EMAIL_MESSAGE_WEBHOOK_PATH = env(
     "EMAIL_MESSAGE_WEBHOOK_PATH", default="email_message_webhook/"
 )
@@ -185,8 +210,20 @@ HOST_URLCONFS: dict[str, str] = {}
 LOGIN_URL = "/user/login/"
 LOGIN_REDIRECT_URL = "/user/settings/profile/"
 LOGOUT_REDIRECT_URL = "/user/login/"
-AUTHENTICATION_BACKENDS = ["django.contrib.auth.backends.ModelBackend"]
+# Users log in with CachedModelBackend. ModelBackend stays listed so that sessions which
+# stored its path before CachedModelBackend was added stay logged in.
+AUTHENTICATION_BACKENDS = [
+    "core.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+# How long the User of an authenticated request is cached by CachedModelBackend, if
+# CACHE_URL points to a shared cache or INVALIDATION_BUS_ENABLED is set.
+USER_CACHE_TIMEOUT = 60
 SESSION_COOKIE_AGE = 15_552_000  # 180 days
+# Set to "django.contrib.sessions.backends.cached_db" to read sessions from the cache
+# (see CACHES) and only hit the database on writes, or to "...backends.cache" to skip
+# the database entirely if the cache is persistent.
+SESSION_ENGINE = env("SESSION_ENGINE", default="django.contrib.sessions.backends.db")
 
 ORG_REQUIRED_INERTIA_COMPONENT = "core/OrgRequired"
 
@@ -228,6 +265,54 @@ INERTIA_LAYOUT = "core/layouts/inertia.html"
 
 STATIC_URL = "/static/"
 
+# SQL query budgets
+# QueryStatsMiddleware logs a warning when a request runs more queries than the budget
+# of its url name, e.g., {"user:profile": 10}, or QUERY_BUDGET_DEFAULT if it has none.
+QUERY_BUDGETS: dict[str, int] = {}
+QUERY_BUDGET_DEFAULT = 50
+
+# Caching
+# Defaults to a per-process in-memory cache. Set CACHE_URL (e.g., to a redis:// url)
+# to share cached values across processes.
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# How long resolved OrgSetting values are cached. The timeout is further bounded by
+# Org.current_period_end so that an expiring primary_plan is respected.
+ORG_SETTING_CACHE_TIMEOUT = 300
+
+# GlobalSettings are held in memory by each process. This is the most seconds a process
+# goes without checking whether they changed.
+GLOBAL_SETTING_SNAPSHOT_INTERVAL = 5
+
+# How long OrgUserSettingPermissionMixin decisions are cached between requests. They are
+# only cached between requests if CACHE_URL points to a shared cache or
+# INVALIDATION_BUS_ENABLED is set, so that changes through services reach every process;
+# this bounds staleness from changes made outside of them.
+ORG_USER_PERMISSION_CACHE_TIMEOUT = 60
+
+# How long each process caches the active Orgs of a domain, including that it has none.
+# Org changes through services evict it in the process that made them, and in every
+# process if INVALIDATION_BUS_ENABLED is set.
+ORG_DOMAIN_CACHE_TIMEOUT = 60
+
+# How long a user's serialized available_orgs are cached. Membership and Org changes
+# through services reach every process if CACHE_URL points to a shared cache or
+# INVALIDATION_BUS_ENABLED is set. Otherwise other processes may serve the old value for
+# up to ORG_USER_PERMISSION_CACHE_TIMEOUT seconds, which then bounds this timeout.
+AVAILABLE_ORGS_CACHE_TIMEOUT = 3600
+
+# OrgUser.last_accessed_at is only written when it is older than this many seconds
+# (or when another of the user's Orgs was accessed more recently). If a Redis url is
+# set, writes are buffered there and flushed by a periodic task in one UPDATE.
+ORG_USER_LAST_ACCESSED_GRANULARITY = 300
+ORG_USER_LAST_ACCESSED_BUFFER_URL = env(
+    "ORG_USER_LAST_ACCESSED_BUFFER_URL", default=None
+)
+
+# Publish model changes over Postgres NOTIFY so that every process evicts its in-memory
+# caches. See core/invalidation.py.
+INVALIDATION_BUS_ENABLED = env.bool("INVALIDATION_BUS_ENABLED", default=False)
+
 # Automated backups
 ENABLE_DATABASE_BACKUPS = False
 ENABLE_MEDIA_BACKUPS = False  # Not implemented yet
@@ -293,3 +378,18 @@ logging.config.dictConfig(
 ORG_SETTING_DEFAULTS: dict[str, dict[str, str]] = {}
 
 ORG_USER_SETTING_DEFAULTS: dict[str, dict[str, str]] = {}
+
+# When False, reading an OrgSetting or OrgUserSetting never writes to the database. Missing
+# rows fall back to the defaults above, and the materialize_setting_defaults management
+# command creates them in bulk instead.
+SETTINGS_MATERIALIZE_ON_READ = env.bool("SETTINGS_MATERIALIZE_ON_READ", default=True)
+
+# OrgSetting and OrgUserSetting definitions are held in memory by each process and
+# rebuilt at least this often (in seconds) to pick up changes made outside of services.
+SETTING_REGISTRY_TIMEOUT = 60
+
+# Periodically recompute the EffectiveOrgSettings of Orgs whose primary_plan has expired.
+# Only needed if org_get_effective_setting_value is used.
+ENABLE_EFFECTIVE_SETTINGS_REFRESH = env.bool(
+    "ENABLE_EFFECTIVE_SETTINGS_REFRESH", default=False
+)
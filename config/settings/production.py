@@ -72,8 +72,12 @@ AWS_S3_ACCESS_KEY_ID = env("AWS_S3_ACCESS_KEY_ID")
 AWS_S3_SECRET_ACCESS_KEY = env("AWS_S3_SECRET_ACCESS_KEY")
 
 # STATIC FILES - WHITENOISE
-# The WhiteNoise middleware should go above everything else except the security middleware.
-MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
+# The WhiteNoise middleware should go above everything else except the security middleware
+# and the fast path.
+MIDDLEWARE.insert(
+    MIDDLEWARE.index("core.middleware.FastPathMiddleware") + 1,
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+)
 STATICFILES_DIRS = [BASE_DIR / "frontend/dist"]
 # STATIC_ROOT is where collectstatic dumps all the static files
 STATIC_ROOT = BASE_DIR / "staticfiles"
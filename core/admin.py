@@ -20,6 +20,16 @@ class BaseModelAdmin(admin.ModelAdmin):
             func_str += "_create"
         return utils.get_function_from_path(func_str)
 
+    def delete_obj(self, obj):
+        """Delete the object with its <model>_delete service, if there is one, and
+        otherwise with model_delete."""
+        func_str = obj._meta.app_label + ".services." + utils.get_snake_case(obj)
+        try:
+            func = utils.get_function_from_path(func_str + "_delete")
+        except AttributeError:
+            func = services.model_delete
+        func(instance=obj)
+
     def save_formset(self, request, form, formset, change):
         instances = formset.save(commit=False)
         for instance in instances:
@@ -46,12 +56,19 @@ class BaseModelAdmin(admin.ModelAdmin):
             func(instance=instance, save=True, **required_kwargs)
 
         for obj in formset.deleted_objects:
-            obj.delete()
+            self.delete_obj(obj)
 
     def save_model(self, request, obj, form, change):
         func = self.get_save_func(obj, change)
         func(instance=obj, save=True, **form.cleaned_data)
 
+    def delete_model(self, request, obj):
+        self.delete_obj(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.delete_obj(obj)
+
 
 class EmailMessageWebhookAdminInline(admin.TabularInline):
     model = models.EmailMessageWebhook
@@ -107,6 +124,22 @@ class EventAdmin(BaseModelAdmin):
     pass
 
 
+@admin.register(models.RequestProfile)
+class RequestProfileAdmin(BaseModelAdmin):
+    """Profiles are recorded by RequestProfileMiddleware and only viewed, downloaded or
+    deleted here."""
+
+    list_display = ("__str__", "user", "status_code", "duration", "created_at")
+    list_filter = ("method", "status_code")
+    search_fields = ("request_id", "path")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.unregister(Group)
 
 
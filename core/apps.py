@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.core.signals import setting_changed
 
 
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        from core import invalidation, services
+
+        services.invalidation_handlers_register()
+        invalidation.start_listener()
+
+        # The setting definition registry is built from these on first use.
+        def setting_registry_reset(*, setting, **kwargs):
+            if setting in ("ORG_SETTING_DEFAULTS", "ORG_USER_SETTING_DEFAULTS"):
+                services.setting_registry_invalidate()
+
+        setting_changed.connect(setting_registry_reset, weak=False)
@@ -0,0 +1,81 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+
+from core import utils
+
+
+class CachedModelBackend(ModelBackend):
+    """A ModelBackend that caches the User loaded on each authenticated request for
+    USER_CACHE_TIMEOUT seconds. User.save() and User.delete() evict it, and publish the
+    eviction to other processes, so it is only cached if the cache is shared or
+    INVALIDATION_BUS_ENABLED is set. The session auth hash is still verified against the
+    cached User by django.contrib.auth.get_user, so changing a password still logs out
+    other sessions."""
+
+    def get_user(self, user_id):
+        if not utils.cache_invalidated_everywhere():
+            return super().get_user(user_id)
+
+        key = utils.get_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        if not utils.cache_invalidated_everywhere():
+            return await super().aget_user(user_id)
+
+        key = utils.get_user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+
+class LatencyEmailBackend(BaseEmailBackend):
+    """A local stand-in for a provider's email backend, e.g., Postmark's, to benchmark sending
+    throughput offline. Opening a connection and each send_messages() call (one request to
+    the provider) take EMAIL_BACKEND_CONNECT_LATENCY and EMAIL_BACKEND_REQUEST_LATENCY
+    seconds. Like Postmark's backend with POSTMARK_RETURN_MESSAGE_ID, it returns message ids."""
+
+    # For comparing how many connections different ways of sending open.
+    connections_opened = 0
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.connection = None
+
+    def open(self):
+        if self.connection is not None:
+            return False
+        time.sleep(settings.EMAIL_BACKEND_CONNECT_LATENCY)
+        self.connection = object()
+        LatencyEmailBackend.connections_opened += 1
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return []
+        new_connection = self.open()
+        try:
+            for message in email_messages:
+                # Serialize it like a real backend would.
+                message.message()
+            time.sleep(settings.EMAIL_BACKEND_REQUEST_LATENCY)
+            return [str(uuid4()) for _ in email_messages]
+        finally:
+            if new_connection:
+                self.close()
@@ -1,9 +1,9 @@
 import logging
 
-from core.middleware import local
+from core.middleware import request_id_var
 
 
 class RequestIDFilter(logging.Filter):
     def filter(self, record):
-        record.request_id = getattr(local, "request_id", "none")
+        record.request_id = request_id_var.get()
         return True
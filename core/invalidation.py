@@ -0,0 +1,135 @@
+"""
+Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+In-process caches (e.g., the GlobalSetting snapshot) are stale in every other gunicorn
+worker and Celery process once a model changes. model_create, model_update and
+model_delete publish the changed instance's model and pk on a NOTIFY channel, and each
+process runs a listener thread that calls the handlers registered for that model.
+
+Postgres only delivers a NOTIFY once its transaction commits, so handlers never see
+uncommitted data. Enable with INVALIDATION_BUS_ENABLED.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, Type
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.db import models
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "core_invalidation"
+
+Handler = Callable[..., None]
+
+_handlers: dict[str, list[tuple[Handler, tuple[str, ...]]]] = defaultdict(list)
+_fields: dict[str, set[str]] = defaultdict(set)
+_listener: threading.Thread | None = None
+
+# Identifies the messages this process published. Not the pid, since processes in other
+# containers or on other hosts may have the same one.
+_process_id = uuid4().hex
+
+
+def register(
+    model: Type[models.Model],
+    handler: Handler,
+    fields: Iterable[str] = (),
+) -> None:
+    """Call handler with the pk of every instance of model that another process changes
+    or deletes, and the instance's values of fields as keyword arguments, since a
+    deleted instance can no longer be queried."""
+    label = model._meta.label_lower
+    fields = tuple(fields)
+    _handlers[label].append((handler, fields))
+    _fields[label].update(fields)
+
+
+def is_enabled() -> bool:
+    return settings.INVALIDATION_BUS_ENABLED and connection.vendor == "postgresql"
+
+
+def publish(instance: models.Model) -> None:
+    """Notify every process that instance changed. Sent when the transaction commits,
+    so publish a deletion before instance.delete() clears its pk."""
+    label = instance._meta.label_lower
+    if not is_enabled() or label not in _handlers:
+        return
+
+    payload = json.dumps(
+        {
+            "model": label,
+            "pk": instance.pk,
+            "fields": {field: getattr(instance, field) for field in _fields[label]},
+            "process": _process_id,
+        }
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+def dispatch(payload: str) -> None:
+    """Call the handlers registered for the model in a NOTIFY payload."""
+    message = json.loads(payload)
+
+    # The publishing process invalidated its own caches already.
+    if message["process"] == _process_id:
+        return
+
+    for handler, fields in _handlers.get(message["model"], []):
+        try:
+            handler(
+                message["pk"], **{field: message["fields"][field] for field in fields}
+            )
+        except Exception:
+            logger.exception(f"Invalidation handler failed for {message}")
+
+
+def _listen() -> None:
+    while True:
+        try:
+            # A dedicated connection since notifies() blocks.
+            wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+            raw = wrapper.get_new_connection(wrapper.get_connection_params())
+            raw.autocommit = True
+            raw.execute(f"LISTEN {CHANNEL}")
+            logger.info(f"Listening for invalidations on {CHANNEL}")
+
+            for notify in raw.notifies():
+                # Handlers may query the database from this thread.
+                close_old_connections()
+                dispatch(notify.payload)
+        except Exception:
+            logger.exception("Invalidation listener disconnected, reconnecting")
+            time.sleep(5)
+
+
+def start_listener() -> None:
+    """Start this process's listener thread if it isn't running already."""
+    global _listener
+    if not is_enabled() or (_listener is not None and _listener.is_alive()):
+        return
+
+    _listener = threading.Thread(
+        target=_listen, name="invalidation-listener", daemon=True
+    )
+    _listener.start()
+
+
+def _reset_after_fork() -> None:
+    """Threads don't survive a fork, e.g., gunicorn --preload or Celery prefork workers."""
+    global _listener, _process_id
+    _process_id = uuid4().hex
+    if _listener is not None:
+        _listener = None
+        start_listener()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import services
+
+
+class Command(BaseCommand):
+    help = "Create missing OrgSetting, OrgUserSetting, PlanOrgSetting and OrgUserSettingDefault rows in bulk."
+
+    def handle(self, *args, **options):
+        services.setting_defaults_materialize()
+        self.stdout.write(self.style.SUCCESS("Materialized setting defaults."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import services
+
+
+class Command(BaseCommand):
+    help = "Rebuild every EffectiveOrgSetting and EffectiveOrgUserSetting from scratch."
+
+    def handle(self, *args, **options):
+        services.effective_settings_rebuild()
+        self.stdout.write(self.style.SUCCESS("Rebuilt effective settings."))
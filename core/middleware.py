@@ -1,53 +1,149 @@
+import cProfile
 import logging
-import threading
+import time
 import uuid
+from contextvars import ContextVar
 
 import pytz
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from inertia import share as inertia_share
-from django.apps import apps
 from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.cache import add_never_cache_headers
+from django.utils.functional import SimpleLazyObject
 
 logger = logging.getLogger(__name__)
-local = threading.local()
 
+# A ContextVar rather than a thread local so each request under ASGI sees its own id.
+request_id_var: ContextVar[str] = ContextVar("request_id", default="none")
+
+
+class BaseMiddleware:
+    """A middleware that runs natively under both WSGI and ASGI, so Django doesn't
+    hop between threads around it. process_request and process_response run on the
+    event loop under ASGI and must not block, e.g., query the database. Middlewares
+    that do block override __acall__."""
+
+    sync_capable = True
+    async_capable = True
 
-# Inspired by https://github.com/dabapps/django-log-request-id/blob/284a264616c582f9d93263bd5d2be67b29996ca0/log_request_id/middleware.py
-class RequestIDMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        request_id = self._get_request_id(request)
-        request.id = request_id
-        local.request_id = request_id
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.process_request(request)
         response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_request(self, request):
+        pass
+
+    def process_response(self, request, response):
+        return response
 
+
+class FastPathMiddleware(BaseMiddleware):
+    """Serve health_check/ and robots.txt without the rest of the middleware, i.e., no
+    session, auth or database. The load balancer hits health_check/ several times a second.
+    Should come right after SecurityMiddleware, so the HTTPS redirect and security headers
+    still apply. Hosts in HOST_URLCONFS are left to their urlconf, and the default
+    urlconf's routes remain as a fallback."""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # robots.txt has no context, so it's rendered once per process.
+        self.robots_txt = render_to_string("core/robots.txt")
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_fast_response(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self.get_fast_response(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    def get_fast_response(self, request):
+        if settings.HOST_URLCONFS and request.get_host() in settings.HOST_URLCONFS:
+            return None
+        if request.path_info == "/health_check/":
+            return HttpResponse("")
+        if request.path_info == "/robots.txt":
+            return HttpResponse(self.robots_txt, content_type="text/plain")
+        return None
+
+
+# Inspired by https://github.com/dabapps/django-log-request-id/blob/284a264616c582f9d93263bd5d2be67b29996ca0/log_request_id/middleware.py
+class RequestIDMiddleware(BaseMiddleware):
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.process_request(request)
+        response = self.get_response(request)
+        return self.process_response(
+            request, response, token, user=getattr(request, "user", None)
+        )
+
+    async def __acall__(self, request):
+        token = self.process_request(request)
+        response = await self.get_response(request)
+        user = getattr(request, "user", None)
+        if isinstance(user, SimpleLazyObject) and hasattr(request, "auser"):
+            # Evaluating the lazy User would query the database from the event loop.
+            user = await request.auser()
+        return self.process_response(request, response, token, user=user)
+
+    def process_request(self, request):
+        request.id = self._get_request_id(request)
+        return request_id_var.set(request.id)
+
+    def process_response(self, request, response, token, *, user):
         # Don't log favicon
         if "favicon" not in request.path and "health_check" not in request.path:
             # If an unhandled exception is raised in the view, this will never log.
             # But django.request will log at WARNING OR ERROR level, so it's okay.
-            self.log_request_id(request, response)
+            self.log_request_id(request, response, user=user)
 
         if settings.REQUEST_ID_HEADER:
             response[settings.REQUEST_ID_HEADER] = request.id
 
-        del local.request_id
+        request_id_var.reset(token)
 
         return response
 
-    def log_request_id(self, request, response):
+    def log_request_id(self, request, response, *, user):
         msg = f"method={request.method} path={request.path} status={response.status_code} "
         ip = request.META["REMOTE_ADDR"]
         msg += f"ip={ip} "
 
-        user = getattr(request, "user", None)
         if user:
             msg += f"User.id={user.id}"
         else:
             msg += "User.id=none"
 
+        # Set by QueryStatsMiddleware, if it's installed.
+        query_stats = getattr(request, "query_stats", None)
+        if query_stats:
+            msg += f" {query_stats}"
+
         logger.info(msg)
 
     def _get_request_id(self, request):
@@ -60,7 +156,99 @@ class RequestIDMiddleware:
             return uuid.uuid4().hex
 
 
-class SetRemoteAddrFromForwardedFor:
+class QueryStats:
+    """The number of SQL queries of a request, the total time spent on them and the
+    slowest one."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+    def __str__(self):
+        return (
+            f"queries={self.count} db_ms={self.duration * 1000:.1f} "
+            f"slowest_ms={self.slowest_duration * 1000:.1f}"
+        )
+
+
+query_stats_var: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    query_stats = query_stats_var.get()
+    if query_stats is None:
+        return execute(sql, params, many, context)
+    return query_stats(execute, sql, params, many, context)
+
+
+def _install_record_query(*, connection, **kwargs):
+    # Installed on every connection rather than per request since, under ASGI, queries
+    # run on connections of other threads. The ContextVar follows them there.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class QueryStatsMiddleware(BaseMiddleware):
+    """Record the SQL queries of each request for RequestIDMiddleware to log, and warn
+    when a route runs more queries than its budget in QUERY_BUDGETS (keyed by url name)
+    or QUERY_BUDGET_DEFAULT. Should come right after RequestIDMiddleware."""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        connection_created.connect(
+            _install_record_query, dispatch_uid="core.middleware.query_stats"
+        )
+        # Connections that were opened before this middleware was loaded.
+        _install_record_query(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.process_request(request)
+        response = self.get_response(request)
+        return self.process_response(request, response, token)
+
+    async def __acall__(self, request):
+        token = self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response, token)
+
+    def process_request(self, request):
+        request.query_stats = QueryStats()
+        return query_stats_var.set(request.query_stats)
+
+    def process_response(self, request, response, token):
+        query_stats_var.reset(token)
+        query_stats = request.query_stats
+
+        match = request.resolver_match
+        route = match.view_name if match else None
+        budget = settings.QUERY_BUDGETS.get(route, settings.QUERY_BUDGET_DEFAULT)
+        if budget is not None and query_stats.count > budget:
+            logger.warning(
+                f"Query budget exceeded route={route} path={request.path} "
+                f"queries={query_stats.count} budget={budget} "
+                f"slowest_sql={(query_stats.slowest_sql or '')[:200]!r}"
+            )
+
+        return response
+
+
+class SetRemoteAddrFromForwardedFor(BaseMiddleware):
     """
     Middleware that sets REMOTE_ADDR based on HTTP_X_FORWARDED_FOR, if the
     latter is set.
@@ -70,10 +258,7 @@ class SetRemoteAddrFromForwardedFor:
     originating IP address: https://stackoverflow.com/a/37061471
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def process_request(self, request):
         try:
             real_ip = request.META["HTTP_X_FORWARDED_FOR"]
         except KeyError:
@@ -91,146 +276,262 @@ class SetRemoteAddrFromForwardedFor:
                 real_ip = real_ip.split(",")[-1].strip()
                 request.META["REMOTE_ADDR"] = real_ip
 
-        return self.get_response(request)
-
 
-class TimezoneMiddleware:
+class TimezoneMiddleware(BaseMiddleware):
     """If the user has a timezone in their session, activate it."""
 
-    def __init__(self, get_response):
-        self.get_response = get_response
+    async def __acall__(self, request):
+        # The User and the session are loaded from the database.
+        user = await request.auser()
+        tz = (
+            await request.session.aget("detected_tz") if user.is_authenticated else None
+        )
+        self._activate(tz)
+        return await self.get_response(request)
 
-    def __call__(self, request):
+    def process_request(self, request):
         tz = None
 
         if request.user.is_authenticated:
             tz = request.session.get("detected_tz")
 
+        self._activate(tz)
+
+    @staticmethod
+    def _activate(tz):
         if tz:
             timezone.activate(pytz.timezone(tz))
         else:
             timezone.deactivate()
 
-        return self.get_response(request)
 
-
-class DisableClientCacheMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        response = self.get_response(request)
+class DisableClientCacheMiddleware(BaseMiddleware):
+    def process_response(self, request, response):
         add_never_cache_headers(response)
         return response
 
 
-class HostUrlconfMiddleware:
+class HostUrlconfMiddleware(BaseMiddleware):
     """ALT_URLCONF defines alternative urlconfs available based on an exact host match."""
 
     # N.B. If wildcard / subdomain matching becomes necessary to add, it should not be difficult.
     # I don't need it yet and can avoid a regex matching performance penalty on every request.
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def process_request(self, request):
         urlconf = settings.HOST_URLCONFS.get(request.get_host())
         if urlconf:
             request.urlconf = urlconf
 
-        response = self.get_response(request)
-        return response
 
+class OrgContext:
+    """The Org and OrgUser of a request along with the user's other active Orgs,
+    resolved together from the user's memberships in a single query."""
 
-class OrgMiddleware:
+    def __init__(self, *, org_users, domain, slug=None):
+        # Most recently accessed first.
+        self.org_users = org_users = sorted(
+            org_users, key=lambda ou: ou.last_accessed_at, reverse=True
+        )
+        on_domain = [ou for ou in org_users if ou.org.domain == domain]
+
+        # If the org in the session matches the domain, use that org.
+        # Otherwise, use the most recently accessed org on the domain, if any.
+        self.org_user = next((ou for ou in on_domain if ou.org.slug == slug), None)
+        if self.org_user is None and on_domain:
+            self.org_user = on_domain[0]
+
+        self.org = self.org_user.org if self.org_user else None
+        self.orgs = sorted(
+            (ou.org for ou in org_users), key=lambda org: (org.name, org.slug)
+        )
+
+    @property
+    def available_orgs(self):
+        """The user's active Orgs other than the request's Org."""
+        return [org for org in self.orgs if org != self.org]
+
+
+class OrgMiddleware(BaseMiddleware):
     """Assign the org to the request based on the domain."""
 
     # If the org in the session matches the domain, use that org.
     # If the org in the session does not match the domain, act like there is no org in the session.
     # If there's no org in the session use the most recently accessed org that matches the domain.
 
-    def __init__(self, get_response):
-        self.get_response = get_response
+    async def __acall__(self, request):
+        # Both halves query the database, so they run in a thread.
+        await sync_to_async(self.process_request)(request)
+        response = await self.get_response(request)
+        return await sync_to_async(self.process_response)(request, response)
+
+    def process_request(self, request):
+        import core.selectors
 
-    def __call__(self, request):
-        Org = apps.get_model("core", "Org")
         request.org = None
+        request.org_context = None
 
         # Only assign Orgs for authenticated users
         if request.user.is_authenticated:
-            import core.selectors
+            import core.services
 
+            # There's no Org to assign on a domain without active Orgs, e.g., the admin's,
+            # so don't load the user's memberships.
             domain = request.get_host()
-
-            # If there's an org in the session and it matches the domain, use it.
-            # If the org in the session does not match the domain, we ignore the org in the session.
-            slug = request.session.get("org_slug")
-            if slug:
-                org = Org.objects.filter(
-                    slug=slug, users=request.user, is_active=True, domain=domain
-                ).first()
-                if org:
-                    request.org = org
-
-            if request.org is None:
-                # Otherwise, use the user's default org, if any.
-                try:
-                    request.org = core.selectors.org_get_recent_for_user(
-                        request.user, domain
-                    )
-                except Org.DoesNotExist:
-                    pass  # Leave request.org as None if the user has no orgs.
+            if core.services.org_get_ids_for_domain(domain=domain):
+                org_users = list(
+                    core.selectors.org_user_list(
+                        user=request.user, org__is_active=True
+                    ).select_related("org")
+                )
+                # Accesses that haven't been flushed to the database yet.
+                core.services.org_user_apply_buffered_access(org_users=org_users)
+                request.org_context = OrgContext(
+                    org_users=org_users,
+                    domain=domain,
+                    slug=request.session.get("org_slug"),
+                )
+                request.org = request.org_context.org
 
             # Add org and available_orgs props to all inertia pages
             inertia_share(request, org=lambda: request.org)
-
-            available_orgs = core.selectors.org_list(users=request.user, is_active=True)
-            if request.org:
-                available_orgs = available_orgs.exclude(slug=request.org.slug)
+            # Only evaluated if the page includes it, e.g., not on partial reloads without it.
             inertia_share(
                 request,
-                available_orgs=lambda: available_orgs,
+                available_orgs=lambda: core.services.user_get_available_orgs(
+                    user=request.user,
+                    exclude=request.org,
+                    orgs=request.org_context.orgs if request.org_context else None,
+                ),
             )
         else:
             # Make sure the props are set for the client even if the user is not authenticated.
             inertia_share(request, org=lambda: None)
             inertia_share(request, available_orgs=lambda: [])
 
-        response = self.get_response(request)
+    def process_response(self, request, response):
+        import core.selectors
 
         # If there's no longer a user (e.g., on logout or user delete),
         # remove the org.
         if not request.user.is_authenticated:
             request.org = None
-            request.session["org_slug"] = None
+            self._set_session_org_slug(request, None)
+
+        ou = None
+        if request.org is not None:
+            if (
+                request.org_context is not None
+                and request.org == request.org_context.org
+                and request.method in ("GET", "HEAD", "OPTIONS")
+            ):
+                # Safe requests don't change memberships, so reuse the OrgUser.
+                ou = request.org_context.org_user
+            else:
+                ou = core.selectors.org_user_list(
+                    org=request.org, user=request.user
+                ).first()
 
         # If there's no longer an org user (e.g., the org user was deleted),
         # remove the org
-        if request.org and not request.org.org_users.filter(user=request.user).exists():
+        if request.org and ou is None:
             request.org = None
-            request.session["org_slug"] = None
+            self._set_session_org_slug(request, None)
 
         if request.org is not None:
             # Set it on the session
-            request.session["org_slug"] = request.org.slug
+            self._set_session_org_slug(request, request.org.slug)
 
             # Set the last accessed time
-            ou = request.org.org_users.get(user=request.user)
             import core.services
 
-            core.services.org_user_update(instance=ou, last_accessed_at=timezone.now())
+            others = request.org_context.org_users if request.org_context else []
+            core.services.org_user_record_access(
+                org_user=ou, others=[other for other in others if other != ou]
+            )
 
         return response
 
+    @staticmethod
+    def _set_session_org_slug(request, slug):
+        # Assigning marks the session modified, which rewrites it, so only do that on a change.
+        if request.session.get("org_slug") != slug:
+            request.session["org_slug"] = slug
 
-class InertiaUserMiddleware:
-    """Provide the user and org, if set, to all Inertia templates.""" ""
 
-    def __init__(self, get_response):
-        self.get_response = get_response
+class RequestProfileMiddleware(BaseMiddleware):
+    """Profile a request with cProfile when a staff user sends the REQUEST_PROFILE_HEADER
+    header or the REQUEST_PROFILE_PARAM query parameter. The profile is stored as a
+    RequestProfile, downloadable from the admin. Should come last so it profiles the view."""
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._is_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time, e.g., in another thread.
+            logger.warning(
+                f"Request not profiled, already profiling path={request.path}"
+            )
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        self._save(request, response, profiler, time.perf_counter() - start)
+
+        return response
+
+    async def __acall__(self, request):
+        if not self._is_requested(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+
+        # The profile also includes anything else running on the event loop meanwhile.
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            logger.warning(
+                f"Request not profiled, already profiling path={request.path}"
+            )
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        await sync_to_async(self._save)(
+            request, response, profiler, time.perf_counter() - start
+        )
+
+        return response
+
+    @staticmethod
+    def _is_requested(request):
+        return (
+            settings.REQUEST_PROFILE_HEADER in request.headers
+            or settings.REQUEST_PROFILE_PARAM in request.GET
+        )
+
+    @staticmethod
+    def _save(request, response, profiler, duration):
+        import core.services
+
+        core.services.request_profile_create_from_request(
+            request=request, response=response, profiler=profiler, duration=duration
+        )
+
+
+class InertiaUserMiddleware(BaseMiddleware):
+    """Provide the user and org, if set, to all Inertia templates.""" ""
+
+    def process_request(self, request):
         inertia_share(
             request, user=lambda: request.user.is_authenticated and request.user or None
         )
-
-        return self.get_response(request)
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0003_effective_settings"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="org",
+            name="domain",
+            field=models.CharField(
+                db_index=True,
+                help_text="The domain used to access the org on the web.",
+                max_length=254,
+            ),
+        ),
+    ]
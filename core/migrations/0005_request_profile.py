@@ -0,0 +1,84 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:50
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0004_org_domain_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "uuid",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="Secondary ID",
+                        unique=True,
+                        verbose_name="UUID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("request_id", models.CharField(db_index=True, max_length=254)),
+                ("method", models.CharField(max_length=16)),
+                ("path", models.CharField(max_length=2048)),
+                ("status_code", models.PositiveSmallIntegerField()),
+                (
+                    "duration",
+                    models.FloatField(
+                        help_text="Total time of the request in seconds."
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        help_text="pstats dump, e.g., for python -m pstats or snakeviz.",
+                        upload_to="request_profiles/",
+                    ),
+                ),
+                (
+                    "summary",
+                    models.TextField(
+                        blank=True,
+                        help_text="The slowest functions by cumulative time.",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="Staff User that requested the profile.",
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-17 06:56
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Built concurrently so that writes to EmailMessage aren't locked meanwhile, which
+    # can't be done in a transaction.
+    atomic = False
+
+    dependencies = [
+        ("core", "0005_request_profile"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="emailmessage",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", False)),
+                fields=["to_email", "created_by", "template_prefix", "sent_at"],
+                name="email_message_cooldown_to_by",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="emailmessage",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", False)),
+                fields=["to_email", "template_prefix", "sent_at"],
+                name="email_message_cooldown_to_tmpl",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="emailmessage",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", False)),
+                fields=["created_by", "template_prefix", "sent_at"],
+                name="email_message_cooldown_by",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="emailmessage",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", False)),
+                fields=["template_prefix", "sent_at"],
+                name="email_message_cooldown_tmpl",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="emailmessage",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", False)),
+                fields=["sent_at"],
+                name="email_message_cooldown_sent",
+            ),
+        ),
+    ]
@@ -3,27 +3,37 @@ from django.contrib.auth.mixins import UserPassesTestMixin, LoginRequiredMixin
 from django.core.exceptions import ImproperlyConfigured
 from django.shortcuts import redirect
 
-from core import services, selectors
+from core import services
 
 
 class OrgUserSettingPermissionMixin(UserPassesTestMixin):
+    """Require an OrgUserSetting, or every one of several OrgUserSettings, to be truthy."""
+
     org_user_setting: typing.Optional[str] = None
+    org_user_settings: typing.Optional[typing.Iterable[str]] = None
+
+    def get_org_user_settings(self) -> list[str]:
+        slugs = list(self.org_user_settings or [])
+        if self.org_user_setting is not None:
+            slugs.insert(0, self.org_user_setting)
+        return slugs
 
     def test_func(self):
-        if self.org_user_setting is None:
+        slugs = self.get_org_user_settings()
+        if not slugs:
             raise ImproperlyConfigured(
-                "%(cls)s is missing org_user_setting."
+                "%(cls)s is missing org_user_setting or org_user_settings."
                 % {"cls": self.__class__.__name__}
             )
 
-        org_user = selectors.org_user_list(
-            user=self.request.user, org=self.request.org
-        ).get()
-
-        # For now, we just return the truthiness of the setting but we can do value matching if it becomes necessary.
-        return services.org_user_get_setting_value(
-            org_user=org_user, slug=self.org_user_setting
+        # For now, we just check the truthiness of the settings but we can do value matching if it becomes necessary.
+        permissions = services.org_user_get_permissions(
+            org=self.request.org,
+            user=self.request.user,
+            slugs=slugs,
+            request=self.request,
         )
+        return all(permissions.values())
 
 
 class OrgRequiredMixin:
@@ -10,7 +10,7 @@ from django.db.models.functions import Lower
 from django.utils import timezone
 from django_extensions.db.fields import AutoSlugField
 
-from core import constants, utils, fields
+from core import constants, utils, fields, invalidation
 
 logger = logging.getLogger(__name__)
 
@@ -123,6 +123,38 @@ class EmailMessage(BaseModel):
     )
     error_message = models.TextField(blank=True)
 
+    class Meta:
+        # For email_message_check_cooling_down. Each combination of its scopes, including
+        # none, filters on a prefix of one of these. Unsent EmailMessages are never
+        # counted, so they're left out.
+        indexes = [
+            models.Index(
+                fields=["to_email", "created_by", "template_prefix", "sent_at"],
+                name="email_message_cooldown_to_by",
+                condition=models.Q(sent_at__isnull=False),
+            ),
+            models.Index(
+                fields=["to_email", "template_prefix", "sent_at"],
+                name="email_message_cooldown_to_tmpl",
+                condition=models.Q(sent_at__isnull=False),
+            ),
+            models.Index(
+                fields=["created_by", "template_prefix", "sent_at"],
+                name="email_message_cooldown_by",
+                condition=models.Q(sent_at__isnull=False),
+            ),
+            models.Index(
+                fields=["template_prefix", "sent_at"],
+                name="email_message_cooldown_tmpl",
+                condition=models.Q(sent_at__isnull=False),
+            ),
+            models.Index(
+                fields=["sent_at"],
+                name="email_message_cooldown_sent",
+                condition=models.Q(sent_at__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         # This will return something like 'reset-password' since its the last part of the template prefix
         template_prefix = self.template_prefix.split("/")[-1]
@@ -206,7 +238,9 @@ class Org(BaseModel):
     # If we implement multi-tenant architecture, we would want to make domain
     # it's own model (OrgDomain) to avoid the risk that two orgs on the same domain are on different tenants.
     domain = models.CharField(
-        max_length=254, help_text="The domain used to access the org on the web."
+        max_length=254,
+        db_index=True,
+        help_text="The domain used to access the org on the web.",
     )
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="owned_orgs"
@@ -408,6 +442,23 @@ class User(AbstractUser):
         # the default authentication backend.
         return (self.email,)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Evict the copy cached for authentication (see core.backends) here and in other
+        # processes so that changes, e.g., to the password or is_active, apply to the
+        # next request. Done here rather than in model_update since Django saves Users
+        # itself, e.g., on login, password change and password reset.
+        utils.user_cache_evict(self.pk)
+        invalidation.publish(self)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        # Published first since delete() clears the pk.
+        invalidation.publish(self)
+        result = super().delete(*args, **kwargs)
+        utils.user_cache_evict(pk)
+        return result
+
 
 # -- SETTINGS: GLOBAL, ORG, ORGUSERS -- #
 
@@ -594,3 +645,88 @@ class OrgUserSettingDefault(BaseModel):
 
     def clean(self):
         check_setting_type(self.value, "value", self.setting.type)
+
+
+class EffectiveOrgSetting(BaseModel):
+    """The resolved value of an OrgSetting for an Org. This is a projection maintained by
+    the services and should never be edited directly."""
+
+    org = models.ForeignKey(
+        "core.Org", on_delete=models.CASCADE, related_name="effective_org_settings"
+    )
+    setting = models.ForeignKey(
+        "core.OrgSetting",
+        on_delete=models.CASCADE,
+        related_name="effective_org_settings",
+    )
+    value = models.CharField(max_length=254)
+    expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the Org's primary_plan expires and the value must be recomputed.",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["org", "setting"], name="unique_effective_org_setting"
+            )
+        ]
+
+    def __str__(self):
+        return f"EffectiveOrgSetting: {self.org_id} / {self.setting_id} ({self.pk})"
+
+
+class EffectiveOrgUserSetting(BaseModel):
+    """The resolved value of an OrgUserSetting for an OrgUser. This is a projection maintained
+    by the services and should never be edited directly."""
+
+    org_user = models.ForeignKey(
+        "core.OrgUser",
+        on_delete=models.CASCADE,
+        related_name="effective_org_user_settings",
+    )
+    setting = models.ForeignKey(
+        "core.OrgUserSetting",
+        on_delete=models.CASCADE,
+        related_name="effective_org_user_settings",
+    )
+    value = models.CharField(max_length=254)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["org_user", "setting"], name="unique_effective_org_user_setting"
+            )
+        ]
+
+    def __str__(self):
+        return f"EffectiveOrgUserSetting: {self.org_user_id} / {self.setting_id} ({self.pk})"
+
+
+class RequestProfile(BaseModel):
+    """A cProfile of a single request, recorded on demand by a staff user. See
+    core.middleware.RequestProfileMiddleware."""
+
+    request_id = models.CharField(max_length=254, db_index=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        help_text="Staff User that requested the profile.",
+        null=True,
+        blank=True,
+    )
+    method = models.CharField(max_length=16)
+    path = models.CharField(max_length=2048)
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text="Total time of the request in seconds.")
+    file = models.FileField(
+        upload_to="request_profiles/",
+        help_text="pstats dump, e.g., for python -m pstats or snakeviz.",
+    )
+    summary = models.TextField(
+        blank=True, help_text="The slowest functions by cumulative time."
+    )
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.request_id})"
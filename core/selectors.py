@@ -1,9 +1,25 @@
-from typing import Type
+from datetime import datetime
+from typing import Iterable, Optional, Type
 
 from django.contrib.auth import get_user_model
-from django.db.models import QuerySet
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 
+from core import constants, utils
 from core.types import BaseModelType, UserType
 
 from .models import (
@@ -20,12 +36,22 @@ from .models import (
     EmailMessage,
     EmailMessageAttachment,
     EmailMessageWebhook,
+    EffectiveOrgSetting,
+    EffectiveOrgUserSetting,
     Event,
 )
 
 User = get_user_model()
 
 
+def effective_org_setting_list(**kwargs) -> QuerySet[EffectiveOrgSetting]:
+    return model_list(klass=EffectiveOrgSetting, **kwargs)
+
+
+def effective_org_user_setting_list(**kwargs) -> QuerySet[EffectiveOrgUserSetting]:
+    return model_list(klass=EffectiveOrgUserSetting, **kwargs)
+
+
 def email_message_list(**kwargs) -> QuerySet[EmailMessage]:
     return model_list(klass=EmailMessage, **kwargs)
 
@@ -46,10 +72,83 @@ def global_setting_list(**kwargs) -> QuerySet[GlobalSetting]:
     return model_list(klass=GlobalSetting, **kwargs)
 
 
+def global_setting_get_version() -> tuple[int, Optional[datetime]]:
+    """A cheap stamp that changes whenever a GlobalSetting is created, updated or deleted."""
+    version = global_setting_list().aggregate(
+        count=Count("pk"), updated_at=Max("updated_at")
+    )
+    return version["count"], version["updated_at"]
+
+
 def org_list(**kwargs) -> QuerySet[Org]:
     return model_list(klass=Org, **kwargs)
 
 
+def org_list_on_plan(*, plan: Plan) -> QuerySet[Org]:
+    """Orgs that use a Plan as either their primary_plan or default_plan."""
+    return org_list(q=Q(primary_plan=plan) | Q(default_plan=plan))
+
+
+def org_list_with_setting_value(*, slug: str, **kwargs) -> QuerySet[Org]:
+    """Orgs annotated with the value of an OrgSetting that applies to each of them as
+    setting_value. The value is computed in SQL and cast to the OrgSetting's type so it
+    can be filtered on, e.g., setting_value=True or setting_value__gt=10."""
+    orgs = org_list(**kwargs)
+
+    try:
+        setting = org_setting_list(slug=slug).get()
+    except OrgSetting.DoesNotExist:
+        # Every Org has the default if the OrgSetting doesn't exist.
+        default_config = utils.get_org_setting_default_config(slug)
+        return _annotate_setting_value(
+            orgs.annotate(setting_raw_value=Value(default_config["default"])),
+            type=default_config["type"],
+        )
+
+    return org_annotate_setting_value(orgs=orgs, setting=setting)
+
+
+def org_annotate_setting_value(
+    *, orgs: QuerySet[Org], setting: OrgSetting
+) -> QuerySet[Org]:
+    """Annotate Orgs with the uncast (setting_raw_value) and cast (setting_value) value
+    of an OrgSetting that applies to each of them."""
+    # The same primary_plan / default_plan switch as org_get_plan.
+    orgs = orgs.annotate(
+        active_plan_id=Case(
+            When(current_period_end__lt=timezone.now(), then=F("default_plan_id")),
+            default=F("primary_plan_id"),
+        )
+    )
+    overridden_value = overridden_org_setting_list(
+        org=OuterRef("pk"), setting=setting
+    ).values("value")[:1]
+    plan_value = plan_org_setting_list(
+        plan=OuterRef("active_plan_id"), setting=setting
+    ).values("value")[:1]
+    orgs = orgs.annotate(
+        setting_raw_value=Coalesce(
+            Subquery(overridden_value), Subquery(plan_value), Value(setting.default)
+        )
+    )
+    return _annotate_setting_value(orgs, type=setting.type)
+
+
+def _annotate_setting_value(qs: QuerySet, *, type: str) -> QuerySet:
+    """Annotate setting_value by casting setting_raw_value to the setting type in SQL."""
+    if type == constants.SettingType.BOOL:
+        setting_value = Case(
+            When(setting_raw_value__iexact="true", then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        )
+    elif type == constants.SettingType.INT:
+        setting_value = Cast("setting_raw_value", IntegerField())
+    else:
+        setting_value = F("setting_raw_value")
+    return qs.annotate(setting_value=setting_value)
+
+
 def org_user_list(**kwargs) -> QuerySet[OrgUser]:
     return model_list(klass=OrgUser, **kwargs)
 
@@ -61,6 +160,64 @@ def org_get_plan(*, org: Org) -> Plan:
     return org.primary_plan
 
 
+def org_get_plan_id(*, org: Org) -> int:
+    """Same as org_get_plan but returns the Plan's pk without loading the Plan."""
+    if org.current_period_end and timezone.now() > org.current_period_end:
+        return org.default_plan_id
+    return org.primary_plan_id
+
+
+def org_user_list_with_setting_value(*, slug: str, **kwargs) -> QuerySet[OrgUser]:
+    """OrgUsers annotated with the value of an OrgUserSetting that applies to each of them
+    as setting_value. The value is computed in SQL and cast to the OrgUserSetting's type."""
+    org_users = org_user_list(**kwargs)
+
+    try:
+        setting = org_user_setting_list(slug=slug).get()
+    except OrgUserSetting.DoesNotExist:
+        # Every OrgUser has the default (or owner_value) if the OrgUserSetting doesn't exist.
+        default_config = utils.get_org_user_setting_default_config(slug)
+        return _annotate_setting_value(
+            org_users.annotate(
+                setting_raw_value=Case(
+                    When(
+                        org__owner_id=F("user_id"),
+                        then=Value(default_config["owner_value"]),
+                    ),
+                    default=Value(default_config["default"]),
+                )
+            ),
+            type=default_config["type"],
+        )
+
+    return org_user_annotate_setting_value(org_users=org_users, setting=setting)
+
+
+def org_user_annotate_setting_value(
+    *, org_users: QuerySet[OrgUser], setting: OrgUserSetting
+) -> QuerySet[OrgUser]:
+    """Annotate OrgUsers with the uncast (setting_raw_value) and cast (setting_value) value
+    of an OrgUserSetting that applies to each of them."""
+    org_user_value = org_user_org_user_setting_list(
+        org_user=OuterRef("pk"), setting=setting
+    ).values("value")[:1]
+    org_default_value = org_user_setting_default_list(
+        org=OuterRef("org_id"), setting=setting
+    ).values("value")[:1]
+    org_users = org_users.annotate(
+        setting_raw_value=Case(
+            # The Org owner always gets the owner_value.
+            When(org__owner_id=F("user_id"), then=Value(setting.owner_value)),
+            default=Coalesce(
+                Subquery(org_user_value),
+                Subquery(org_default_value),
+                Value(setting.default),
+            ),
+        )
+    )
+    return _annotate_setting_value(org_users, type=setting.type)
+
+
 def org_user_setting_list(**kwargs) -> QuerySet[OrgUserSetting]:
     return model_list(klass=OrgUserSetting, **kwargs)
 
@@ -89,6 +246,28 @@ def org_setting_list(**kwargs) -> QuerySet[OrgSetting]:
     return model_list(klass=OrgSetting, **kwargs)
 
 
+def org_setting_list_with_values(
+    *, org: Org, slugs: Optional[Iterable[str]] = None
+) -> QuerySet[OrgSetting]:
+    """OrgSettings annotated with the uncast value that applies to an Org as resolved_value.
+    An OverriddenOrgSetting takes priority over the PlanOrgSetting, which takes priority
+    over the OrgSetting default."""
+    overridden_value = overridden_org_setting_list(
+        org=org, setting=OuterRef("pk")
+    ).values("value")[:1]
+    plan_value = plan_org_setting_list(
+        plan_id=org_get_plan_id(org=org), setting=OuterRef("pk")
+    ).values("value")[:1]
+    org_settings = org_setting_list()
+    if slugs is not None:
+        org_settings = org_settings.filter(slug__in=slugs)
+    return org_settings.annotate(
+        resolved_value=Coalesce(
+            Subquery(overridden_value), Subquery(plan_value), F("default")
+        )
+    )
+
+
 def user_list(**kwargs) -> QuerySet[UserType]:
     return User._default_manager.filter(**kwargs)
 
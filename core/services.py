@@ -14,39 +14,67 @@ Interacts with the database, other resources & other parts of your system.
 Does business logic - from simple model creation to complex cross-cutting concerns, to calling external services & tasks.
 """
 
+import cProfile
+import io
+import itertools
+import json
 import os
 import logging
+import marshal
+import math
 import mimetypes
+import pstats
+import threading
+import time
 import traceback
+from collections import defaultdict
 from datetime import datetime, timedelta
 from importlib import import_module
-from typing import IO, AnyStr, List, Optional, Type, Literal
+from types import MappingProxyType
+from typing import (
+    IO,
+    Any,
+    AnyStr,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Type,
+    Literal,
+)
 from uuid import uuid4
 import pytz
+import redis
 import requests
 
 from django.conf import settings
 from django.contrib.auth import get_user_model, login as django_login
+from django.core.cache import cache
 from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.files.storage import storages
+from django.core.mail import get_connection
 from django.core.mail.message import EmailMultiAlternatives, sanitize_address
 from django.core.management import call_command
-from django.db import models, transaction
-from django.db.models import QuerySet
-from django.http import HttpRequest
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Q, QuerySet, Value, When
+from django.http import HttpRequest, HttpResponse
 from django.template import TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.template.autoreload import get_template_directories
+from django.template.loader import get_template
 from django.utils import timezone
 from django.urls import reverse
 
-from . import constants, selectors, utils
+from . import constants, invalidation, selectors, utils
 from .exceptions import *
 from .models import (
     BaseModel,
     EmailMessage,
     EmailMessageAttachment,
     EmailMessageWebhook,
+    EffectiveOrgSetting,
+    EffectiveOrgUserSetting,
     Event,
     GlobalSetting,
     Org,
@@ -58,8 +86,14 @@ from .models import (
     OverriddenOrgSetting,
     Plan,
     PlanOrgSetting,
+    RequestProfile,
 )
 from .tasks import email_message_send as email_message_send_task
+from .tasks import email_message_send_batch as email_message_send_batch_task
+from .tasks import effective_org_setting_refresh as effective_org_setting_refresh_task
+from .tasks import (
+    effective_org_user_setting_refresh as effective_org_user_setting_refresh_task,
+)
 from .types import BaseModelType, DjangoModelType, UserType
 
 logger = logging.getLogger(__name__)
@@ -142,6 +176,168 @@ def event_update(instance: Event, **kwargs) -> Event:
     return model_update(instance=instance, **kwargs)
 
 
+def request_profile_create_from_request(
+    *,
+    request: HttpRequest,
+    response: HttpResponse,
+    profiler: cProfile.Profile,
+    duration: float,
+) -> RequestProfile:
+    """Store the profile of a request, keyed by its request id."""
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+
+    request_profile = request_profile_create(
+        request_id=request.id,
+        user=request.user,
+        method=request.method,
+        path=request.path[:2048],
+        status_code=response.status_code,
+        duration=duration,
+        # The same format as Stats.dump_stats().
+        file=ContentFile(marshal.dumps(stats.stats), name=f"{request.id}.prof"),
+        summary=summary.getvalue(),
+    )
+    logger.info(f"RequestProfile.id={request_profile.id} recorded")
+
+    return request_profile
+
+
+def request_profile_create(**kwargs) -> RequestProfile:
+    return model_create(klass=RequestProfile, **kwargs)
+
+
+def request_profile_delete(*, instance: RequestProfile) -> None:
+    """Delete a RequestProfile along with its file."""
+    instance.file.delete(save=False)
+    model_delete(instance=instance)
+
+
+_EMAIL_MESSAGE_COOLDOWN_SCOPE_FIELDS = {
+    "created_by": "created_by_id",
+    "template_prefix": "template_prefix",
+    "to": "to_email",
+}
+
+
+class _EmailMessageCooldownCounter:
+    """Sliding-window counters of sent EmailMessages held in this process. Each process
+    only counts what it sent itself, so the cooldown isn't global unless there is a
+    single process, e.g., in development or benchmarks."""
+
+    def __init__(self):
+        self._sent_at: defaultdict[str, list[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, *, keys: List[str], sent_at: float, retention: int) -> None:
+        with self._lock:
+            for key in keys:
+                self._sent_at[key] = [
+                    t for t in self._sent_at[key] if t > sent_at - retention
+                ] + [sent_at]
+
+    def count(self, *, keys: List[str], since: float) -> List[int]:
+        with self._lock:
+            return [sum(t > since for t in self._sent_at.get(key, [])) for key in keys]
+
+
+class _RedisEmailMessageCooldownCounter:
+    """Sliding-window counters of sent EmailMessages in Redis sorted sets scored by sent_at."""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def add(self, *, keys: List[str], sent_at: float, retention: int) -> None:
+        member = uuid4().hex
+        with self._redis.pipeline() as pipe:
+            for key in keys:
+                pipe.zadd(key, {member: sent_at})
+                pipe.zremrangebyscore(key, "-inf", sent_at - retention)
+                pipe.expire(key, retention)
+            pipe.execute()
+
+    def count(self, *, keys: List[str], since: float) -> List[int]:
+        with self._redis.pipeline() as pipe:
+            for key in keys:
+                pipe.zcount(key, f"({since}", "+inf")
+            return pipe.execute()
+
+
+_email_message_cooldown_counter: (
+    _EmailMessageCooldownCounter | _RedisEmailMessageCooldownCounter | None
+) = None
+
+
+def _email_message_cooldown_counter_get() -> (
+    _EmailMessageCooldownCounter | _RedisEmailMessageCooldownCounter | None
+):
+    """The counter that answers cooldown checks without SQL, if one is configured."""
+    global _email_message_cooldown_counter
+    url = settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_URL
+    if url is None:
+        return None
+    if _email_message_cooldown_counter is None:
+        if url == "memory://":
+            _email_message_cooldown_counter = _EmailMessageCooldownCounter()
+        else:
+            _email_message_cooldown_counter = _RedisEmailMessageCooldownCounter(url)
+    return _email_message_cooldown_counter
+
+
+def _email_message_cooldown_key(
+    *, email_message: EmailMessage, scopes: List[str]
+) -> str:
+    fields = [
+        field
+        for scope, field in _EMAIL_MESSAGE_COOLDOWN_SCOPE_FIELDS.items()
+        if scope in scopes
+    ]
+    values = json.dumps([getattr(email_message, field) for field in fields])
+    return f"core:email_message_cooldown:{','.join(fields)}:{values}"
+
+
+def _email_message_cooldown_counts(
+    *, email_messages: List[EmailMessage], period: int, scopes: List[str]
+) -> Optional[List[int]]:
+    """How many EmailMessages with the same scopes as each of email_messages were sent in
+    the last period seconds, according to the counter. None if there's no counter or it
+    doesn't go back that far."""
+    counter = _email_message_cooldown_counter_get()
+    if counter is None or period > settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_RETENTION:
+        return None
+    return counter.count(
+        keys=[
+            _email_message_cooldown_key(email_message=e, scopes=scopes)
+            for e in email_messages
+        ],
+        since=(timezone.now() - timedelta(seconds=period)).timestamp(),
+    )
+
+
+def email_message_cooldown_record(*, email_messages: List[EmailMessage]) -> None:
+    """Count sent EmailMessages in the cooldown counter, if one is configured, under every
+    combination of scopes."""
+    counter = _email_message_cooldown_counter_get()
+    if counter is None:
+        return
+
+    scope_combinations = [
+        list(scopes)
+        for r in range(len(_EMAIL_MESSAGE_COOLDOWN_SCOPE_FIELDS) + 1)
+        for scopes in itertools.combinations(_EMAIL_MESSAGE_COOLDOWN_SCOPE_FIELDS, r)
+    ]
+    for e in email_messages:
+        counter.add(
+            keys=[
+                _email_message_cooldown_key(email_message=e, scopes=scopes)
+                for scopes in scope_combinations
+            ],
+            sent_at=e.sent_at.timestamp(),
+            retention=settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_RETENTION,
+        )
+
+
 def email_message_check_cooling_down(
     *, email_message: EmailMessage, period: int, allowed: int, scopes: List[str]
 ) -> bool:
@@ -149,6 +345,13 @@ def email_message_check_cooling_down(
     You can tighten the suppression by removing scopes. An empty list will cancel if any email
     at all has been sent in the cooldown period."""
     e = email_message
+
+    counts = _email_message_cooldown_counts(
+        email_messages=[e], period=period, scopes=scopes
+    )
+    if counts is not None:
+        return counts[0] >= allowed
+
     cooldown_period = timedelta(seconds=period)
     email_messages = EmailMessage.objects.filter(
         sent_at__gt=timezone.now() - cooldown_period
@@ -163,8 +366,75 @@ def email_message_check_cooling_down(
     return email_messages.count() >= allowed
 
 
-def email_message_prepare(*, email_message: EmailMessage) -> None:
-    """Updates the context with defaults and other sanity checking"""
+def email_message_check_cooling_down_bulk(
+    *,
+    email_messages: List[EmailMessage],
+    period: int,
+    allowed: int,
+    scopes: List[str],
+) -> List[bool]:
+    """email_message_check_cooling_down for each of many EmailMessages in one grouped query.
+    Earlier EmailMessages in the list that aren't cooling down count as sent, since they
+    will be once queued."""
+    if not email_messages:
+        return []
+
+    counts = _email_message_cooldown_counts(
+        email_messages=email_messages, period=period, scopes=scopes
+    )
+    if counts is None:
+        counts = _email_message_sent_counts(
+            email_messages=email_messages, period=period, scopes=scopes
+        )
+
+    cooling_down = []
+    pending: defaultdict[str, int] = defaultdict(int)
+    for e, count in zip(email_messages, counts):
+        key = _email_message_cooldown_key(email_message=e, scopes=scopes)
+        is_cooling_down = count + pending[key] >= allowed
+        if not is_cooling_down:
+            pending[key] += 1
+        cooling_down.append(is_cooling_down)
+    return cooling_down
+
+
+def _email_message_sent_counts(
+    *, email_messages: List[EmailMessage], period: int, scopes: List[str]
+) -> List[int]:
+    """How many EmailMessages with the same scopes as each of email_messages were sent in
+    the last period seconds, in one grouped query."""
+    fields = [
+        field
+        for scope, field in _EMAIL_MESSAGE_COOLDOWN_SCOPE_FIELDS.items()
+        if scope in scopes
+    ]
+    sent = selectors.email_message_list(
+        sent_at__gt=timezone.now() - timedelta(seconds=period)
+    )
+    if not fields:
+        return [sent.count()] * len(email_messages)
+
+    for field in fields:
+        values = {getattr(e, field) for e in email_messages}
+        q = Q(**{f"{field}__in": values - {None}})
+        if None in values:
+            q |= Q(**{f"{field}__isnull": True})
+        sent = sent.filter(q)
+
+    counts = {
+        tuple(row[field] for field in fields): row["count"]
+        for row in sent.order_by().values(*fields).annotate(count=Count("pk"))
+    }
+    return [
+        counts.get(tuple(getattr(e, field) for field in fields), 0)
+        for e in email_messages
+    ]
+
+
+def email_message_prepare(*, email_message: EmailMessage, save=True) -> None:
+    """Updates the context with defaults and other sanity checking, and sets status=READY.
+    Every field is computed in memory so the EmailMessage is validated and written once.
+    With save=False, nothing is validated or written."""
     e = email_message
 
     if e.status != constants.EmailMessage.Status.NEW:
@@ -173,8 +443,7 @@ def email_message_prepare(*, email_message: EmailMessage) -> None:
         )
 
     assert settings.SITE_CONFIG["default_from_email"] is not None
-    email_message_update(
-        instance=e,
+    fields = dict(
         sender_email=utils.trim_string(
             field=e.sender_email or settings.SITE_CONFIG["default_from_email"]
         ),
@@ -185,16 +454,15 @@ def email_message_prepare(*, email_message: EmailMessage) -> None:
         reply_to_name=utils.trim_string(field=e.reply_to_name or ""),
         to_name=utils.trim_string(field=e.to_name),
         to_email=utils.trim_string(field=e.to_email),
+        postmark_message_stream=e.postmark_message_stream
+        or settings.POSTMARK_DEFAULT_STREAM_ID,
     )
 
-    if e.reply_to_name and not e.reply_to_email:
-        email_message_update(instance=e, status=constants.EmailMessage.Status.ERROR)
-        raise RuntimeError("Reply to has a name but does not have an email")
-
-    if not e.postmark_message_stream:
+    if fields["reply_to_name"] and not fields["reply_to_email"]:
         email_message_update(
-            instance=e, postmark_message_stream=settings.POSTMARK_DEFAULT_STREAM_ID
+            instance=e, save=save, status=constants.EmailMessage.Status.ERROR, **fields
         )
+        raise RuntimeError("Reply to has a name but does not have an email")
 
     # Set defaults for template context if not provided.
     template_context = {
@@ -210,9 +478,13 @@ def email_message_prepare(*, email_message: EmailMessage) -> None:
     # Render subject from template if not already set
     subject = e.subject
     if not subject:
-        subject = render_to_string(
-            "{0}_subject.txt".format(e.template_prefix), template_context
+        subject = email_template_render(
+            template_prefix=e.template_prefix, part="subject", context=template_context
         )
+        if subject is None:
+            raise TemplateDoesNotExist(
+                e.template_prefix + _EMAIL_TEMPLATE_PARTS["subject"]
+            )
     subject = utils.trim_string(field=subject)
     if len(subject) > settings.MAX_SUBJECT_LENGTH:
         subject = subject[: settings.MAX_SUBJECT_LENGTH - 3] + "..."
@@ -220,9 +492,11 @@ def email_message_prepare(*, email_message: EmailMessage) -> None:
 
     email_message_update(
         instance=e,
+        save=save,
         template_context=template_context,
         subject=subject,
         status=constants.EmailMessage.Status.READY,
+        **fields,
     )
 
 
@@ -297,70 +571,255 @@ def email_message_queue(
         return True
 
 
-def email_message_send(*, email_message: EmailMessage) -> None:
-    """Send an email_message immediately. Normally called by a celery task."""
-    if email_message.status != constants.EmailMessage.Status.READY:
-        raise RuntimeError(
-            f"EmailMessage.id={email_message.id} email_message_send called on an email that is not status=READY. Did you run email_message_queue()"
-        )
-    email_message_update(
-        instance=email_message, status=constants.EmailMessage.Status.PENDING
-    )
-    template_name = email_message.template_prefix + "_message.txt"
-    html_template_name = email_message.template_prefix + "_message.html"
+def email_message_bulk_queue(
+    *,
+    messages: List[EmailMessage],
+    cooldown_period=180,
+    cooldown_allowed=1,
+    scopes: List[str] = ["created_by", "template_prefix", "to"],
+) -> List[EmailMessage]:
+    """email_message_queue for many new, unsaved EmailMessages, e.g., a notification to every
+    member of an Org. They are prepared in memory, checked for cooldown in one query, created
+    in one INSERT and sent in batches of EMAIL_MESSAGE_QUEUE_CHUNK_SIZE. Returns the queued
+    EmailMessages. The others are created as CANCELED or ERROR, except those that fail
+    validation, which are set to ERROR but not created since they may not fit the table."""
+    valid = []
+    prepared = []
+    for e in messages:
+        if e.status != constants.EmailMessage.Status.NEW or not e._state.adding:
+            raise RuntimeError(
+                f"EmailMessage.id={e.id} email_message_bulk_queue() called on an email that is not new"
+            )
+
+        try:
+            email_message_prepare(email_message=e, save=False)
+        except Exception as exc:
+            # E.g., a template that doesn't exist or fails to render. Only this
+            # EmailMessage isn't queued.
+            email_message_update(
+                instance=e,
+                save=False,
+                status=constants.EmailMessage.Status.ERROR,
+                error_message=repr(exc),
+            )
+            logger.warning(f"EmailMessage to={e.to_email} not queued: {exc!r}")
 
-    try:
-        msg = render_to_string(
-            template_name=template_name,
-            context=email_message.template_context,
-        )
-        html_msg = None
         try:
-            html_msg = render_to_string(
-                template_name=html_template_name,
-                context=email_message.template_context,
+            # created_by and org are left to the foreign keys and uuid to its unique
+            # constraint since validating them would take queries for every EmailMessage.
+            e.full_clean(exclude=["created_by", "org"], validate_unique=False)
+        except ValidationError as exc:
+            email_message_update(
+                instance=e,
+                save=False,
+                status=constants.EmailMessage.Status.ERROR,
+                error_message=repr(exc),
             )
+            logger.warning(f"EmailMessage to={e.to_email} not queued: {exc!r}")
+            continue
+
+        valid.append(e)
+        if e.status == constants.EmailMessage.Status.READY:
+            prepared.append(e)
+
+    cooling_down = email_message_check_cooling_down_bulk(
+        email_messages=prepared,
+        period=cooldown_period,
+        allowed=cooldown_allowed,
+        scopes=scopes,
+    )
+    queued = []
+    for e, is_cooling_down in zip(prepared, cooling_down):
+        if is_cooling_down:
+            email_message_update(
+                instance=e,
+                save=False,
+                status=constants.EmailMessage.Status.CANCELED,
+                error_message="Cooling down",
+            )
+        else:
+            queued.append(e)
+
+    model_bulk_create(klass=EmailMessage, instances=valid)
+
+    if queued:
+        # One broker message and email backend connection per chunk rather than per
+        # EmailMessage.
+        # Dispatched once the transaction commits since the task only sends the
+        # EmailMessages it finds with status=READY.
+        chunk_size = settings.EMAIL_MESSAGE_QUEUE_CHUNK_SIZE
+        for i in range(0, len(queued), chunk_size):
+            ids = [e.id for e in queued[i : i + chunk_size]]
+            transaction.on_commit(
+                lambda ids=ids: email_message_send_batch_task.delay(ids)
+            )
+
+    return queued
+
+
+_EMAIL_TEMPLATE_PARTS = {
+    "subject": "_subject.txt",
+    "txt": "_message.txt",
+    "html": "_message.html",
+}
+
+
+class _EmailTemplates(NamedTuple):
+    """The compiled parts of an email template_prefix, None for the parts that don't exist."""
+
+    subject: Any
+    txt: Any
+    html: Any
+
+
+class _EmailTemplateTiming(NamedTuple):
+    count: int
+    seconds: float
+
+
+# Filled per template_prefix and only ever added to, so it is safe to read from any thread.
+_email_templates: dict[str, _EmailTemplates] = {}
+_email_template_timings: dict[str, _EmailTemplateTiming] = {}
+_email_template_timings_lock = threading.Lock()
+
+
+def _email_templates_load(template_prefix: str) -> _EmailTemplates:
+    parts = {}
+    for part, suffix in _EMAIL_TEMPLATE_PARTS.items():
+        try:
+            parts[part] = get_template(template_prefix + suffix)
         except TemplateDoesNotExist:
-            logger.warning(
-                f"EmailMessage.id={email_message.id} template not found {html_template_name}"
+            parts[part] = None
+    if parts["html"] is None:
+        logger.warning(f"template not found {template_prefix}_message.html")
+    return _EmailTemplates(**parts)
+
+
+def _email_templates_get(template_prefix: str) -> _EmailTemplates:
+    # Templates are reloaded on every render in development, so changes show up.
+    if settings.DEBUG:
+        return _email_templates_load(template_prefix)
+
+    templates = _email_templates.get(template_prefix)
+    if templates is None:
+        templates = _email_templates[template_prefix] = _email_templates_load(
+            template_prefix
+        )
+    return templates
+
+
+def email_template_registry_build() -> None:
+    """Compile the parts of every email template_prefix, i.e., every template named
+    <template_prefix>_message.txt, so sending doesn't look them up. Called at worker startup.
+    Other template_prefixes are compiled on first use."""
+    for directory in get_template_directories():
+        for path in directory.glob("**/*" + _EMAIL_TEMPLATE_PARTS["txt"]):
+            template_name = path.relative_to(directory).as_posix()
+            _email_templates_get(
+                template_name.removesuffix(_EMAIL_TEMPLATE_PARTS["txt"])
             )
 
-        encoding = settings.DEFAULT_CHARSET
-        from_email = sanitize_address(
-            (email_message.sender_name, email_message.sender_email), encoding
+
+def email_template_render(
+    *,
+    template_prefix: str,
+    part: Literal["subject", "txt", "html"],
+    context: dict,
+) -> Optional[str]:
+    """Render a part of an email template_prefix, or None if the part doesn't exist."""
+    template = getattr(_email_templates_get(template_prefix), part)
+    if template is None:
+        return None
+
+    start = time.perf_counter()
+    rendered = template.render(context)
+    duration = time.perf_counter() - start
+    with _email_template_timings_lock:
+        timing = _email_template_timings.get(
+            template_prefix, _EmailTemplateTiming(0, 0.0)
         )
-        to = [
-            sanitize_address((email_message.to_name, email_message.to_email), encoding),
-        ]
+        _email_template_timings[template_prefix] = _EmailTemplateTiming(
+            count=timing.count + 1, seconds=timing.seconds + duration
+        )
+    return rendered
 
-        if email_message.reply_to_email:
-            reply_to = [
-                sanitize_address(
-                    (email_message.reply_to_name, email_message.reply_to_email),
-                    encoding,
-                )
-            ]
-        else:
-            reply_to = None
-
-        django_email_message = EmailMultiAlternatives(
-            subject=email_message.subject,
-            from_email=from_email,
-            to=to,
-            body=msg,
-            reply_to=reply_to,
+
+def email_template_get_timings() -> dict[str, _EmailTemplateTiming]:
+    """The number of renders and total seconds spent rendering, per template_prefix, in
+    this process."""
+    with _email_template_timings_lock:
+        return dict(_email_template_timings)
+
+
+def _email_message_build(*, email_message: EmailMessage) -> EmailMultiAlternatives:
+    """Render an EmailMessage into the EmailMultiAlternatives to send."""
+    msg = email_template_render(
+        template_prefix=email_message.template_prefix,
+        part="txt",
+        context=email_message.template_context,
+    )
+    if msg is None:
+        raise TemplateDoesNotExist(
+            email_message.template_prefix + _EMAIL_TEMPLATE_PARTS["txt"]
         )
-        if html_msg:
-            django_email_message.attach_alternative(html_msg, "text/html")
+    html_msg = email_template_render(
+        template_prefix=email_message.template_prefix,
+        part="html",
+        context=email_message.template_context,
+    )
 
-        for attachment in email_message.attachments.all():
-            django_email_message.attach(
-                attachment.filename, attachment.file.read(), attachment.mimetype
-            )
-        if email_message.postmark_message_stream:
-            django_email_message.message_stream = (  # type: ignore
-                email_message.postmark_message_stream
+    encoding = settings.DEFAULT_CHARSET
+    from_email = sanitize_address(
+        (email_message.sender_name, email_message.sender_email), encoding
+    )
+    to = [
+        sanitize_address((email_message.to_name, email_message.to_email), encoding),
+    ]
+
+    if email_message.reply_to_email:
+        reply_to = [
+            sanitize_address(
+                (email_message.reply_to_name, email_message.reply_to_email),
+                encoding,
             )
+        ]
+    else:
+        reply_to = None
+
+    django_email_message = EmailMultiAlternatives(
+        subject=email_message.subject,
+        from_email=from_email,
+        to=to,
+        body=msg,
+        reply_to=reply_to,
+    )
+    if html_msg:
+        django_email_message.attach_alternative(html_msg, "text/html")
+
+    for attachment in email_message.attachments.all():
+        django_email_message.attach(
+            attachment.filename, attachment.file.read(), attachment.mimetype
+        )
+    if email_message.postmark_message_stream:
+        django_email_message.message_stream = (  # type: ignore
+            email_message.postmark_message_stream
+        )
+
+    return django_email_message
+
+
+def email_message_send(*, email_message: EmailMessage) -> None:
+    """Send an email_message immediately. Normally called by a celery task."""
+    if email_message.status != constants.EmailMessage.Status.READY:
+        raise RuntimeError(
+            f"EmailMessage.id={email_message.id} email_message_send called on an email that is not status=READY. Did you run email_message_queue()"
+        )
+    email_message_update(
+        instance=email_message, status=constants.EmailMessage.Status.PENDING
+    )
+
+    try:
+        django_email_message = _email_message_build(email_message=email_message)
 
         if global_setting_get_value("disable_outbound_email"):
             raise RuntimeError("GlobalSetting disable_outbound_email is True")
@@ -387,6 +846,91 @@ def email_message_send(*, email_message: EmailMessage) -> None:
             status=constants.EmailMessage.Status.SENT,
             sent_at=timezone.now(),
         )
+        email_message_cooldown_record(email_messages=[email_message])
+
+
+def email_message_send_batch(*, email_messages: List[EmailMessage]) -> None:
+    """Send many EmailMessages immediately over one email backend connection, e.g., one
+    Postmark batch request. Statuses are updated in bulk. If the backend raises, they are
+    left PENDING since some may have been delivered. Normally called by a celery task with
+    the attachments prefetched."""
+    for email_message in email_messages:
+        if email_message.status != constants.EmailMessage.Status.READY:
+            raise RuntimeError(
+                f"EmailMessage.id={email_message.id} email_message_send_batch called on an email that is not status=READY. Did you run email_message_bulk_queue()"
+            )
+    if not email_messages:
+        return
+
+    model_bulk_update(
+        qs=selectors.email_message_list(pk__in=[e.pk for e in email_messages]),
+        status=constants.EmailMessage.Status.PENDING,
+    )
+
+    to_send = []
+    django_email_messages = []
+    for email_message in email_messages:
+        try:
+            django_email_messages.append(
+                _email_message_build(email_message=email_message)
+            )
+        except Exception as e:
+            email_message.status = constants.EmailMessage.Status.ERROR
+            email_message.error_message = repr(e)
+            logger.exception(
+                f"EmailMessage.id={email_message.id} Exception caught in email_message_send_batch"
+            )
+        else:
+            to_send.append(email_message)
+
+    message_ids = None
+    attempted = sent = False
+    try:
+        if global_setting_get_value("disable_outbound_email"):
+            raise RuntimeError("GlobalSetting disable_outbound_email is True")
+        elif to_send:
+            with get_connection() as connection:
+                attempted = True
+                message_ids = connection.send_messages(django_email_messages)
+                sent = True
+    except Exception as e:
+        logger.exception(
+            f"EmailMessage.ids={[m.pk for m in to_send]} Exception caught in email_message_send_batch"
+        )
+        if not sent:
+            for email_message in to_send:
+                if attempted:
+                    # The backend may have delivered some of them before it raised and
+                    # doesn't say which, so they are left PENDING, which is never sent
+                    # again, rather than set to ERROR and resent.
+                    email_message.status = constants.EmailMessage.Status.PENDING
+                    email_message.error_message = f"Delivery unknown: {e!r}"
+                else:
+                    email_message.status = constants.EmailMessage.Status.ERROR
+                    email_message.error_message = repr(e)
+
+    if sent:
+        sent_at = timezone.now()
+        for email_message in to_send:
+            email_message.status = constants.EmailMessage.Status.SENT
+            email_message.sent_at = sent_at
+
+        # Postmark has a setting for returning MessageIDs, in the same order.
+        if isinstance(message_ids, list) and len(message_ids) == len(to_send):
+            for email_message, message_id in zip(to_send, message_ids):
+                email_message.message_id = message_id
+
+    # The fields were validated by email_message_prepare and only statuses changed since.
+    model_bulk_update_instances(
+        klass=EmailMessage,
+        instances=email_messages,
+        fields=["status", "error_message", "sent_at", "message_id"],
+    )
+    email_message_cooldown_record(
+        email_messages=[
+            e for e in email_messages if e.status == constants.EmailMessage.Status.SENT
+        ]
+    )
 
 
 def email_message_create(*, save=False, **kwargs) -> EmailMessage:
@@ -646,7 +1190,18 @@ def org_switch(*, request: HttpRequest, slug: str) -> str:
 
 
 def org_user_create(*, org: Org, user: UserType, **kwargs) -> OrgUser:
-    return model_create(klass=OrgUser, org=org, user=user, **kwargs)
+    org_user = model_create(klass=OrgUser, org=org, user=user, **kwargs)
+    effective_org_user_setting_refresh_on_commit(org_user_id=org_user.pk)
+    org_user_setting_version_bump(org_id=org.pk)
+    org_membership_version_bump(user_ids=[user.pk])
+    return org_user
+
+
+def org_user_delete(*, instance: OrgUser) -> None:
+    """Delete an OrgUser."""
+    model_delete(instance=instance)
+    org_user_setting_version_bump(org_id=instance.org_id)
+    org_membership_version_bump(user_ids=[instance.user_id])
 
 
 def org_create(**kwargs) -> Org:
@@ -663,23 +1218,69 @@ def org_create(**kwargs) -> Org:
         kwargs.setdefault("default_plan", plan)
 
     org = model_create(klass=Org, **kwargs)
+    org_domain_cache_invalidate()
 
     # If owner isn't an OrgUser, create one.
     if not selectors.org_user_list(org=org, user=org.owner).exists():
         org_user_create(org=org, user=org.owner)
 
+    effective_org_setting_refresh_on_commit(org_id=org.pk)
+
     return org
 
 
+# Active Org ids and the time.monotonic() they were read at, by domain.
+_org_ids_by_domain: dict[str, tuple[frozenset[int], float]] = {}
+
+
+def org_domain_cache_invalidate() -> None:
+    """Discard this process's cache of active Org ids by domain."""
+    global _org_ids_by_domain
+    # Every domain, since an Org's previous domain isn't known.
+    _org_ids_by_domain = {}
+
+
+def org_get_ids_for_domain(*, domain: str) -> frozenset[int]:
+    """The pks of the active Orgs on a domain, cached in this process until an Org is
+    created or updated, or for at most ORG_DOMAIN_CACHE_TIMEOUT seconds to pick up
+    changes that other processes can't evict."""
+    # Filled in place, but a fill that races an invalidation lands in the discarded dict.
+    org_ids_by_domain = _org_ids_by_domain
+    now = time.monotonic()
+    entry = org_ids_by_domain.get(domain)
+    if entry is not None and now - entry[1] < settings.ORG_DOMAIN_CACHE_TIMEOUT:
+        return entry[0]
+
+    org_ids = frozenset(
+        selectors.org_list(domain=domain, is_active=True).values_list("pk", flat=True)
+    )
+    org_ids_by_domain[domain] = (org_ids, now)
+    return org_ids
+
+
 def org_update(*, instance: Org, **kwargs) -> Org:
     """Update an Org and return the Org."""
 
     org = model_update(instance=instance, **kwargs)
+    org_domain_cache_invalidate()
 
     # If owner isn't an OrgUser, create one.
     if not selectors.org_user_list(org=org, user=org.owner).exists():
         org_user_create(org=org, user=org.owner)
 
+    # Plans or current_period_end may have changed.
+    org_setting_cache_invalidate(org_ids=[org.pk])
+    effective_org_setting_refresh_on_commit(org_id=org.pk)
+
+    # The owner may have changed.
+    effective_org_user_setting_refresh_on_commit(org_id=org.pk)
+    org_user_setting_version_bump(org_id=org.pk)
+
+    # The name, slug, domain or is_active may have changed for every member.
+    org_membership_version_bump(
+        user_ids=selectors.org_user_list(org=org).values_list("user_id", flat=True)
+    )
+
     return org
 
 
@@ -737,7 +1338,9 @@ def plan_update(*, instance: Plan, **kwargs) -> Plan:
 
 def global_setting_update(*, instance: GlobalSetting, **kwargs) -> GlobalSetting:
     """Update a GlobalSetting and return the GlobalSetting."""
-    return model_update(instance=instance, **kwargs)
+    global_setting = model_update(instance=instance, **kwargs)
+    global_setting_snapshot_invalidate()
+    return global_setting
 
 
 def org_user_update(*, instance: OrgUser, **kwargs) -> OrgUser:
@@ -745,37 +1348,263 @@ def org_user_update(*, instance: OrgUser, **kwargs) -> OrgUser:
     return model_update(instance=instance, **kwargs)
 
 
+ORG_USER_LAST_ACCESSED_BUFFER_KEY = "core:org_user_last_accessed"
+_org_user_last_accessed_buffer: Optional[redis.Redis] = None
+
+
+def _org_user_last_accessed_buffer_get() -> Optional[redis.Redis]:
+    """The Redis client that buffers OrgUser.last_accessed_at, if one is configured."""
+    global _org_user_last_accessed_buffer
+    url = settings.ORG_USER_LAST_ACCESSED_BUFFER_URL
+    if url is None:
+        return None
+    if _org_user_last_accessed_buffer is None:
+        _org_user_last_accessed_buffer = redis.Redis.from_url(url)
+    return _org_user_last_accessed_buffer
+
+
+def _org_membership_version_key(*, user_id: int) -> str:
+    return f"core:org_membership_version:{user_id}"
+
+
+def org_membership_version_bump(*, user_ids: Iterable[int]) -> None:
+    """Change the membership version of Users so their cached available Orgs are no longer used."""
+    cache.delete_many(
+        [_org_membership_version_key(user_id=user_id) for user_id in user_ids]
+    )
+
+
+def user_get_available_orgs(
+    *,
+    user: UserType,
+    exclude: Optional[Org] = None,
+    orgs: Optional[Iterable[Org]] = None,
+) -> list[dict]:
+    """The serialized active Orgs of a User other than exclude, cached per membership
+    version. On a cache miss, orgs are serialized if they were already loaded, and
+    otherwise they are queried. Changes through services bump the version in this
+    process, but only reach other processes if the cache is shared or
+    INVALIDATION_BUS_ENABLED is set, so otherwise they are cached for no longer than
+    ORG_USER_PERMISSION_CACHE_TIMEOUT seconds."""
+    version_key = _org_membership_version_key(user_id=user.pk)
+    version = cache.get(version_key)
+    if version is None:
+        # Random rather than counted, so a version evicted from the cache is never reused.
+        version = uuid4().hex
+        if not cache.add(version_key, version, None):
+            version = cache.get(version_key)
+
+    key = f"core:available_orgs:{user.pk}:{version}"
+    available_orgs = cache.get(key)
+    if available_orgs is None:
+        if orgs is None:
+            orgs = selectors.org_list(users=user, is_active=True)
+        available_orgs = [utils.org_to_dict(org) for org in orgs]
+        timeout = settings.AVAILABLE_ORGS_CACHE_TIMEOUT
+        if not utils.cache_invalidated_everywhere():
+            timeout = min(timeout, settings.ORG_USER_PERMISSION_CACHE_TIMEOUT)
+        cache.set(key, available_orgs, timeout)
+
+    if exclude is None:
+        return available_orgs
+    return [org for org in available_orgs if org["id"] != exclude.pk]
+
+
+def org_user_record_access(
+    *, org_user: OrgUser, others: Iterable[OrgUser] = ()
+) -> None:
+    """Record that an OrgUser was accessed now. Nothing is written if last_accessed_at
+    is within ORG_USER_LAST_ACCESSED_GRANULARITY seconds and still later than that of
+    the user's other OrgUsers, so the most recently accessed OrgUser stays correct.
+    The write goes to the buffer flushed by org_user_last_accessed_flush if one is
+    configured, and is otherwise a single UPDATE."""
+    now = timezone.now()
+    since = (now - org_user.last_accessed_at).total_seconds()
+    if 0 <= since < settings.ORG_USER_LAST_ACCESSED_GRANULARITY and all(
+        other.last_accessed_at <= org_user.last_accessed_at for other in others
+    ):
+        return
+
+    org_user.last_accessed_at = now
+    buffer = _org_user_last_accessed_buffer_get()
+    if buffer is None:
+        model_bulk_update(
+            qs=selectors.org_user_list(pk=org_user.pk), last_accessed_at=now
+        )
+    else:
+        buffer.hset(ORG_USER_LAST_ACCESSED_BUFFER_KEY, org_user.pk, now.timestamp())
+
+
+def org_user_apply_buffered_access(*, org_users: List[OrgUser]) -> None:
+    """Set last_accessed_at on OrgUsers to any later value that hasn't been flushed yet."""
+    buffer = _org_user_last_accessed_buffer_get()
+    if buffer is None or not org_users:
+        return
+
+    timestamps = buffer.hmget(
+        ORG_USER_LAST_ACCESSED_BUFFER_KEY, [org_user.pk for org_user in org_users]
+    )
+    for org_user, timestamp in zip(org_users, timestamps):
+        if timestamp is not None:
+            buffered = datetime.fromtimestamp(float(timestamp), tz=pytz.utc)
+            org_user.last_accessed_at = max(org_user.last_accessed_at, buffered)
+
+
+def _org_user_last_accessed_restore(*, buffer: redis.Redis, flushing_key: str) -> None:
+    """Move the accesses in a flushing key back into the buffer. Accesses buffered since
+    it was moved aside are later, so they are kept."""
+    with buffer.pipeline() as pipe:
+        for pk, timestamp in buffer.hgetall(flushing_key).items():
+            pipe.hsetnx(ORG_USER_LAST_ACCESSED_BUFFER_KEY, pk, timestamp)
+        pipe.delete(flushing_key)
+        pipe.execute()
+
+
+def org_user_last_accessed_flush() -> int:
+    """Write buffered OrgUser.last_accessed_at values with a single UPDATE and return
+    the number of OrgUsers updated."""
+    buffer = _org_user_last_accessed_buffer_get()
+    if buffer is None:
+        return 0
+
+    # Left behind by a flush whose process died before it could restore them. A flush
+    # still running elsewhere may lose its key too, which only writes its values again.
+    for leftover_key in buffer.scan_iter(
+        f"{ORG_USER_LAST_ACCESSED_BUFFER_KEY}:flushing:*"
+    ):
+        _org_user_last_accessed_restore(buffer=buffer, flushing_key=leftover_key)
+
+    # Move the buffer aside atomically so accesses recorded meanwhile aren't lost.
+    flushing_key = f"{ORG_USER_LAST_ACCESSED_BUFFER_KEY}:flushing:{uuid4().hex}"
+    try:
+        buffer.rename(ORG_USER_LAST_ACCESSED_BUFFER_KEY, flushing_key)
+    except redis.ResponseError:
+        return 0  # Nothing buffered.
+
+    try:
+        last_accessed = {
+            int(pk): datetime.fromtimestamp(float(timestamp), tz=pytz.utc)
+            for pk, timestamp in buffer.hgetall(flushing_key).items()
+        }
+        updated = model_bulk_update(
+            qs=selectors.org_user_list(pk__in=last_accessed),
+            last_accessed_at=Case(
+                *[When(pk=pk, then=Value(at)) for pk, at in last_accessed.items()]
+            ),
+        )
+    except Exception:
+        # Flushed again next time.
+        _org_user_last_accessed_restore(buffer=buffer, flushing_key=flushing_key)
+        raise
+    buffer.delete(flushing_key)
+    logger.info(f"Flushed last_accessed_at of {updated} OrgUsers")
+    return updated
+
+
 def org_setting_update(*, instance: OrgSetting, **kwargs) -> OrgSetting:
     """Update an OrgSetting and return the OrgSetting."""
-    return model_update(instance=instance, **kwargs)
+    org_setting = model_update(instance=instance, **kwargs)
+    setting_registry_invalidate()
+    org_setting_cache_invalidate(slugs=[org_setting.slug])
+    effective_org_setting_refresh_on_commit(setting=org_setting)
+    return org_setting
 
 
 def plan_org_setting_update(*, instance: PlanOrgSetting, **kwargs) -> PlanOrgSetting:
     """Update a PlanOrgSetting and return the PlanOrgSetting."""
-    return model_update(instance=instance, **kwargs)
+    plan_org_setting = model_update(instance=instance, **kwargs)
+    plan_org_setting_cache_invalidate(plan_org_setting=plan_org_setting)
+    effective_org_setting_refresh_on_commit(
+        setting=plan_org_setting.setting, plan=plan_org_setting.plan
+    )
+    return plan_org_setting
 
 
 def overridden_org_setting_update(
     *, instance: OverriddenOrgSetting, **kwargs
 ) -> OverriddenOrgSetting:
     """Update an OverriddenOrgSetting and return the OverriddenOrgSetting."""
-    return model_update(instance=instance, **kwargs)
+    overridden_org_setting = model_update(instance=instance, **kwargs)
+    org_setting_cache_invalidate(
+        org_ids=[overridden_org_setting.org_id],
+        slugs=[overridden_org_setting.setting.slug],
+    )
+    effective_org_setting_refresh_on_commit(
+        setting=overridden_org_setting.setting, org_id=overridden_org_setting.org_id
+    )
+    return overridden_org_setting
 
 
 def org_user_setting_update(*, instance: OrgUserSetting, **kwargs) -> OrgUserSetting:
-    return model_update(instance=instance, **kwargs)
+    org_user_setting = model_update(instance=instance, **kwargs)
+    setting_registry_invalidate()
+    effective_org_user_setting_refresh_on_commit(setting=org_user_setting)
+    org_user_setting_version_bump()
+    return org_user_setting
 
 
 def org_user_org_user_setting_update(
     *, instance: OrgUserOrgUserSetting, **kwargs
 ) -> OrgUserOrgUserSetting:
-    return model_update(instance=instance, **kwargs)
+    org_user_org_user_setting = model_update(instance=instance, **kwargs)
+    effective_org_user_setting_refresh(
+        org_users=selectors.org_user_list(pk=org_user_org_user_setting.org_user_id),
+        setting=org_user_org_user_setting.setting,
+    )
+    org_user_setting_version_bump(org_id=org_user_org_user_setting.org_user.org_id)
+    return org_user_org_user_setting
 
 
 def org_user_setting_default_update(
     *, instance: OrgUserSettingDefault, **kwargs
 ) -> OrgUserSettingDefault:
-    return model_update(instance=instance, **kwargs)
+    org_user_setting_default = model_update(instance=instance, **kwargs)
+    effective_org_user_setting_refresh_on_commit(
+        setting=org_user_setting_default.setting,
+        org_id=org_user_setting_default.org_id,
+    )
+    org_user_setting_version_bump(org_id=org_user_setting_default.org_id)
+    return org_user_setting_default
+
+
+def overridden_org_setting_delete(*, instance: OverriddenOrgSetting) -> None:
+    """Delete an OverriddenOrgSetting so its Org uses its Plan's value again."""
+    model_delete(instance=instance)
+    org_setting_cache_invalidate(
+        org_ids=[instance.org_id], slugs=[instance.setting.slug]
+    )
+    effective_org_setting_refresh_on_commit(
+        setting=instance.setting, org_id=instance.org_id
+    )
+
+
+def plan_org_setting_delete(*, instance: PlanOrgSetting) -> None:
+    """Delete a PlanOrgSetting so Orgs on its Plan use the OrgSetting's default again."""
+    model_delete(instance=instance)
+    plan_org_setting_cache_invalidate(plan_org_setting=instance)
+    effective_org_setting_refresh_on_commit(
+        setting=instance.setting, plan=instance.plan
+    )
+
+
+def org_user_org_user_setting_delete(*, instance: OrgUserOrgUserSetting) -> None:
+    """Delete an OrgUserOrgUserSetting so its OrgUser uses its Org's default again."""
+    model_delete(instance=instance)
+    effective_org_user_setting_refresh(
+        org_users=selectors.org_user_list(pk=instance.org_user_id),
+        setting=instance.setting,
+    )
+    org_user_setting_version_bump(org_id=instance.org_user.org_id)
+
+
+def org_user_setting_default_delete(*, instance: OrgUserSettingDefault) -> None:
+    """Delete an OrgUserSettingDefault so OrgUsers of its Org use the OrgUserSetting's
+    default again."""
+    model_delete(instance=instance)
+    effective_org_user_setting_refresh_on_commit(
+        setting=instance.setting, org_id=instance.org_id
+    )
+    org_user_setting_version_bump(org_id=instance.org_id)
 
 
 def model_update(*, instance: DjangoModelType, save=True, **kwargs) -> DjangoModelType:
@@ -831,126 +1660,988 @@ def model_update(*, instance: DjangoModelType, save=True, **kwargs) -> DjangoMod
         related_manager = getattr(instance, field_name)
         related_manager.set(value)
 
+    # Other processes evict their cached copies once this commits. User.save() publishes
+    # itself.
+    if save and not isinstance(instance, User):
+        invalidation.publish(instance)
+
     return instance
 
 
+def model_delete(*, instance: DjangoModelType) -> None:
+    """Delete a model instance."""
+    # Other processes evict their cached copies once this commits. Published first since
+    # delete() clears the pk. User.delete() publishes itself.
+    if not isinstance(instance, User):
+        invalidation.publish(instance)
+    instance.delete()
+
+
 def model_bulk_update(*, qs: QuerySet, **kwargs) -> int:
     """Bulk update a set of instances and return the number of instances updated."""
     return qs.update(**kwargs)
 
 
+def model_bulk_update_instances(
+    *, klass: Type[BaseModelType], instances: List[BaseModelType], fields: List[str]
+) -> int:
+    """Write fields of a list of instances in bulk and return the number of instances
+    updated. Like model_bulk_create, this skips full_clean() and save(), so updated_at is
+    set here."""
+    now = timezone.now()
+    for instance in instances:
+        instance.updated_at = now
+    return klass._default_manager.bulk_update(instances, [*fields, "updated_at"])
+
+
+def model_bulk_create(
+    *, klass: Type[BaseModelType], instances: List[BaseModelType], **kwargs
+) -> List[BaseModelType]:
+    """Bulk create a list of instances and return them. This skips full_clean() and
+    save(), so it should only be used for data that has already been validated."""
+    return klass._default_manager.bulk_create(instances, **kwargs)
+
+
+class _GlobalSettingSnapshot(NamedTuple):
+    values: MappingProxyType
+    version: tuple
+    checked_at: float
+
+
+# Replaced wholesale, never mutated, so it is safe to read from any thread.
+_global_setting_snapshot: Optional[_GlobalSettingSnapshot] = None
+
+
+def global_setting_snapshot_invalidate() -> None:
+    """Discard this process's GlobalSetting snapshot so the next read reloads it."""
+    global _global_setting_snapshot
+    _global_setting_snapshot = None
+
+
+def _global_setting_snapshot_get() -> MappingProxyType:
+    """The cast values of every GlobalSetting keyed by slug. The version stamp is checked
+    at most every GLOBAL_SETTING_SNAPSHOT_INTERVAL seconds and the GlobalSettings are only
+    reloaded when it changes."""
+    global _global_setting_snapshot
+    snapshot = _global_setting_snapshot
+    now = time.monotonic()
+    if (
+        snapshot is not None
+        and now - snapshot.checked_at < settings.GLOBAL_SETTING_SNAPSHOT_INTERVAL
+    ):
+        return snapshot.values
+
+    version = selectors.global_setting_get_version()
+    if snapshot is not None and snapshot.version == version:
+        values = snapshot.values
+    else:
+        values = MappingProxyType(
+            {
+                setting.slug: utils.cast_setting(setting.value, setting.type)
+                for setting in selectors.global_setting_list()
+            }
+        )
+    _global_setting_snapshot = _GlobalSettingSnapshot(
+        values=values, version=version, checked_at=now
+    )
+    return values
+
+
 def global_setting_get_value(slug: str) -> bool | int | str:
-    """Get a GlobalSetting, creating it as False if it does not exist."""
+    """Get a GlobalSetting, creating it as False if it does not exist. Values are read
+    from an in-process snapshot of all GlobalSettings."""
+    values = _global_setting_snapshot_get()
+    if slug in values:
+        return values[slug]
+
+    # The snapshot may predate a GlobalSetting created by another process.
     try:
         setting = selectors.global_setting_list(slug=slug).get()
     except GlobalSetting.DoesNotExist:
         setting = global_setting_create(
             slug=slug, type=constants.SettingType.BOOL, value="false"
         )
-
+    else:
+        global_setting_snapshot_invalidate()
     return utils.cast_setting(setting.value, setting.type)
 
 
+class SettingDefinition(NamedTuple):
+    """An OrgSetting or OrgUserSetting definition with its values already cast."""
+
+    pk: Optional[int]  # None if the definition is not in the database.
+    slug: str
+    type: str
+    default: bool | int | str
+    owner_value: Optional[bool | int | str]
+    cast: Callable[[str], bool | int | str]
+
+
+class _SettingRegistry(NamedTuple):
+    org: MappingProxyType
+    org_user: MappingProxyType
+    built_at: float
+
+
+# Replaced wholesale, never mutated, so it is safe to read from any thread.
+_setting_registry: Optional[_SettingRegistry] = None
+
+
+def setting_registry_invalidate() -> None:
+    """Discard this process's setting definition registry so the next read rebuilds it."""
+    global _setting_registry
+    _setting_registry = None
+
+
+def _setting_definition(
+    *, slug: str, type: str, default: str, owner_value: Optional[str] = None, pk=None
+) -> SettingDefinition:
+    # Raises ValueError for an unknown type or a default that doesn't match the type.
+    cast = utils.get_setting_caster(type)
+    return SettingDefinition(
+        pk=pk,
+        slug=slug,
+        type=type,
+        default=cast(default),
+        owner_value=cast(owner_value) if owner_value is not None else None,
+        cast=cast,
+    )
+
+
+def _setting_registry_get() -> _SettingRegistry:
+    """OrgSetting and OrgUserSetting definitions keyed by slug, built from
+    ORG_SETTING_DEFAULTS, ORG_USER_SETTING_DEFAULTS and the database. Services that change
+    definitions discard it, and it is rebuilt at least every SETTING_REGISTRY_TIMEOUT
+    seconds to pick up changes made outside of them."""
+    global _setting_registry
+    registry = _setting_registry
+    now = time.monotonic()
+    if (
+        registry is not None
+        and now - registry.built_at < settings.SETTING_REGISTRY_TIMEOUT
+    ):
+        return registry
+
+    org = {
+        slug: _setting_definition(slug=slug, **config)
+        for slug, config in settings.ORG_SETTING_DEFAULTS.items()
+    }
+    for org_setting in selectors.org_setting_list():
+        org[org_setting.slug] = _setting_definition(
+            pk=org_setting.pk,
+            slug=org_setting.slug,
+            type=org_setting.type,
+            default=org_setting.default,
+        )
+
+    org_user = {
+        slug: _setting_definition(slug=slug, **config)
+        for slug, config in settings.ORG_USER_SETTING_DEFAULTS.items()
+    }
+    for org_user_setting in selectors.org_user_setting_list():
+        org_user[org_user_setting.slug] = _setting_definition(
+            pk=org_user_setting.pk,
+            slug=org_user_setting.slug,
+            type=org_user_setting.type,
+            default=org_user_setting.default,
+            owner_value=org_user_setting.owner_value,
+        )
+
+    registry = _SettingRegistry(
+        org=MappingProxyType(org), org_user=MappingProxyType(org_user), built_at=now
+    )
+    _setting_registry = registry
+    return registry
+
+
+def org_setting_get_definition(slug: str) -> SettingDefinition:
+    """The definition of an OrgSetting, falling back to its default config if it is
+    neither in the database nor in ORG_SETTING_DEFAULTS."""
+    definition = _setting_registry_get().org.get(slug)
+    if definition is None:
+        definition = _setting_definition(
+            slug=slug, **utils.get_org_setting_default_config(slug)
+        )
+    return definition
+
+
+def org_user_setting_get_definition(slug: str) -> SettingDefinition:
+    """The definition of an OrgUserSetting, falling back to its default config if it is
+    neither in the database nor in ORG_USER_SETTING_DEFAULTS."""
+    definition = _setting_registry_get().org_user.get(slug)
+    if definition is None:
+        definition = _setting_definition(
+            slug=slug, **utils.get_org_user_setting_default_config(slug)
+        )
+    return definition
+
+
+def _org_setting_generation_key(
+    *, org_id: Optional[int] = None, slug: Optional[str] = None
+) -> str:
+    if org_id is not None:
+        return f"core:org_setting_generation:org:{org_id}"
+    return f"core:org_setting_generation:slug:{slug}"
+
+
+def _org_setting_generations_get(*, org_id: int, slugs: List[str]) -> dict[str, str]:
+    """The generation of each slug's cached value for an Org, keyed by slug. It changes
+    when either the Org's generation or the slug's generation is bumped."""
+    org_key = _org_setting_generation_key(org_id=org_id)
+    slug_keys = {slug: _org_setting_generation_key(slug=slug) for slug in slugs}
+    keys = [org_key, *slug_keys.values()]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Random rather than counted, so a generation evicted from the cache is never reused.
+            generation = uuid4().hex
+            generations[key] = (
+                generation if cache.add(key, generation, None) else cache.get(key)
+            )
+    return {
+        slug: f"{generations[org_key]}.{generations[key]}"
+        for slug, key in slug_keys.items()
+    }
+
+
+def _org_setting_materialize(slug: str) -> SettingDefinition:
+    """Create an OrgSetting that isn't in the registry with its default config and return
+    its definition. The registry may only be stale, so an OrgSetting that another process
+    created is used instead."""
+    if not selectors.org_setting_list(slug=slug).exists():
+        try:
+            with transaction.atomic():
+                org_setting_create(
+                    refresh_effective=False,
+                    slug=slug,
+                    **utils.get_org_setting_default_config(slug),
+                )
+        except IntegrityError:
+            pass  # Another process created it in the meantime.
+    setting_registry_invalidate()
+    return org_setting_get_definition(slug)
+
+
+def _org_user_setting_materialize(slug: str) -> SettingDefinition:
+    """Create an OrgUserSetting that isn't in the registry with its default config and
+    return its definition, using the OrgUserSetting if another process created it."""
+    if not selectors.org_user_setting_list(slug=slug).exists():
+        try:
+            with transaction.atomic():
+                org_user_setting_create(
+                    refresh_effective=False,
+                    slug=slug,
+                    **utils.get_org_user_setting_default_config(slug),
+                )
+        except IntegrityError:
+            pass  # Another process created it in the meantime.
+    setting_registry_invalidate()
+    return org_user_setting_get_definition(slug)
+
+
+def _org_setting_cache_key(*, org_id: int, slug: str, generation: str) -> str:
+    return f"core:org_setting_value:{org_id}:{slug}:{generation}"
+
+
+def _org_setting_cache_timeout(*, org: Org) -> int:
+    """The cache timeout for an Org's settings, bounded by the end of the current period."""
+    timeout = settings.ORG_SETTING_CACHE_TIMEOUT
+    now = timezone.now()
+    if org.current_period_end and org.current_period_end > now:
+        remaining = math.ceil((org.current_period_end - now).total_seconds())
+        timeout = min(timeout, remaining)
+    return timeout
+
+
+def org_setting_cache_invalidate(
+    *, org_ids: Optional[Iterable[int]] = None, slugs: Optional[Iterable[str]] = None
+) -> None:
+    """Evict the cached OrgSetting values for every combination of org_ids and slugs.
+    If org_ids is None, the slugs are evicted for every Org, and if slugs is None, every
+    slug is evicted for the Orgs. Either way that is a single cache write per slug or Org
+    rather than one per Org and slug."""
+    if org_ids is None or slugs is None:
+        keys = [_org_setting_generation_key(slug=slug) for slug in slugs or []] + [
+            _org_setting_generation_key(org_id=org_id) for org_id in org_ids or []
+        ]
+        cache.set_many({key: uuid4().hex for key in keys}, None)
+        return
+
+    slugs = list(slugs)
+    keys = []
+    for org_id in org_ids:
+        generations = _org_setting_generations_get(org_id=org_id, slugs=slugs)
+        keys += [
+            _org_setting_cache_key(org_id=org_id, slug=slug, generation=generation)
+            for slug, generation in generations.items()
+        ]
+    if keys:
+        cache.delete_many(keys)
+
+
+def plan_org_setting_cache_invalidate(*, plan_org_setting: PlanOrgSetting) -> None:
+    """Evict the cached value of a PlanOrgSetting. It is evicted for every Org rather
+    than only the Orgs that may be on the Plan, so the Orgs don't need to be queried."""
+    org_setting_cache_invalidate(slugs=[plan_org_setting.setting.slug])
+
+
+def _org_invalidated(pk: int) -> None:
+    org_domain_cache_invalidate()
+    org_setting_cache_invalidate(org_ids=[pk])
+    org_user_setting_version_bump(org_id=pk)
+    org_membership_version_bump(
+        user_ids=selectors.org_user_list(org_id=pk).values_list("user_id", flat=True)
+    )
+
+
+def _org_setting_invalidated(pk: int, *, slug: str) -> None:
+    setting_registry_invalidate()
+    org_setting_cache_invalidate(slugs=[slug])
+
+
+def _org_user_invalidated(pk: int, *, org_id: int, user_id: int) -> None:
+    org_user_setting_version_bump(org_id=org_id)
+    org_membership_version_bump(user_ids=[user_id])
+
+
+def _org_setting_slug_get(pk: int) -> Optional[str]:
+    return selectors.org_setting_list(pk=pk).values_list("slug", flat=True).first()
+
+
+def _plan_org_setting_invalidated(pk: int, *, setting_id: int) -> None:
+    slug = _org_setting_slug_get(setting_id)
+    if slug:
+        org_setting_cache_invalidate(slugs=[slug])
+
+
+def _overridden_org_setting_invalidated(
+    pk: int, *, org_id: int, setting_id: int
+) -> None:
+    slug = _org_setting_slug_get(setting_id)
+    if slug:
+        org_setting_cache_invalidate(org_ids=[org_id], slugs=[slug])
+
+
+def invalidation_handlers_register() -> None:
+    """Evict this process's cached values when another process changes or deletes the
+    models they are derived from. Only the GlobalSetting snapshot is always process-local;
+    the OrgSetting values are too unless CACHE_URL points to a shared cache."""
+    invalidation.register(
+        GlobalSetting, lambda pk: global_setting_snapshot_invalidate()
+    )
+    invalidation.register(Org, _org_invalidated)
+    invalidation.register(OrgSetting, _org_setting_invalidated, fields=["slug"])
+    invalidation.register(User, lambda pk: utils.user_cache_evict(pk))
+    invalidation.register(OrgUser, _org_user_invalidated, fields=["org_id", "user_id"])
+    invalidation.register(
+        PlanOrgSetting, _plan_org_setting_invalidated, fields=["setting_id"]
+    )
+    invalidation.register(
+        OverriddenOrgSetting,
+        _overridden_org_setting_invalidated,
+        fields=["org_id", "setting_id"],
+    )
+    invalidation.register(OrgUserSetting, lambda pk: setting_registry_invalidate())
+    invalidation.register(OrgUserSetting, lambda pk: org_user_setting_version_bump())
+    invalidation.register(
+        OrgUserOrgUserSetting,
+        lambda pk, org_user_id: org_user_setting_version_bump(
+            org_id=selectors.org_user_list(pk=org_user_id)
+            .values_list("org_id", flat=True)
+            .first()
+        ),
+        fields=["org_user_id"],
+    )
+    invalidation.register(
+        OrgUserSettingDefault,
+        lambda pk, org_id: org_user_setting_version_bump(org_id=org_id),
+        fields=["org_id"],
+    )
+
+
 def org_get_setting_value(*, org: Org, slug: str) -> bool | int | str:
-    try:
-        setting = selectors.org_setting_list(slug=slug).get()
-    except OrgSetting.DoesNotExist:
-        # Check if there's a default configuration in settings
-        default_config = settings.ORG_SETTING_DEFAULTS.get(slug)
-        if default_config:
-            setting = org_setting_create(slug=slug, **default_config)
-        else:
-            # Fall back to hardcoded default
-            setting = org_setting_create(
-                slug=slug, type=constants.SettingType.BOOL, default="false"
+    """Get the value of an OrgSetting for an Org. Values are cached per Org and slug
+    until invalidated by the services that change them or until the cache times out."""
+    generations = _org_setting_generations_get(org_id=org.pk, slugs=[slug])
+    key = _org_setting_cache_key(org_id=org.pk, slug=slug, generation=generations[slug])
+    plan_id = selectors.org_get_plan_id(org=org)
+
+    # A cached value is only good for the Plan it was resolved against.
+    cached = cache.get(key)
+    if cached is not None and cached[0] == plan_id:
+        return cached[1]
+
+    value = _org_resolve_setting_value(org=org, slug=slug)
+    cache.set(key, (plan_id, value), _org_setting_cache_timeout(org=org))
+    return value
+
+
+def org_get_setting_values(
+    *, org: Org, slugs: Iterable[str]
+) -> dict[str, bool | int | str]:
+    """Get the values of several OrgSettings for an Org, keyed by slug. Values that
+    aren't cached are resolved together in a single query. Unlike org_get_setting_value,
+    settings that don't exist are not created but use their configured defaults."""
+    slugs = list(dict.fromkeys(slugs))
+    plan_id = selectors.org_get_plan_id(org=org)
+    generations = _org_setting_generations_get(org_id=org.pk, slugs=slugs)
+    keys = {
+        slug: _org_setting_cache_key(
+            org_id=org.pk, slug=slug, generation=generations[slug]
+        )
+        for slug in slugs
+    }
+    cached = cache.get_many(keys.values())
+
+    values: dict[str, bool | int | str] = {}
+    for slug in slugs:
+        entry = cached.get(keys[slug])
+        if entry is not None and entry[0] == plan_id:
+            values[slug] = entry[1]
+
+    missing = [slug for slug in slugs if slug not in values]
+    if not missing:
+        return values
+
+    resolved = {}
+    for setting in selectors.org_setting_list_with_values(org=org, slugs=missing):
+        resolved[setting.slug] = utils.cast_setting(
+            setting.resolved_value, setting.type
+        )
+    cache.set_many(
+        {keys[slug]: (plan_id, value) for slug, value in resolved.items()},
+        _org_setting_cache_timeout(org=org),
+    )
+
+    # Settings without a definition aren't cached since the definition may be created later.
+    for slug in missing:
+        if slug not in resolved:
+            default_config = utils.get_org_setting_default_config(slug)
+            resolved[slug] = utils.cast_setting(
+                default_config["default"], default_config["type"]
             )
 
+    return values | resolved
+
+
+def _org_resolve_setting_value(*, org: Org, slug: str) -> bool | int | str:
+    """Resolve the value of an OrgSetting for an Org. Missing rows are created unless
+    SETTINGS_MATERIALIZE_ON_READ is False, in which case the defaults are used instead."""
+    materialize = settings.SETTINGS_MATERIALIZE_ON_READ
+    definition = org_setting_get_definition(slug)
+    if definition.pk is None:
+        if not materialize:
+            return definition.default
+        definition = _org_setting_materialize(slug)
+
     try:
         overridden_org_setting = selectors.overridden_org_setting_list(
-            org=org, setting=setting
+            org=org, setting_id=definition.pk
         ).get()
         best = overridden_org_setting.value
     except OverriddenOrgSetting.DoesNotExist:
-        plan = selectors.org_get_plan(org=org)
+        plan_id = selectors.org_get_plan_id(org=org)
         try:
             plan_org_setting = selectors.plan_org_setting_list(
-                plan=plan, setting=setting
+                plan_id=plan_id, setting_id=definition.pk
             ).get()
         except PlanOrgSetting.DoesNotExist:
+            if not materialize:
+                return definition.default
+            setting = selectors.org_setting_list(pk=definition.pk).get()
             plan_org_setting = plan_org_setting_create(
-                plan=plan, setting=setting, value=setting.default
+                refresh_effective=False,
+                plan=selectors.org_get_plan(org=org),
+                setting=setting,
+                value=setting.default,
             )
         best = plan_org_setting.value
 
-    return utils.cast_setting(best, setting.type)
+    return definition.cast(best)
 
 
 def org_user_get_setting_value(*, org_user: OrgUser, slug: str) -> bool | int | str:
-    try:
-        setting = selectors.org_user_setting_list(slug=slug).get()
-    except OrgUserSetting.DoesNotExist:
-        # Check if there's a default configuration in settings
-        default_config = settings.ORG_USER_SETTING_DEFAULTS.get(slug)
-        if default_config:
-            setting = org_user_setting_create(slug=slug, **default_config)
-        else:
-            # Fall back to hardcoded default
-            setting = org_user_setting_create(
-                slug=slug,
-                type=constants.SettingType.BOOL,
-                default="false",
-                owner_value="true",
-            )
+    """Get the value of an OrgUserSetting for an OrgUser. Missing rows are created unless
+    SETTINGS_MATERIALIZE_ON_READ is False, in which case the defaults are used instead."""
+    materialize = settings.SETTINGS_MATERIALIZE_ON_READ
+    definition = org_user_setting_get_definition(slug)
+    if definition.pk is None and materialize:
+        definition = _org_user_setting_materialize(slug)
 
     # Short-circuit if the OrgUser is the Org owner.
-    if org_user.org.owner == org_user.user:
-        return utils.cast_setting(setting.owner_value, setting.type)
+    if org_user.org.owner_id == org_user.user_id:
+        return definition.owner_value
+
+    if definition.pk is None:
+        return definition.default
 
     try:
         org_user_org_user_setting = selectors.org_user_org_user_setting_list(
-            org_user=org_user, setting=setting
+            org_user=org_user, setting_id=definition.pk
         ).get()
         best = org_user_org_user_setting.value
     except OrgUserOrgUserSetting.DoesNotExist:
         try:
             org_user_setting_default = selectors.org_user_setting_default_list(
-                org=org_user.org, setting=setting
+                org=org_user.org, setting_id=definition.pk
             ).get()
         except OrgUserSettingDefault.DoesNotExist:
+            if not materialize:
+                return definition.default
+            setting = selectors.org_user_setting_list(pk=definition.pk).get()
             org_user_setting_default = org_user_setting_default_create(
-                org=org_user.org, setting=setting, value=setting.default
+                refresh_effective=False,
+                org=org_user.org,
+                setting=setting,
+                value=setting.default,
             )
         best = org_user_setting_default.value
 
-    return utils.cast_setting(best, setting.type)
+    return definition.cast(best)
+
+
+def org_user_get_setting_values_bulk(
+    *, org: Org, slugs: Iterable[str]
+) -> dict[int, dict[str, bool | int | str]]:
+    """Get the values of several OrgUserSettings for every OrgUser of an Org, keyed by
+    OrgUser pk and then by slug, in a constant number of queries. Like
+    org_get_setting_values, settings that don't exist are not created but use their
+    configured defaults."""
+    slugs = list(dict.fromkeys(slugs))
+    setting_by_slug = {
+        setting.slug: setting
+        for setting in selectors.org_user_setting_list(slug__in=slugs)
+    }
+
+    # (type, default, owner_value) of each slug.
+    configs = {}
+    for slug in slugs:
+        if slug in setting_by_slug:
+            setting = setting_by_slug[slug]
+            configs[slug] = (setting.type, setting.default, setting.owner_value)
+        else:
+            default_config = utils.get_org_user_setting_default_config(slug)
+            configs[slug] = (
+                default_config["type"],
+                default_config["default"],
+                default_config["owner_value"],
+            )
 
+    org_defaults: dict[str, str] = {}
+    org_user_values: dict[tuple[int, str], str] = {}
+    if setting_by_slug:
+        org_defaults = dict(
+            selectors.org_user_setting_default_list(
+                org=org, setting__in=setting_by_slug.values()
+            ).values_list("setting__slug", "value")
+        )
+        for org_user_id, slug, value in selectors.org_user_org_user_setting_list(
+            org_user__org=org, setting__in=setting_by_slug.values()
+        ).values_list("org_user_id", "setting__slug", "value"):
+            org_user_values[(org_user_id, slug)] = value
+
+    values = {}
+    for org_user_id, user_id in selectors.org_user_list(org=org).values_list(
+        "pk", "user_id"
+    ):
+        values[org_user_id] = {}
+        for slug, (type, default, owner_value) in configs.items():
+            if user_id == org.owner_id:
+                best = owner_value
+            elif (org_user_id, slug) in org_user_values:
+                best = org_user_values[(org_user_id, slug)]
+            else:
+                best = org_defaults.get(slug, default)
+            values[org_user_id][slug] = utils.cast_setting(best, type)
+
+    return values
+
+
+def _org_user_setting_version_key(*, org_id: Optional[int] = None) -> str:
+    if org_id is None:
+        return "core:org_user_setting_version"
+    return f"core:org_user_setting_version:{org_id}"
+
+
+def org_user_setting_version_bump(*, org_id: Optional[int] = None) -> None:
+    """Change the settings-version of an Org's OrgUserSettings, or of every Org's if
+    org_id is None, so that cached permission decisions are no longer used."""
+    cache.set(_org_user_setting_version_key(org_id=org_id), uuid4().hex, None)
+
+
+def _org_user_setting_version_get(*, org_id: int) -> str:
+    """The settings-version of an Org's OrgUserSettings."""
+    keys = [
+        _org_user_setting_version_key(),
+        _org_user_setting_version_key(org_id=org_id),
+    ]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Random rather than counted, so a version evicted from the cache is never reused.
+            version = uuid4().hex
+            versions[key] = version if cache.add(key, version, None) else cache.get(key)
+    return ".".join(versions[key] for key in keys)
+
+
+def org_user_get_permissions(
+    *,
+    org: Org,
+    user: UserType,
+    slugs: Iterable[str],
+    request: Optional[HttpRequest] = None,
+) -> dict[str, bool]:
+    """Whether each OrgUserSetting is truthy for the user in the Org, keyed by slug.
+    Decisions are cached per settings-version for the rest of the request, if one is
+    passed. They are also cached across requests for ORG_USER_PERMISSION_CACHE_TIMEOUT
+    seconds, but only if the cache is shared or INVALIDATION_BUS_ENABLED is set, since
+    other processes would otherwise not see changes until the decisions expire."""
+    slugs = list(dict.fromkeys(slugs))
+    shared = utils.cache_invalidated_everywhere()
+    version = _org_user_setting_version_get(org_id=org.pk)
+    keys = {
+        slug: f"core:org_user_permission:{org.pk}:{user.pk}:{slug}:{version}"
+        for slug in slugs
+    }
+
+    request_decisions = {}
+    if request is not None:
+        if not hasattr(request, "_org_user_permissions"):
+            request._org_user_permissions = {}
+        request_decisions = request._org_user_permissions
+
+    decisions = {
+        slug: request_decisions[keys[slug]]
+        for slug in slugs
+        if keys[slug] in request_decisions
+    }
+    missing = [slug for slug in slugs if slug not in decisions]
+    if missing and shared:
+        cached = cache.get_many([keys[slug] for slug in missing])
+        decisions |= {
+            slug: cached[keys[slug]] for slug in missing if keys[slug] in cached
+        }
+
+    unresolved = [slug for slug in slugs if slug not in decisions]
+    if unresolved:
+        org_user = (
+            selectors.org_user_list(org=org, user=user).select_related("org").get()
+        )
+        resolved = {
+            slug: bool(org_user_get_setting_value(org_user=org_user, slug=slug))
+            for slug in unresolved
+        }
+        if shared:
+            cache.set_many(
+                {keys[slug]: decision for slug, decision in resolved.items()},
+                settings.ORG_USER_PERMISSION_CACHE_TIMEOUT,
+            )
+        decisions |= resolved
 
-def global_setting_create(**kwargs) -> GlobalSetting:
-    return model_create(klass=GlobalSetting, **kwargs)
+    for slug in slugs:
+        request_decisions[keys[slug]] = decisions[slug]
 
+    return decisions
 
-def org_setting_create(**kwargs) -> OrgSetting:
-    return model_create(klass=OrgSetting, **kwargs)
 
+def org_get_effective_setting_value(*, org: Org, slug: str) -> bool | int | str:
+    """Get the value of an OrgSetting for an Org from its EffectiveOrgSetting in a single
+    indexed read. Falls back to org_get_setting_value if there is no current EffectiveOrgSetting."""
+    effective = (
+        selectors.effective_org_setting_list(org=org, setting__slug=slug)
+        .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+        .select_related("setting")
+        .first()
+    )
+    if effective is None:
+        return org_get_setting_value(org=org, slug=slug)
+    return utils.cast_setting(effective.value, effective.setting.type)
+
+
+def org_user_get_effective_setting_value(
+    *, org_user: OrgUser, slug: str
+) -> bool | int | str:
+    """Get the value of an OrgUserSetting for an OrgUser from its EffectiveOrgUserSetting in a
+    single indexed read. Falls back to org_user_get_setting_value if there is no EffectiveOrgUserSetting."""
+    effective = (
+        selectors.effective_org_user_setting_list(org_user=org_user, setting__slug=slug)
+        .select_related("setting")
+        .first()
+    )
+    if effective is None:
+        return org_user_get_setting_value(org_user=org_user, slug=slug)
+    return utils.cast_setting(effective.value, effective.setting.type)
 
-def org_user_setting_create(**kwargs) -> OrgUserSetting:
-    return model_create(klass=OrgUserSetting, **kwargs)
 
+def effective_org_setting_refresh(
+    *,
+    orgs: Optional[QuerySet[Org]] = None,
+    setting: Optional[OrgSetting] = None,
+) -> None:
+    """Recompute the EffectiveOrgSettings of the Orgs for the OrgSetting.
+    All Orgs and all OrgSettings are refreshed if they are not provided."""
+    if orgs is None:
+        orgs = selectors.org_list()
+
+    if setting is None:
+        for org_setting in selectors.org_setting_list():
+            effective_org_setting_refresh(orgs=orgs, setting=org_setting)
+        return
+
+    now = timezone.now()
+    instances = []
+    for org in selectors.org_annotate_setting_value(
+        orgs=orgs.order_by(), setting=setting
+    ).iterator():
+        # The value changes when the primary_plan expires.
+        expires_at = None
+        if org.current_period_end and org.current_period_end > now:
+            expires_at = org.current_period_end
+
+        instances.append(
+            EffectiveOrgSetting(
+                org=org,
+                setting=setting,
+                value=org.setting_raw_value,
+                expires_at=expires_at,
+            )
+        )
+
+    model_bulk_create(
+        klass=EffectiveOrgSetting,
+        instances=instances,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["org", "setting"],
+        update_fields=["value", "expires_at", "updated_at"],
+    )
+
+
+def effective_org_setting_refresh_expired() -> None:
+    """Recompute the EffectiveOrgSettings of Orgs whose primary_plan has expired."""
+    expired = selectors.effective_org_setting_list(expires_at__lte=timezone.now())
+    effective_org_setting_refresh(
+        orgs=selectors.org_list(pk__in=expired.values("org_id"))
+    )
+
+
+def effective_org_user_setting_refresh(
+    *,
+    org_users: Optional[QuerySet[OrgUser]] = None,
+    setting: Optional[OrgUserSetting] = None,
+) -> None:
+    """Recompute the EffectiveOrgUserSettings of the OrgUsers for the OrgUserSetting.
+    All OrgUsers and all OrgUserSettings are refreshed if they are not provided."""
+    if org_users is None:
+        org_users = selectors.org_user_list()
+
+    if setting is None:
+        for org_user_setting in selectors.org_user_setting_list():
+            effective_org_user_setting_refresh(
+                org_users=org_users, setting=org_user_setting
+            )
+        return
+
+    instances = [
+        EffectiveOrgUserSetting(
+            org_user=org_user, setting=setting, value=org_user.setting_raw_value
+        )
+        for org_user in selectors.org_user_annotate_setting_value(
+            org_users=org_users.order_by(), setting=setting
+        ).iterator()
+    ]
+
+    model_bulk_create(
+        klass=EffectiveOrgUserSetting,
+        instances=instances,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["org_user", "setting"],
+        update_fields=["value", "updated_at"],
+    )
 
-def org_user_setting_default_create(**kwargs) -> OrgUserSettingDefault:
-    return model_create(klass=OrgUserSettingDefault, **kwargs)
 
+def effective_org_setting_refresh_on_commit(
+    *,
+    setting: Optional[OrgSetting] = None,
+    plan: Optional[Plan] = None,
+    org_id: Optional[int] = None,
+) -> None:
+    """Recompute the EffectiveOrgSettings of every Org, of the Orgs on the Plan or of the
+    Org, for the OrgSetting or for every OrgSetting, in a task once the current transaction
+    commits, since there may be many. Until the task runs, the EffectiveOrgSettings may
+    have the previous value."""
+    setting_id = setting.pk if setting is not None else None
+    plan_id = plan.pk if plan is not None else None
+    transaction.on_commit(
+        lambda: effective_org_setting_refresh_task.delay(
+            setting_id, plan_id=plan_id, org_id=org_id
+        )
+    )
 
-def plan_org_setting_create(**kwargs) -> PlanOrgSetting:
-    return model_create(klass=PlanOrgSetting, **kwargs)
+
+def effective_org_user_setting_refresh_on_commit(
+    *,
+    setting: Optional[OrgUserSetting] = None,
+    org_id: Optional[int] = None,
+    org_user_id: Optional[int] = None,
+) -> None:
+    """Recompute the EffectiveOrgUserSettings of every OrgUser, of the OrgUsers of the
+    Org or of the OrgUser, for the OrgUserSetting or for every OrgUserSetting, in a task
+    once the current transaction commits. Until the task runs, the
+    EffectiveOrgUserSettings may have the previous value."""
+    setting_id = setting.pk if setting is not None else None
+    transaction.on_commit(
+        lambda: effective_org_user_setting_refresh_task.delay(
+            setting_id, org_id=org_id, org_user_id=org_user_id
+        )
+    )
+
+
+def effective_settings_rebuild() -> None:
+    """Delete and recompute every EffectiveOrgSetting and EffectiveOrgUserSetting."""
+    with transaction.atomic():
+        selectors.effective_org_setting_list().delete()
+        selectors.effective_org_user_setting_list().delete()
+        effective_org_setting_refresh()
+        effective_org_user_setting_refresh()
+
+
+def setting_defaults_materialize() -> None:
+    """Create the OrgSettings and OrgUserSettings configured in ORG_SETTING_DEFAULTS and
+    ORG_USER_SETTING_DEFAULTS, along with a PlanOrgSetting for every Plan and an
+    OrgUserSettingDefault for every Org that doesn't have one. Existing rows are left as-is."""
+    model_bulk_create(
+        klass=OrgSetting,
+        instances=[
+            OrgSetting(slug=slug, **utils.get_org_setting_default_config(slug))
+            for slug in settings.ORG_SETTING_DEFAULTS
+        ],
+        ignore_conflicts=True,
+    )
+    model_bulk_create(
+        klass=OrgUserSetting,
+        instances=[
+            OrgUserSetting(slug=slug, **utils.get_org_user_setting_default_config(slug))
+            for slug in settings.ORG_USER_SETTING_DEFAULTS
+        ],
+        ignore_conflicts=True,
+    )
+    setting_registry_invalidate()
+
+    plans = list(selectors.plan_list().only("pk"))
+    for org_setting in selectors.org_setting_list():
+        model_bulk_create(
+            klass=PlanOrgSetting,
+            instances=[
+                PlanOrgSetting(
+                    plan=plan, setting=org_setting, value=org_setting.default
+                )
+                for plan in plans
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    orgs = list(selectors.org_list().only("pk"))
+    for org_user_setting in selectors.org_user_setting_list():
+        model_bulk_create(
+            klass=OrgUserSettingDefault,
+            instances=[
+                OrgUserSettingDefault(
+                    org=org, setting=org_user_setting, value=org_user_setting.default
+                )
+                for org in orgs
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    # New OrgSettings and OrgUserSettings change what gets resolved.
+    effective_org_setting_refresh()
+    effective_org_user_setting_refresh()
+    org_setting_cache_invalidate(
+        slugs=selectors.org_setting_list().values_list("slug", flat=True)
+    )
+
+
+def global_setting_create(**kwargs) -> GlobalSetting:
+    global_setting = model_create(klass=GlobalSetting, **kwargs)
+    global_setting_snapshot_invalidate()
+    return global_setting
+
+
+def org_setting_create(*, refresh_effective=True, **kwargs) -> OrgSetting:
+    """Create an OrgSetting and return the OrgSetting. The EffectiveOrgSettings needn't
+    be refreshed if it is created with the default it would otherwise resolve to."""
+    org_setting = model_create(klass=OrgSetting, **kwargs)
+    setting_registry_invalidate()
+    # Orgs may have cached a default from ORG_SETTING_DEFAULTS for this slug.
+    org_setting_cache_invalidate(slugs=[org_setting.slug])
+    if refresh_effective:
+        effective_org_setting_refresh_on_commit(setting=org_setting)
+    return org_setting
+
+
+def org_user_setting_create(*, refresh_effective=True, **kwargs) -> OrgUserSetting:
+    """Create an OrgUserSetting and return the OrgUserSetting. The
+    EffectiveOrgUserSettings needn't be refreshed if it is created with the default it
+    would otherwise resolve to."""
+    org_user_setting = model_create(klass=OrgUserSetting, **kwargs)
+    setting_registry_invalidate()
+    if refresh_effective:
+        effective_org_user_setting_refresh_on_commit(setting=org_user_setting)
+    org_user_setting_version_bump()
+    return org_user_setting
+
+
+def org_user_setting_default_create(
+    *, refresh_effective=True, **kwargs
+) -> OrgUserSettingDefault:
+    """Create an OrgUserSettingDefault and return the OrgUserSettingDefault. The
+    EffectiveOrgUserSettings needn't be refreshed if it has the OrgUserSetting's default."""
+    org_user_setting_default = model_create(klass=OrgUserSettingDefault, **kwargs)
+    if refresh_effective:
+        effective_org_user_setting_refresh_on_commit(
+            setting=org_user_setting_default.setting,
+            org_id=org_user_setting_default.org_id,
+        )
+    org_user_setting_version_bump(org_id=org_user_setting_default.org_id)
+    return org_user_setting_default
+
+
+def plan_org_setting_create(*, refresh_effective=True, **kwargs) -> PlanOrgSetting:
+    """Create a PlanOrgSetting and return the PlanOrgSetting. The EffectiveOrgSettings
+    needn't be refreshed if it has the OrgSetting's default."""
+    plan_org_setting = model_create(klass=PlanOrgSetting, **kwargs)
+    plan_org_setting_cache_invalidate(plan_org_setting=plan_org_setting)
+    if refresh_effective:
+        effective_org_setting_refresh_on_commit(
+            setting=plan_org_setting.setting, plan=plan_org_setting.plan
+        )
+    return plan_org_setting
 
 
 def overridden_org_setting_create(**kwargs) -> OverriddenOrgSetting:
-    return model_create(klass=OverriddenOrgSetting, **kwargs)
+    overridden_org_setting = model_create(klass=OverriddenOrgSetting, **kwargs)
+    org_setting_cache_invalidate(
+        org_ids=[overridden_org_setting.org_id],
+        slugs=[overridden_org_setting.setting.slug],
+    )
+    effective_org_setting_refresh_on_commit(
+        setting=overridden_org_setting.setting, org_id=overridden_org_setting.org_id
+    )
+    return overridden_org_setting
 
 
 def org_user_org_user_setting_create(**kwargs) -> OrgUserOrgUserSetting:
-    return model_create(klass=OrgUserOrgUserSetting, **kwargs)
+    org_user_org_user_setting = model_create(klass=OrgUserOrgUserSetting, **kwargs)
+    effective_org_user_setting_refresh(
+        org_users=selectors.org_user_list(pk=org_user_org_user_setting.org_user_id),
+        setting=org_user_org_user_setting.setting,
+    )
+    org_user_setting_version_bump(org_id=org_user_org_user_setting.org_user.org_id)
+    return org_user_org_user_setting
 
 
 def user_login(
@@ -965,7 +2656,13 @@ def user_login(
     if not user.is_active:
         raise ApplicationError("User is not active.")
 
-    django_login(request, user)
+    # Users that weren't authenticated by a backend, e.g., with Google, are logged in
+    # with the first one, since more than one is configured.
+    django_login(
+        request,
+        user,
+        backend=getattr(user, "backend", settings.AUTHENTICATION_BACKENDS[0]),
+    )
 
     if detected_tz:
         set_timezone(request=request, detected_tz=detected_tz)
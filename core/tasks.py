@@ -1,4 +1,5 @@
 from django.conf import settings
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
 from config.celery import app
 
@@ -29,6 +30,24 @@ def email_message_send(email_message_id):
     email_message_send(email_message=email_message)
 
 
+@app.task
+def email_message_send_batch(email_message_ids):
+    logger.info(
+        f"EmailMessage.ids={email_message_ids} email_message_send_batch task started"
+    )
+
+    from core import constants
+    from core.services import email_message_send_batch
+    from core.selectors import email_message_list
+
+    email_messages = list(
+        email_message_list(
+            id__in=email_message_ids, status=constants.EmailMessage.Status.READY
+        ).prefetch_related("attachments")
+    )
+    email_message_send_batch(email_messages=email_messages)
+
+
 @app.task(time_limit=60 * 60)
 def database_backup():
     from core.services import database_backup
@@ -36,6 +55,69 @@ def database_backup():
     database_backup()
 
 
+@app.task
+def effective_org_setting_refresh_expired():
+    from core.services import effective_org_setting_refresh_expired
+
+    effective_org_setting_refresh_expired()
+
+
+@app.task
+def effective_org_setting_refresh(setting_id=None, plan_id=None, org_id=None):
+    from core import selectors
+    from core.services import effective_org_setting_refresh
+
+    setting = None
+    if setting_id is not None:
+        setting = selectors.org_setting_list(pk=setting_id).first()
+        if setting is None:
+            return  # Deleted before the task ran.
+
+    orgs = None
+    if plan_id is not None:
+        plan = selectors.plan_list(pk=plan_id).first()
+        if plan is None:
+            return
+        orgs = selectors.org_list_on_plan(plan=plan)
+    if org_id is not None:
+        orgs = selectors.org_list(pk=org_id)
+    effective_org_setting_refresh(orgs=orgs, setting=setting)
+
+
+@app.task
+def effective_org_user_setting_refresh(setting_id=None, org_id=None, org_user_id=None):
+    from core import selectors
+    from core.services import effective_org_user_setting_refresh
+
+    setting = None
+    if setting_id is not None:
+        setting = selectors.org_user_setting_list(pk=setting_id).first()
+        if setting is None:
+            return  # Deleted before the task ran.
+
+    org_users = None
+    if org_id is not None:
+        org_users = selectors.org_user_list(org=org_id)
+    if org_user_id is not None:
+        org_users = selectors.org_user_list(pk=org_user_id)
+    effective_org_user_setting_refresh(org_users=org_users, setting=setting)
+
+
+@app.task
+def org_user_last_accessed_flush():
+    from core.services import org_user_last_accessed_flush
+
+    org_user_last_accessed_flush()
+
+
+@worker_process_init.connect
+def email_template_registry_build(**kwargs):
+    """Compile the email templates in each worker process before it sends anything."""
+    from core.services import email_template_registry_build
+
+    email_template_registry_build()
+
+
 @app.task
 def heartbeat():
     logger.info("django-base heartbeat (lub-dub)")
@@ -63,4 +145,26 @@ periodic = [
         },
         "enabled": settings.ENABLE_HEARTBEAT,
     },
+    # Recompute EffectiveOrgSettings of Orgs whose primary_plan expired, every 15 minutes.
+    {
+        "task": effective_org_setting_refresh_expired,
+        "name": effective_org_setting_refresh_expired.name,
+        "cron": {
+            "minute": "*/15",
+            "hour": "*",
+            "day_of_week": "*",
+        },
+        "enabled": settings.ENABLE_EFFECTIVE_SETTINGS_REFRESH,
+    },
+    # Write buffered OrgUser.last_accessed_at values every minute.
+    {
+        "task": org_user_last_accessed_flush,
+        "name": org_user_last_accessed_flush.name,
+        "cron": {
+            "minute": "*",
+            "hour": "*",
+            "day_of_week": "*",
+        },
+        "enabled": settings.ORG_USER_LAST_ACCESSED_BUFFER_URL is not None,
+    },
 ]
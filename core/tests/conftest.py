@@ -1,4 +1,5 @@
 import pytest
+from django.core.cache import cache
 
 from . import factories
 from .. import services
@@ -26,3 +27,12 @@ def ou(user, org):
 @pytest.fixture(autouse=True)
 def enable_db_access_for_all_tests(db):
     pass
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Cached values must not leak between tests since the database is rolled back."""
+    cache.clear()
+    services.global_setting_snapshot_invalidate()
+    services.setting_registry_invalidate()
+    services.org_domain_cache_invalidate()
@@ -0,0 +1,265 @@
+"""Tests related to EffectiveOrgSettings and EffectiveOrgUserSettings."""
+
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from freezegun import freeze_time
+
+from core import constants, selectors, services
+from core.tests import factories
+
+
+@pytest.fixture
+def org_setting(django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        return services.org_setting_create(
+            slug="for-test", default="1", type=constants.SettingType.INT
+        )
+
+
+@pytest.fixture
+def org_user_setting(django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        return services.org_user_setting_create(
+            slug="for-test",
+            default="5",
+            owner_value="100",
+            type=constants.SettingType.INT,
+        )
+
+
+def test_effective_org_setting_create(org, org_setting):
+    """Creating an OrgSetting materializes its default for every Org"""
+    effective = selectors.effective_org_setting_list(org=org, setting=org_setting).get()
+    assert effective.value == "1"
+    assert effective.expires_at == org.current_period_end
+
+
+def test_effective_org_setting_plan(
+    org, org_setting, django_capture_on_commit_callbacks
+):
+    """A PlanOrgSetting on the Org's primary_plan is reflected in the EffectiveOrgSetting
+    once the transaction commits"""
+    with django_capture_on_commit_callbacks(execute=True):
+        services.plan_org_setting_create(
+            plan=org.primary_plan, setting=org_setting, value="10"
+        )
+        # Not refreshed until the transaction commits.
+        assert services.org_get_effective_setting_value(org=org, slug="for-test") == 1
+
+    effective = selectors.effective_org_setting_list(org=org, setting=org_setting).get()
+    assert effective.value == "10"
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 10
+
+
+def test_effective_org_setting_overridden(
+    org, org_setting, django_capture_on_commit_callbacks
+):
+    """An OverriddenOrgSetting is reflected in the EffectiveOrgSetting"""
+    with django_capture_on_commit_callbacks(execute=True):
+        services.plan_org_setting_create(
+            plan=org.primary_plan, setting=org_setting, value="10"
+        )
+    with django_capture_on_commit_callbacks(execute=True):
+        overridden = services.overridden_org_setting_create(
+            org=org, setting=org_setting, value="20"
+        )
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 20
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.overridden_org_setting_update(instance=overridden, value="30")
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 30
+
+
+def test_effective_org_setting_primary_plan_change(
+    org, org_setting, django_capture_on_commit_callbacks
+):
+    """Changing an Org's primary_plan refreshes its EffectiveOrgSettings once the
+    transaction commits"""
+    plan = services.plan_create(name="New plan")
+    services.plan_org_setting_create(plan=plan, setting=org_setting, value="50")
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.org_update(instance=org, primary_plan=plan)
+        # Not refreshed in the request.
+        assert services.org_get_effective_setting_value(org=org, slug="for-test") == 1
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 50
+
+
+def test_effective_org_setting_expired(
+    org, org_setting, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    """An expired EffectiveOrgSetting is not used and is refreshed periodically"""
+    with django_capture_on_commit_callbacks(execute=True):
+        services.plan_org_setting_create(
+            plan=org.primary_plan, setting=org_setting, value="10"
+        )
+        services.plan_org_setting_create(
+            plan=org.default_plan, setting=org_setting, value="2"
+        )
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 10
+
+    with freeze_time(timezone.now() + timedelta(days=11)):
+        assert services.org_get_effective_setting_value(org=org, slug="for-test") == 2
+
+        services.effective_org_setting_refresh_expired()
+        effective = selectors.effective_org_setting_list(
+            org=org, setting=org_setting
+        ).get()
+        assert effective.value == "2"
+        assert effective.expires_at is None
+
+        with django_assert_num_queries(1):
+            assert (
+                services.org_get_effective_setting_value(org=org, slug="for-test") == 2
+            )
+
+
+def test_effective_org_user_setting(
+    ou, org_user_setting, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    """EffectiveOrgUserSettings follow OrgUserSettingDefaults and OrgUserOrgUserSettings"""
+    with django_assert_num_queries(1):
+        assert (
+            services.org_user_get_effective_setting_value(org_user=ou, slug="for-test")
+            == 5
+        )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.org_user_setting_default_create(
+            org=ou.org, setting=org_user_setting, value="10"
+        )
+    assert (
+        services.org_user_get_effective_setting_value(org_user=ou, slug="for-test")
+        == 10
+    )
+
+    services.org_user_org_user_setting_create(
+        org_user=ou, setting=org_user_setting, value="20"
+    )
+    assert (
+        services.org_user_get_effective_setting_value(org_user=ou, slug="for-test")
+        == 20
+    )
+
+
+def test_effective_org_user_setting_owner(
+    ou, org_user_setting, django_capture_on_commit_callbacks
+):
+    """The Org owner's EffectiveOrgUserSetting is the owner_value, including after an owner change"""
+    owner_ou = selectors.org_user_list(org=ou.org, user=ou.org.owner).get()
+    assert (
+        services.org_user_get_effective_setting_value(
+            org_user=owner_ou, slug="for-test"
+        )
+        == 100
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.org_update(instance=ou.org, owner=ou.user)
+    assert (
+        services.org_user_get_effective_setting_value(org_user=ou, slug="for-test")
+        == 100
+    )
+    assert (
+        services.org_user_get_effective_setting_value(
+            org_user=owner_ou, slug="for-test"
+        )
+        == 5
+    )
+
+
+def test_effective_settings_org_create(
+    org_setting, org_user_setting, user, django_capture_on_commit_callbacks
+):
+    """A new Org and its owner's OrgUser get their effective settings once the
+    transaction commits"""
+    with django_capture_on_commit_callbacks(execute=True):
+        org = factories.org_create(owner=user, domain="new.example.com")
+        assert not selectors.effective_org_setting_list(org=org).exists()
+    assert selectors.effective_org_setting_list(org=org).get().value == "1"
+    owner_ou = selectors.org_user_list(org=org, user=user).get()
+    assert (
+        selectors.effective_org_user_setting_list(org_user=owner_ou).get().value
+        == "100"
+    )
+
+
+def test_rebuild_effective_settings(org, ou, org_setting, org_user_setting):
+    """The rebuild_effective_settings command recomputes every effective setting"""
+    selectors.effective_org_setting_list().delete()
+    selectors.effective_org_user_setting_list().delete()
+
+    call_command("rebuild_effective_settings")
+
+    assert selectors.effective_org_setting_list(org=org).get().value == "1"
+    assert selectors.effective_org_user_setting_list(org_user=ou).get().value == "5"
+
+
+def test_effective_org_setting_not_refreshed_on_read(
+    org, django_capture_on_commit_callbacks
+):
+    """Materializing an OrgSetting and PlanOrgSetting on read doesn't refresh any
+    EffectiveOrgSettings, since they would resolve to the same default"""
+    with django_capture_on_commit_callbacks() as callbacks:
+        assert services.org_get_setting_value(org=org, slug="unknown") is False
+    assert callbacks == []
+    assert selectors.plan_org_setting_list(setting__slug="unknown").exists()
+    assert services.org_get_effective_setting_value(org=org, slug="unknown") is False
+
+
+def test_effective_org_setting_delete(
+    org, org_setting, django_capture_on_commit_callbacks
+):
+    """Deleting an OverriddenOrgSetting or PlanOrgSetting refreshes the EffectiveOrgSetting"""
+    with django_capture_on_commit_callbacks(execute=True):
+        plan_org_setting = services.plan_org_setting_create(
+            plan=org.primary_plan, setting=org_setting, value="10"
+        )
+    with django_capture_on_commit_callbacks(execute=True):
+        overridden = services.overridden_org_setting_create(
+            org=org, setting=org_setting, value="20"
+        )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 20
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 20
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.overridden_org_setting_delete(instance=overridden)
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+    assert services.org_get_effective_setting_value(org=org, slug="for-test") == 10
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.plan_org_setting_delete(instance=plan_org_setting)
+    effective = selectors.effective_org_setting_list(org=org, setting=org_setting).get()
+    assert effective.value == "1"
+    assert services.org_get_setting_value(org=org, slug="for-test") == 1
+
+
+def test_effective_org_user_setting_delete(
+    ou, org_user_setting, django_capture_on_commit_callbacks
+):
+    """Deleting an OrgUserOrgUserSetting or OrgUserSettingDefault refreshes the
+    EffectiveOrgUserSetting"""
+    with django_capture_on_commit_callbacks(execute=True):
+        org_user_setting_default = services.org_user_setting_default_create(
+            org=ou.org, setting=org_user_setting, value="10"
+        )
+    org_user_org_user_setting = services.org_user_org_user_setting_create(
+        org_user=ou, setting=org_user_setting, value="20"
+    )
+
+    services.org_user_org_user_setting_delete(instance=org_user_org_user_setting)
+    assert (
+        services.org_user_get_effective_setting_value(org_user=ou, slug="for-test")
+        == 10
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        services.org_user_setting_default_delete(instance=org_user_setting_default)
+    effective = selectors.effective_org_user_setting_list(
+        org_user=ou, setting=org_user_setting
+    ).get()
+    assert effective.value == "5"
@@ -1,5 +1,6 @@
 import tempfile
 from datetime import timedelta
+from unittest.mock import patch
 
 import pytest
 from django.utils import timezone
@@ -7,7 +8,7 @@ from freezegun import freeze_time
 
 from .. import factories
 
-from ... import constants, services
+from ... import backends, constants, services
 from ...exceptions import ApplicationError
 
 
@@ -207,6 +208,47 @@ def test_email_attachment_matching_mime(user):
         )
 
 
+def test_email_message_prepare_single_write(user, django_assert_num_queries, settings):
+    """Preparing an EmailMessage validates and writes it once."""
+    email_message = services.email_message_create(
+        created_by=user,
+        subject=" A subject ",
+        template_prefix="core/email/password_reset",
+        to_name=f" {user.name} ",
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+
+    # full_clean() checks that created_by exists and that uuid is unique, then INSERT.
+    with django_assert_num_queries(3):
+        services.email_message_prepare(email_message=email_message)
+
+    email_message.refresh_from_db()
+    assert email_message.status == constants.EmailMessage.Status.READY
+    assert email_message.to_name == user.name
+    assert email_message.subject == "A subject"
+    assert email_message.template_context["subject"] == "A subject"
+    assert email_message.postmark_message_stream == settings.POSTMARK_DEFAULT_STREAM_ID
+
+
+def test_email_message_prepare_no_save(user, django_assert_num_queries):
+    """With save=False, preparing an EmailMessage doesn't touch the database."""
+    email_message = services.email_message_create(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_email=user.email,
+    )
+    with django_assert_num_queries(0):
+        services.email_message_prepare(email_message=email_message, save=False)
+    assert email_message.pk is None
+    assert email_message.status == constants.EmailMessage.Status.READY
+
+
 def test_postmark_message_stream(user, mailoutbox):
     email_message = services.email_message_create(
         created_by=user,
@@ -275,6 +317,372 @@ def test_cooldown(user, mailoutbox):
         assert email_message.status == constants.EmailMessage.Status.SENT
 
 
+def test_email_message_bulk_queue(user, mailoutbox, django_capture_on_commit_callbacks):
+    """Many EmailMessages can be queued at once, with the same cooldown as one at a time"""
+    email_message_args = dict(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_name=user.name,
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    email_message = services.email_message_create(**email_message_args)
+    assert services.email_message_queue(email_message=email_message) is True
+    assert len(mailoutbox) == 1
+
+    cooling_down = services.email_message_create(**email_message_args)
+    other = services.email_message_create(
+        **{**email_message_args, "to_email": "someone.else@example.com"}
+    )
+    error = services.email_message_create(
+        **{**email_message_args, "reply_to_name": "Reply to name"}
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        queued = services.email_message_bulk_queue(
+            messages=[cooling_down, other, error]
+        )
+    assert queued == [other]
+    assert len(mailoutbox) == 2
+    assert mailoutbox[1].to == [f"{user.name} <someone.else@example.com>"]
+
+    for email_message, status in [
+        (cooling_down, constants.EmailMessage.Status.CANCELED),
+        (other, constants.EmailMessage.Status.SENT),
+        (error, constants.EmailMessage.Status.ERROR),
+    ]:
+        email_message.refresh_from_db()
+        assert email_message.status == status
+
+
+def test_email_message_bulk_queue_within_batch(
+    user, mailoutbox, django_capture_on_commit_callbacks
+):
+    """EmailMessages earlier in the same batch count towards the cooldown"""
+    email_message_args = dict(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_name=user.name,
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    first = services.email_message_create(**email_message_args)
+    duplicate = services.email_message_create(**email_message_args)
+    other = services.email_message_create(
+        **{**email_message_args, "to_email": "someone.else@example.com"}
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        queued = services.email_message_bulk_queue(messages=[first, duplicate, other])
+    assert queued == [first, other]
+    assert len(mailoutbox) == 2
+    duplicate.refresh_from_db()
+    assert duplicate.status == constants.EmailMessage.Status.CANCELED
+
+
+def test_email_message_bulk_queue_invalid(
+    user, mailoutbox, django_capture_on_commit_callbacks
+):
+    """An EmailMessage that fails validation is set to ERROR without failing the others"""
+    email_message_args = dict(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_name=user.name,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    invalid = services.email_message_create(
+        **email_message_args, to_email="not an email"
+    )
+    valid = services.email_message_create(**email_message_args, to_email=user.email)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        queued = services.email_message_bulk_queue(messages=[invalid, valid])
+    assert queued == [valid]
+    assert len(mailoutbox) == 1
+    assert invalid.status == constants.EmailMessage.Status.ERROR
+    assert "to_email" in invalid.error_message
+    assert invalid.pk is None
+
+
+def test_email_message_bulk_queue_render_error(
+    user, mailoutbox, django_capture_on_commit_callbacks
+):
+    """An EmailMessage whose template fails to render is set to ERROR without failing
+    the others"""
+    email_message_args = dict(
+        created_by=user,
+        to_name=user.name,
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    missing = services.email_message_create(
+        **email_message_args, template_prefix="core/email/does_not_exist"
+    )
+    valid = services.email_message_create(
+        **email_message_args, template_prefix="core/email/password_reset"
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        queued = services.email_message_bulk_queue(messages=[missing, valid])
+    assert queued == [valid]
+    assert len(mailoutbox) == 1
+    missing.refresh_from_db()
+    assert missing.status == constants.EmailMessage.Status.ERROR
+    assert "TemplateDoesNotExist" in missing.error_message
+
+
+def test_email_message_bulk_queue_on_commit(
+    user, mailoutbox, django_capture_on_commit_callbacks
+):
+    """Batches are dispatched once the transaction commits, since the task only sends
+    committed EmailMessages"""
+    email_message = services.email_message_create(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    with django_capture_on_commit_callbacks() as callbacks:
+        services.email_message_bulk_queue(messages=[email_message])
+    assert len(mailoutbox) == 0
+    assert len(callbacks) == 1
+
+    callbacks[0]()
+    assert len(mailoutbox) == 1
+
+
+def test_email_message_send_batch(user, settings, django_capture_on_commit_callbacks):
+    """A batch of EmailMessages is sent over one connection and updated in bulk"""
+    settings.EMAIL_BACKEND = "core.backends.LatencyEmailBackend"
+    settings.EMAIL_BACKEND_CONNECT_LATENCY = 0
+    settings.EMAIL_BACKEND_REQUEST_LATENCY = 0
+    email_messages = [
+        services.email_message_create(
+            created_by=user,
+            subject="A subject",
+            template_prefix="core/email/password_reset",
+            to_email=f"user{i}@example.com",
+            template_context={
+                "user_name": user.name,
+                "user_email": user.email,
+                "password_reset_url": "",
+            },
+        )
+        for i in range(3)
+    ]
+    connections_opened = backends.LatencyEmailBackend.connections_opened
+
+    # Sent in eager mode by the email_message_send_batch task.
+    with django_capture_on_commit_callbacks(execute=True):
+        queued = services.email_message_bulk_queue(messages=email_messages)
+    assert len(queued) == 3
+    assert backends.LatencyEmailBackend.connections_opened == connections_opened + 1
+
+    message_ids = set()
+    for email_message in email_messages:
+        email_message.refresh_from_db()
+        assert email_message.status == constants.EmailMessage.Status.SENT
+        assert email_message.sent_at is not None
+        assert email_message.updated_at >= email_message.sent_at
+        message_ids.add(email_message.message_id)
+    assert None not in message_ids and len(message_ids) == 3
+
+
+def test_email_message_send_batch_delivery_unknown(
+    user, settings, django_capture_on_commit_callbacks
+):
+    """If the backend raises partway through a batch, the EmailMessages are left PENDING
+    rather than set to ERROR, since some may have been delivered"""
+    settings.EMAIL_BACKEND = "core.backends.LatencyEmailBackend"
+    settings.EMAIL_BACKEND_CONNECT_LATENCY = 0
+    settings.EMAIL_BACKEND_REQUEST_LATENCY = 0
+    email_messages = [
+        services.email_message_create(
+            created_by=user,
+            subject="A subject",
+            template_prefix="core/email/password_reset",
+            to_email=f"user{i}@example.com",
+            template_context={
+                "user_name": user.name,
+                "user_email": user.email,
+                "password_reset_url": "",
+            },
+        )
+        for i in range(2)
+    ]
+
+    with (
+        patch.object(
+            backends.LatencyEmailBackend,
+            "send_messages",
+            side_effect=TimeoutError("Timed out"),
+        ),
+        django_capture_on_commit_callbacks(execute=True),
+    ):
+        services.email_message_bulk_queue(messages=email_messages)
+
+    for email_message in email_messages:
+        email_message.refresh_from_db()
+        assert email_message.status == constants.EmailMessage.Status.PENDING
+        assert email_message.sent_at is None
+        assert "Delivery unknown" in email_message.error_message
+
+
+def test_email_message_send_batch_disabled(
+    user, mailoutbox, django_capture_on_commit_callbacks
+):
+    """A batch is not sent if outbound email is disabled"""
+    services.global_setting_create(
+        slug="disable_outbound_email", type=constants.SettingType.BOOL, value="true"
+    )
+    email_message = services.email_message_create(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        services.email_message_bulk_queue(messages=[email_message])
+    assert len(mailoutbox) == 0
+    email_message.refresh_from_db()
+    assert email_message.status == constants.EmailMessage.Status.ERROR
+    assert "disable_outbound_email" in email_message.error_message
+
+
+def test_cooldown_counter(user, settings, monkeypatch, django_assert_num_queries):
+    """With a cooldown counter, cooldown checks match the SQL ones without querying"""
+    settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_URL = "memory://"
+    monkeypatch.setattr(services, "_email_message_cooldown_counter", None)
+    email_message_args = dict(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_name=user.name,
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    email_message = services.email_message_create(**email_message_args)
+    assert services.email_message_queue(email_message=email_message) is True
+
+    same = services.email_message_create(**email_message_args)
+    other = services.email_message_create(
+        **{**email_message_args, "to_email": "someone.else@example.com"}
+    )
+    for scopes, expected in [
+        (["created_by", "template_prefix", "to"], [True, False]),
+        (["created_by", "template_prefix"], [True, True]),
+        ([], [True, True]),
+    ]:
+        with django_assert_num_queries(0):
+            counted = services.email_message_check_cooling_down_bulk(
+                email_messages=[same, other], period=180, allowed=1, scopes=scopes
+            )
+        assert counted == expected
+        settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_URL = None
+        assert (
+            services.email_message_check_cooling_down_bulk(
+                email_messages=[same, other], period=180, allowed=1, scopes=scopes
+            )
+            == expected
+        )
+        settings.EMAIL_MESSAGE_COOLDOWN_COUNTER_URL = "memory://"
+
+    with django_assert_num_queries(0):
+        assert (
+            services.email_message_check_cooling_down(
+                email_message=same,
+                period=180,
+                allowed=1,
+                scopes=["created_by", "template_prefix", "to"],
+            )
+            is True
+        )
+
+    with freeze_time(timezone.now() + timedelta(seconds=181)):
+        assert (
+            services.email_message_check_cooling_down(
+                email_message=same,
+                period=180,
+                allowed=1,
+                scopes=["created_by", "template_prefix", "to"],
+            )
+            is False
+        )
+
+
+def test_email_message_check_cooling_down_bulk(user, django_assert_num_queries):
+    """The cooldown of many EmailMessages is checked in one query"""
+    sent = factories.email_message_create(
+        created_by=user,
+        sent_at=timezone.now(),
+        status=constants.EmailMessage.Status.SENT,
+    )
+    email_messages = [
+        services.email_message_create(
+            created_by=sent.created_by,
+            template_prefix=sent.template_prefix,
+            to_email=sent.to_email,
+        ),
+        services.email_message_create(
+            created_by=None,
+            template_prefix=sent.template_prefix,
+            to_email=sent.to_email,
+        ),
+    ]
+
+    with django_assert_num_queries(1):
+        assert services.email_message_check_cooling_down_bulk(
+            email_messages=email_messages,
+            period=180,
+            allowed=1,
+            scopes=["created_by", "template_prefix", "to"],
+        ) == [True, False]
+
+    # Without the created_by scope, both are cooling down.
+    assert services.email_message_check_cooling_down_bulk(
+        email_messages=email_messages,
+        period=180,
+        allowed=1,
+        scopes=["template_prefix", "to"],
+    ) == [True, True]
+    # The first counts against the second, since it will be sent.
+    assert services.email_message_check_cooling_down_bulk(
+        email_messages=email_messages, period=180, allowed=2, scopes=[]
+    ) == [False, True]
+
+
 def test_cooldown_scopes(user, mailoutbox):
     """Email cancellation can be tightened by removing scopes"""
     email_message_args = dict(
@@ -410,3 +818,37 @@ def test_reply_to_name_no_email(user, mailoutbox, settings):
     email_message.refresh_from_db()
     assert email_message.status == constants.EmailMessage.Status.ERROR
     assert len(mailoutbox) == 0
+
+
+def test_email_template_registry(user, mailoutbox):
+    """Email templates are compiled once per template_prefix and their renders are timed"""
+    services.email_template_registry_build()
+    templates = services._email_templates["core/email/password_reset"]
+    assert templates.txt is not None
+    assert templates.html is not None
+    assert templates.subject is None
+
+    # Earlier tests may have rendered this and other template_prefixes already.
+    timing = services.email_template_get_timings().get("core/email/password_reset")
+    count = timing.count if timing is not None else 0
+
+    email_message = services.email_message_create(
+        created_by=user,
+        subject="A subject",
+        template_prefix="core/email/password_reset",
+        to_email=user.email,
+        template_context={
+            "user_name": user.name,
+            "user_email": user.email,
+            "password_reset_url": "",
+        },
+    )
+    with patch.object(services, "get_template") as mock:
+        services.email_message_queue(email_message=email_message)
+    mock.assert_not_called()
+    assert len(mailoutbox) == 1
+    assert mailoutbox[0].alternatives
+
+    timing = services.email_template_get_timings()["core/email/password_reset"]
+    assert timing.count == count + 2
+    assert timing.seconds > 0
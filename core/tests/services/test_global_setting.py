@@ -0,0 +1,78 @@
+"""Tests related to GlobalSettings."""
+
+from datetime import timedelta
+
+from django.test import override_settings
+from freezegun import freeze_time
+
+from core import constants, selectors, services
+from ...models import GlobalSetting
+
+
+def test_global_setting_get_value_noexist():
+    """global_setting_get_value() creates a GlobalSetting as False if it does not exist"""
+    assert services.global_setting_get_value("for-test") is False
+    assert selectors.global_setting_list(slug="for-test").count() == 1
+
+
+@override_settings(GLOBAL_SETTING_SNAPSHOT_INTERVAL=5)
+def test_global_setting_get_value_created_elsewhere():
+    """A GlobalSetting missing from a stale snapshot is read rather than created again"""
+    with freeze_time():
+        assert services.global_setting_get_value("other") is False
+
+        # Bypass the services so the snapshot is not invalidated.
+        services.model_create(
+            klass=GlobalSetting,
+            slug="for-test",
+            type=constants.SettingType.BOOL,
+            value="true",
+        )
+        assert services.global_setting_get_value("for-test") is True
+        assert selectors.global_setting_list(slug="for-test").count() == 1
+
+
+def test_global_setting_get_value_snapshot(django_assert_num_queries):
+    """global_setting_get_value() reads from the in-process snapshot"""
+    services.global_setting_create(
+        slug="for-test", type=constants.SettingType.INT, value="5"
+    )
+    assert services.global_setting_get_value("for-test") == 5
+
+    with django_assert_num_queries(0):
+        assert services.global_setting_get_value("for-test") == 5
+
+
+def test_global_setting_get_value_service_update():
+    """Changes through services are visible immediately in the same process"""
+    setting = services.global_setting_create(
+        slug="for-test", type=constants.SettingType.BOOL, value="false"
+    )
+    assert services.global_setting_get_value("for-test") is False
+
+    services.global_setting_update(instance=setting, value="true")
+    assert services.global_setting_get_value("for-test") is True
+
+
+@override_settings(GLOBAL_SETTING_SNAPSHOT_INTERVAL=5)
+def test_global_setting_get_value_version_polling(django_assert_num_queries):
+    """Changes made elsewhere are picked up once the version stamp is checked again"""
+    with freeze_time() as frozen:
+        setting = services.global_setting_create(
+            slug="for-test", type=constants.SettingType.BOOL, value="false"
+        )
+        assert services.global_setting_get_value("for-test") is False
+
+        # Simulate a change by another process.
+        selectors.global_setting_list(pk=setting.pk).update(
+            value="true", updated_at=setting.updated_at + timedelta(seconds=1)
+        )
+        assert services.global_setting_get_value("for-test") is False
+
+        frozen.tick(timedelta(seconds=6))
+        assert services.global_setting_get_value("for-test") is True
+
+        # Only the version stamp is checked when nothing changed.
+        frozen.tick(timedelta(seconds=6))
+        with django_assert_num_queries(1):
+            assert services.global_setting_get_value("for-test") is True
@@ -1,6 +1,10 @@
+from datetime import timedelta
 from unittest.mock import MagicMock
 import pytest
 from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.utils import timezone
+from freezegun import freeze_time
 
 from .. import factories
 from ... import models, services, selectors
@@ -73,3 +77,111 @@ def test_org_create_default_plan(user):
 
     assert org.primary_plan == plan
     assert org.default_plan == plan
+
+
+def test_org_user_record_access_throttled(ou, django_assert_num_queries):
+    """Recent accesses aren't written again within the granularity"""
+    with django_assert_num_queries(0):
+        services.org_user_record_access(org_user=ou)
+
+
+def test_org_user_record_access(ou, settings):
+    """Accesses older than the granularity are written with a single UPDATE"""
+    last_accessed_at = timezone.now() - timedelta(
+        seconds=settings.ORG_USER_LAST_ACCESSED_GRANULARITY + 1
+    )
+    selectors.org_user_list(pk=ou.pk).update(last_accessed_at=last_accessed_at)
+    ou.refresh_from_db()
+
+    services.org_user_record_access(org_user=ou)
+    ou.refresh_from_db()
+    assert ou.last_accessed_at > last_accessed_at
+
+
+def test_org_user_record_access_other_more_recent(user, ou):
+    """A recent access is written if another of the user's OrgUsers was accessed since"""
+    other_org = factories.org_create()
+    other_ou = services.org_user_create(org=other_org, user=user)
+    assert other_ou.last_accessed_at > ou.last_accessed_at
+
+    services.org_user_record_access(org_user=ou, others=[other_ou])
+    assert selectors.org_get_recent_for_user(user, "testserver") == ou.org
+
+
+def test_user_get_available_orgs(user, org, django_assert_num_queries):
+    """A user's available orgs are cached until their memberships change"""
+    other_org = factories.org_create()
+    services.org_user_create(org=other_org, user=user)
+
+    available_orgs = services.user_get_available_orgs(user=user, exclude=org)
+    assert [o["id"] for o in available_orgs] == [other_org.pk]
+    assert "users" not in available_orgs[0]
+
+    with django_assert_num_queries(0):
+        services.user_get_available_orgs(user=user, exclude=org)
+
+    # Org changes are reflected.
+    services.org_update(instance=other_org, name="Renamed")
+    available_orgs = services.user_get_available_orgs(user=user, exclude=org)
+    assert available_orgs[0]["name"] == "Renamed"
+
+    # New and deleted memberships are reflected.
+    third_org = factories.org_create()
+    ou = services.org_user_create(org=third_org, user=user)
+    assert len(services.user_get_available_orgs(user=user, exclude=org)) == 2
+
+    services.org_user_delete(instance=ou)
+    assert len(services.user_get_available_orgs(user=user, exclude=org)) == 1
+
+
+@override_settings(
+    AVAILABLE_ORGS_CACHE_TIMEOUT=3600, ORG_USER_PERMISSION_CACHE_TIMEOUT=60
+)
+def test_user_get_available_orgs_not_shared(user, org):
+    """Without a shared cache or the invalidation bus, available orgs are cached briefly,
+    since other processes could not evict them."""
+    with freeze_time() as frozen:
+        assert [o["id"] for o in services.user_get_available_orgs(user=user)] == [
+            org.pk
+        ]
+
+        # Bypass the services, as if another process made the change.
+        models.OrgUser.objects.filter(user=user).delete()
+        assert len(services.user_get_available_orgs(user=user)) == 1
+
+        frozen.tick(timedelta(seconds=61))
+        assert services.user_get_available_orgs(user=user) == []
+
+
+def test_org_get_ids_for_domain(org, django_assert_num_queries):
+    """Active Org ids by domain are cached until an Org is created or updated"""
+    domain = org.domain
+    with django_assert_num_queries(1):
+        assert org.pk in services.org_get_ids_for_domain(domain=domain)
+    with django_assert_num_queries(0):
+        assert org.pk in services.org_get_ids_for_domain(domain=domain)
+
+    services.org_update(instance=org, domain="other.example.com")
+    assert org.pk not in services.org_get_ids_for_domain(domain=domain)
+    assert services.org_get_ids_for_domain(domain="other.example.com") == {org.pk}
+
+    services.org_update(instance=org, is_active=False)
+    assert not services.org_get_ids_for_domain(domain="other.example.com")
+
+    other_org = factories.org_create(domain="other.example.com")
+    assert services.org_get_ids_for_domain(domain="other.example.com") == {other_org.pk}
+
+
+@override_settings(ORG_DOMAIN_CACHE_TIMEOUT=60)
+def test_org_get_ids_for_domain_timeout(org):
+    """Active Org ids by domain, including none, are read again once they time out, to
+    pick up changes made by other processes"""
+    with freeze_time() as frozen:
+        assert services.org_get_ids_for_domain(domain="new.example.com") == frozenset()
+
+        # Bypass the services, as if another process made the change.
+        models.Org.objects.filter(pk=org.pk).update(domain="new.example.com")
+        assert services.org_get_ids_for_domain(domain="new.example.com") == frozenset()
+
+        frozen.tick(timedelta(seconds=61))
+        assert services.org_get_ids_for_domain(domain="new.example.com") == {org.pk}
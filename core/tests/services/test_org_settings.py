@@ -2,15 +2,20 @@
 
 import pytest
 from datetime import timedelta
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import override_settings
+from django.utils import timezone
 from freezegun import freeze_time
 from ...models import (
     OrgSetting,
     OrgUserSetting,
+    OrgUserSettingDefault,
     PlanOrgSetting,
     OverriddenOrgSetting,
 )
-from core import constants, services
+from core import constants, selectors, services
+from .. import factories
 
 
 @pytest.fixture
@@ -186,9 +191,7 @@ def test_org_user_get_setting_from_defaults(org):
     assert result is False  # User is not the owner
 
     # Test integer setting from defaults
-    result = services.org_user_get_setting_value(
-        org_user=org_user, slug="max_exports"
-    )
+    result = services.org_user_get_setting_value(org_user=org_user, slug="max_exports")
     settings = OrgUserSetting.objects.filter(slug="max_exports")
     assert len(settings) == 1
     setting = settings.first()
@@ -224,3 +227,360 @@ def test_org_user_get_setting_from_defaults(org):
     assert setting.owner_value == "true"
     assert setting.type == constants.SettingType.BOOL
     assert result is False
+
+
+def test_org_get_setting_cached(org, org_setting, django_assert_num_queries):
+    """org_get_setting_value() caches the resolved value so repeat calls don't hit the database."""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    with django_assert_num_queries(0):
+        assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+
+def test_org_get_setting_cache_invalidated_by_override(org, org_setting):
+    """Creating or updating an OverriddenOrgSetting invalidates the cached value."""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    overridden = services.overridden_org_setting_create(
+        org=org, setting=org_setting, value="20"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 20
+
+    services.overridden_org_setting_update(instance=overridden, value="30")
+    assert services.org_get_setting_value(org=org, slug="for-test") == 30
+
+
+def test_org_get_setting_cache_invalidated_by_plan(org, org_setting):
+    """Updating a PlanOrgSetting invalidates the cached value for Orgs on that Plan."""
+    plan_org_setting = services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    services.plan_org_setting_update(instance=plan_org_setting, value="20")
+    assert services.org_get_setting_value(org=org, slug="for-test") == 20
+
+
+def test_org_get_setting_cache_invalidated_by_org_update(org, org_setting):
+    """Switching an Org's primary_plan does not serve the old Plan's cached value."""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    services.plan_org_setting_create(
+        plan=org.default_plan, setting=org_setting, value="20"
+    )
+    services.org_update(instance=org, primary_plan=org.default_plan)
+    assert services.org_get_setting_value(org=org, slug="for-test") == 20
+
+
+def test_org_get_setting_cache_invalidated_by_org_setting_update(org):
+    """Updating an OrgSetting's type invalidates the cached value."""
+    org_setting = services.org_setting_create(
+        slug="for-test", default="5", type=constants.SettingType.STR
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == "5"
+
+    services.org_setting_update(instance=org_setting, type=constants.SettingType.INT)
+    assert services.org_get_setting_value(org=org, slug="for-test") == 5
+
+
+def test_org_setting_cache_invalidate_generations(org, org_setting):
+    """Evicting a slug for every Org, or every slug for an Org, doesn't touch the rest."""
+    other_org_setting = services.org_setting_create(
+        slug="other", default="1", type=constants.SettingType.INT
+    )
+    other_org = factories.org_create()
+    for o in (org, other_org):
+        assert services.org_get_setting_values(org=o, slugs=["for-test", "other"]) == {
+            "for-test": 5,
+            "other": 1,
+        }
+
+    # Bypass the services so the cache is not invalidated.
+    OrgSetting.objects.filter(pk=org_setting.pk).update(default="6")
+    OrgSetting.objects.filter(pk=other_org_setting.pk).update(default="2")
+    PlanOrgSetting.objects.filter(setting=org_setting).update(value="6")
+    PlanOrgSetting.objects.filter(setting=other_org_setting).update(value="2")
+
+    services.org_setting_cache_invalidate(slugs=["for-test"])
+    for o in (org, other_org):
+        assert services.org_get_setting_value(org=o, slug="for-test") == 6
+        assert services.org_get_setting_value(org=o, slug="other") == 1
+
+    services.org_setting_cache_invalidate(org_ids=[other_org.pk])
+    assert services.org_get_setting_value(org=org, slug="other") == 1
+    assert services.org_get_setting_value(org=other_org, slug="other") == 2
+
+
+def test_org_get_setting_cache_timeout_current_period_end(org, org_setting):
+    """The cached value expires no later than Org.current_period_end."""
+    services.org_update(
+        instance=org,
+        default_plan=org.primary_plan,
+        current_period_end=timezone.now() + timedelta(seconds=10),
+    )
+    plan_org_setting = services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    # Bypass the services so the cache is not invalidated.
+    PlanOrgSetting.objects.filter(pk=plan_org_setting.pk).update(value="20")
+
+    with freeze_time(timezone.now() + timedelta(seconds=5)):
+        assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    with freeze_time(timezone.now() + timedelta(seconds=11)):
+        assert services.org_get_setting_value(org=org, slug="for-test") == 20
+
+
+@override_settings(
+    ORG_SETTING_DEFAULTS={"max_items": {"type": "int", "default": "100"}}
+)
+def test_org_get_setting_values(org, django_assert_num_queries):
+    """org_get_setting_values() resolves many settings for an Org in one query"""
+    overridden = services.org_setting_create(
+        slug="overridden", default="1", type=constants.SettingType.INT
+    )
+    on_plan = services.org_setting_create(
+        slug="on-plan", default="false", type=constants.SettingType.BOOL
+    )
+    services.org_setting_create(
+        slug="default-only", default="hello", type=constants.SettingType.STR
+    )
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=overridden, value="2"
+    )
+    services.overridden_org_setting_create(org=org, setting=overridden, value="3")
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=on_plan, value="true"
+    )
+
+    slugs = ["overridden", "on-plan", "default-only", "max_items", "unknown"]
+    with django_assert_num_queries(1):
+        result = services.org_get_setting_values(org=org, slugs=slugs)
+
+    assert result == {
+        "overridden": 3,
+        "on-plan": True,
+        "default-only": "hello",
+        "max_items": 100,  # From ORG_SETTING_DEFAULTS
+        "unknown": False,  # Hardcoded fallback
+    }
+    # Settings that don't exist are not created.
+    assert not OrgSetting.objects.filter(slug__in=["max_items", "unknown"]).exists()
+
+    # Results match the single-setting resolution.
+    for slug in ["overridden", "on-plan", "default-only"]:
+        assert services.org_get_setting_value(org=org, slug=slug) == result[slug]
+
+
+def test_org_get_setting_values_cached(org, org_setting, django_assert_num_queries):
+    """org_get_setting_values() shares the cache with org_get_setting_value()"""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    with django_assert_num_queries(0):
+        result = services.org_get_setting_values(org=org, slugs=["for-test"])
+    assert result == {"for-test": 10}
+
+
+def test_org_get_setting_values_plan_expired(org, org_setting):
+    """org_get_setting_values() uses the default_plan once the primary_plan expires."""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    services.plan_org_setting_create(
+        plan=org.default_plan, setting=org_setting, value="30"
+    )
+    assert services.org_get_setting_values(org=org, slugs=["for-test"]) == {
+        "for-test": 10
+    }
+    with freeze_time(org.current_period_end + timedelta(seconds=1)):
+        assert services.org_get_setting_values(org=org, slugs=["for-test"]) == {
+            "for-test": 30
+        }
+
+
+def test_org_list_with_setting_value(org, org_setting):
+    """org_list_with_setting_value() annotates each Org with the value that applies to it"""
+    plan_org = factories.org_create()
+    overridden_org = factories.org_create()
+    expired_org = factories.org_create()
+    for o in (org, plan_org, overridden_org, expired_org):
+        services.plan_org_setting_create(
+            plan=o.default_plan, setting=org_setting, value="1"
+        )
+    services.plan_org_setting_create(
+        plan=plan_org.primary_plan, setting=org_setting, value="20"
+    )
+    services.plan_org_setting_create(
+        plan=expired_org.primary_plan, setting=org_setting, value="30"
+    )
+    services.overridden_org_setting_create(
+        org=overridden_org, setting=org_setting, value="40"
+    )
+    services.org_update(
+        instance=expired_org, current_period_end=timezone.now() - timedelta(days=1)
+    )
+
+    orgs = selectors.org_list_with_setting_value(slug="for-test")
+    values = {o: o.setting_value for o in orgs}
+    assert values == {org: 5, plan_org: 20, overridden_org: 40, expired_org: 1}
+
+    # The values agree with the services.
+    for o in values:
+        assert services.org_get_setting_value(org=o, slug="for-test") == values[o]
+
+    # Filtering happens in SQL
+    assert set(
+        selectors.org_list_with_setting_value(slug="for-test").filter(
+            setting_value__gt=10
+        )
+    ) == {plan_org, overridden_org}
+
+
+@override_settings(
+    ORG_SETTING_DEFAULTS={"feature_x_enabled": {"type": "bool", "default": "true"}}
+)
+def test_org_list_with_setting_value_bool(org):
+    """org_list_with_setting_value() casts booleans and honours settings that don't exist yet"""
+    orgs = selectors.org_list_with_setting_value(slug="feature_x_enabled")
+    assert list(orgs.filter(setting_value=True)) == [org]
+    assert not OrgSetting.objects.filter(slug="feature_x_enabled").exists()
+
+    setting = services.org_setting_create(
+        slug="feature_x_enabled", type=constants.SettingType.BOOL, default="false"
+    )
+    services.overridden_org_setting_create(org=org, setting=setting, value="True")
+    other_org = factories.org_create()
+
+    orgs = selectors.org_list_with_setting_value(slug="feature_x_enabled")
+    assert list(orgs.filter(setting_value=True)) == [org]
+    assert list(orgs.filter(setting_value=False)) == [other_org]
+
+
+@override_settings(
+    SETTINGS_MATERIALIZE_ON_READ=False,
+    ORG_SETTING_DEFAULTS={"max_items": {"type": "int", "default": "100"}},
+    ORG_USER_SETTING_DEFAULTS={
+        "can_export": {"type": "bool", "default": "false", "owner_value": "true"}
+    },
+)
+def test_get_setting_value_read_only(org, ou, org_setting):
+    """When SETTINGS_MATERIALIZE_ON_READ is False, reading settings never creates rows"""
+    assert services.org_get_setting_value(org=org, slug="max_items") == 100
+    assert services.org_get_setting_value(org=org, slug="for-test") == 1
+    assert OrgSetting.objects.count() == 1
+    assert PlanOrgSetting.objects.count() == 0
+
+    owner_ou = selectors.org_user_list(org=org, user=org.owner).get()
+    assert services.org_user_get_setting_value(org_user=ou, slug="can_export") is False
+    assert (
+        services.org_user_get_setting_value(org_user=owner_ou, slug="can_export")
+        is True
+    )
+    assert OrgUserSetting.objects.count() == 0
+
+
+@override_settings(
+    SETTINGS_MATERIALIZE_ON_READ=False,
+    ORG_SETTING_DEFAULTS={"max_items": {"type": "int", "default": "100"}},
+)
+def test_get_setting_value_read_only_definition_created(org):
+    """A cached default is discarded once the OrgSetting is created"""
+    assert services.org_get_setting_value(org=org, slug="max_items") == 100
+
+    services.org_setting_create(
+        slug="max_items", default="5", type=constants.SettingType.INT
+    )
+    assert services.org_get_setting_value(org=org, slug="max_items") == 5
+
+
+@override_settings(
+    ORG_SETTING_DEFAULTS={"max_items": {"type": "int", "default": "100"}},
+    ORG_USER_SETTING_DEFAULTS={
+        "can_export": {"type": "bool", "default": "false", "owner_value": "true"}
+    },
+)
+def test_materialize_setting_defaults(org, org_setting):
+    """materialize_setting_defaults creates missing settings rows and keeps existing ones"""
+    existing = services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+
+    call_command("materialize_setting_defaults")
+    call_command("materialize_setting_defaults")  # Idempotent
+
+    assert OrgSetting.objects.count() == 2
+    assert OrgUserSetting.objects.count() == 1
+    plan_count = selectors.plan_list().count()
+    assert PlanOrgSetting.objects.count() == 2 * plan_count
+    assert OrgUserSettingDefault.objects.count() == selectors.org_list().count()
+
+    existing.refresh_from_db()
+    assert existing.value == "10"
+    assert services.org_get_setting_value(org=org, slug="max_items") == 100
+
+
+def test_setting_registry_skips_definition_query(
+    org, ou, org_setting, django_assert_num_queries
+):
+    """Once the setting registry is built, resolving a value doesn't query definitions"""
+    services.plan_org_setting_create(
+        plan=org.primary_plan, setting=org_setting, value="10"
+    )
+    assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    cache.clear()  # Skip the cached value but keep the registry.
+    with django_assert_num_queries(2):  # OverriddenOrgSetting and PlanOrgSetting
+        assert services.org_get_setting_value(org=org, slug="for-test") == 10
+
+    with django_assert_num_queries(0):
+        assert services.org_setting_get_definition("for-test").default == 1  # Pre-cast
+
+
+def test_setting_registry_stale_definition_created_elsewhere(org):
+    """An OrgSetting missing from a stale registry is read rather than created again"""
+    assert services.org_get_setting_value(org=org, slug="other") is False
+
+    # Bypass the services so the registry is not invalidated.
+    services.model_create(
+        klass=OrgSetting, slug="for-test", default="5", type=constants.SettingType.INT
+    )
+    assert services.org_setting_get_definition("for-test").pk is None
+
+    assert services.org_get_setting_value(org=org, slug="for-test") == 5
+    assert OrgSetting.objects.filter(slug="for-test").count() == 1
+    assert services.org_setting_get_definition("for-test").pk is not None
+
+
+def test_setting_registry_refreshed_on_definition_change(org):
+    """Changing a definition through services refreshes the setting registry"""
+    org_setting = services.org_setting_create(
+        slug="for-test", default="5", type=constants.SettingType.INT
+    )
+    assert services.org_setting_get_definition("for-test").default == 5
+
+    services.org_setting_update(instance=org_setting, default="6")
+    assert services.org_setting_get_definition("for-test").default == 6
+
+
+@override_settings(
+    ORG_SETTING_DEFAULTS={"max_items": {"type": "int", "default": "100"}},
+)
+def test_setting_registry_from_defaults(org):
+    """The setting registry includes ORG_SETTING_DEFAULTS that aren't in the database"""
+    definition = services.org_setting_get_definition("max_items")
+    assert definition.pk is None
+    assert definition.default == 100
@@ -6,7 +6,8 @@ from ...models import (
     OrgUserSettingDefault,
     OrgUserOrgUserSetting,
 )
-from core import constants, services
+from core import constants, selectors, services
+from .. import factories
 
 
 @pytest.fixture
@@ -16,6 +17,22 @@ def org_user_setting():
     )
 
 
+def test_ou_get_setting_stale_definition_created_elsewhere(ou):
+    """An OrgUserSetting missing from a stale registry is read rather than created again"""
+    assert services.org_user_get_setting_value(org_user=ou, slug="other") is False
+
+    # Bypass the services so the registry is not invalidated.
+    services.model_create(
+        klass=OrgUserSetting,
+        slug="for-test",
+        default="5",
+        owner_value="100",
+        type=constants.SettingType.INT,
+    )
+    assert services.org_user_get_setting_value(org_user=ou, slug="for-test") == 5
+    assert OrgUserSetting.objects.filter(slug="for-test").count() == 1
+
+
 def test_ou_get_setting_noexist(ou):
     """org_user_get_setting() will create a boolean OrgUserSetting with a default of false and owner_value of true if it is accessed but does not exist"""
     assert OrgUserSetting.objects.count() == 0  # No OrgUserSettings yet.
@@ -103,3 +120,39 @@ def test_ou_owner(org, ou, org_user_setting):
     assert OrgUserOrgUserSetting.objects.first().value == "20"  # No change
 
     assert result == 100
+
+
+def test_ou_get_setting_values_bulk(
+    org, ou, org_user_setting, django_assert_num_queries
+):
+    """org_user_get_setting_values_bulk() resolves settings for every OrgUser in constant queries"""
+    other_ou = services.org_user_create(org=org, user=factories.user_create())
+    owner_ou = selectors.org_user_list(org=org, user=org.owner).get()
+    services.org_user_setting_default_create(
+        org=org, setting=org_user_setting, value="10"
+    )
+    services.org_user_org_user_setting_create(
+        org_user=ou, setting=org_user_setting, value="20"
+    )
+
+    with django_assert_num_queries(4):
+        result = services.org_user_get_setting_values_bulk(
+            org=org, slugs=["for-test", "unknown-setting"]
+        )
+
+    assert result == {
+        ou.pk: {"for-test": 20, "unknown-setting": False},
+        other_ou.pk: {"for-test": 10, "unknown-setting": False},
+        owner_ou.pk: {"for-test": 100, "unknown-setting": True},
+    }
+    assert OrgUserSetting.objects.count() == 1  # Nothing created
+
+
+def test_ou_get_setting_values_bulk_matches(org, ou, org_user_setting):
+    """org_user_get_setting_values_bulk() agrees with org_user_get_setting_value()"""
+    result = services.org_user_get_setting_values_bulk(org=org, slugs=["for-test"])
+
+    for org_user in selectors.org_user_list(org=org):
+        assert result[org_user.pk]["for-test"] == services.org_user_get_setting_value(
+            org_user=org_user, slug="for-test"
+        )
@@ -0,0 +1,105 @@
+from django.contrib.auth import BACKEND_SESSION_KEY, get_backends
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import backends, services, utils
+
+
+def test_cached_model_backend_configured(client, user):
+    """Users log in with CachedModelBackend, and sessions that stored ModelBackend's
+    path stay logged in."""
+    assert isinstance(get_backends()[0], backends.CachedModelBackend)
+
+    client.force_login(user)
+    assert client.session[BACKEND_SESSION_KEY] == "core.backends.CachedModelBackend"
+
+    client.force_login(user, backend="django.contrib.auth.backends.ModelBackend")
+    response = client.get(reverse("user:profile"))
+    assert response.wsgi_request.user == user
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend(client, user):
+    """The User of an authenticated request is cached between requests."""
+    client.force_login(user)
+    client.get(reverse("user:profile"))
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(reverse("user:profile"))
+    assert response.wsgi_request.user == user
+    assert not any('FROM "core_user"' in query["sql"] for query in ctx.captured_queries)
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend_user_update(client, user):
+    """Updating a User evicts the cached User."""
+    client.force_login(user)
+    client.get(reverse("user:profile"))
+
+    services.user_update(instance=user, first_name="Changed")
+    response = client.get(reverse("user:profile"))
+    assert response.wsgi_request.user.first_name == "Changed"
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend_password_change(client, user):
+    """Changing the password still logs out other sessions."""
+    client.force_login(user)
+    client.get(reverse("user:profile"))
+
+    services.user_update(instance=user, password="new-password-123")
+    response = client.get(reverse("user:profile"))
+    assert not response.wsgi_request.user.is_authenticated
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend_inactive(client, user):
+    """Deactivating a User logs them out on the next request."""
+    client.force_login(user)
+    client.get(reverse("user:profile"))
+
+    services.user_update(instance=user, is_active=False)
+    response = client.get(reverse("user:profile"))
+    assert not response.wsgi_request.user.is_authenticated
+
+
+def test_cached_model_backend_not_shared(client, user):
+    """Without a shared cache or the invalidation bus, the User is not cached, since
+    other processes could not evict it."""
+    client.force_login(user)
+    client.get(reverse("user:profile"))
+    assert cache.get(utils.get_user_cache_key(user.pk)) is None
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend_evicted_on_commit(
+    client, user, django_capture_on_commit_callbacks
+):
+    """The cached User is evicted again once the transaction commits, in case another
+    request cached the old row before then."""
+    key = utils.get_user_cache_key(user.pk)
+    with django_capture_on_commit_callbacks(execute=True):
+        services.user_update(instance=user, first_name="Changed")
+        cache.set(key, user)
+    assert cache.get(key) is None
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_cached_model_backend_password_change_view(client, user):
+    """Changing the password with PasswordChangeView, which saves the User itself, evicts
+    the cached User."""
+    client.login(username=user.email, password="goodpass")
+    client.get(reverse("user:profile"))
+    key = utils.get_user_cache_key(user.pk)
+    assert cache.get(key) is not None
+
+    payload = {
+        "old_password": "goodpass",
+        "new_password1": "newpass123",
+        "new_password2": "newpass123",
+    }
+    client.post(reverse("user:password-change"), payload)
+    assert cache.get(key) is None
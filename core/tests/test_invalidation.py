@@ -0,0 +1,123 @@
+import json
+
+import pytest
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+
+from core import constants, invalidation, selectors, services
+from core.models import GlobalSetting, OrgUser
+
+
+def _payload(**kwargs):
+    return json.dumps(
+        {"model": "core.globalsetting", "pk": 1, "fields": {}, "process": "other"}
+        | kwargs
+    )
+
+
+def test_dispatch_global_setting():
+    """A GlobalSetting change in another process discards the GlobalSetting snapshot"""
+    setting = services.global_setting_create(
+        slug="for-test", type=constants.SettingType.BOOL, value="false"
+    )
+    assert services.global_setting_get_value("for-test") is False
+    GlobalSetting.objects.filter(pk=setting.pk).update(value="true")
+
+    invalidation.dispatch(_payload(pk=setting.pk))
+    assert services.global_setting_get_value("for-test") is True
+
+
+def test_dispatch_own_process():
+    """Messages published by this process are ignored"""
+    calls = []
+    invalidation.register(GlobalSetting, calls.append)
+    try:
+        invalidation.dispatch(_payload(process=invalidation._process_id))
+        assert calls == []
+        invalidation.dispatch(_payload())
+        assert calls == [1]
+    finally:
+        invalidation._handlers["core.globalsetting"].remove((calls.append, ()))
+
+
+def test_dispatch_org_user_deleted(user, org, ou):
+    """A handler can evict the caches of an OrgUser deleted by another process"""
+    assert [o["id"] for o in services.user_get_available_orgs(user=user)] == [org.pk]
+
+    # Bypass the services so the cache is not invalidated.
+    OrgUser.objects.filter(pk=ou.pk).delete()
+    assert not selectors.org_user_list(pk=ou.pk).exists()
+
+    invalidation.dispatch(
+        _payload(
+            model="core.orguser",
+            pk=ou.pk,
+            fields={"org_id": org.pk, "user_id": user.pk},
+        )
+    )
+    assert services.user_get_available_orgs(user=user) == []
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+@pytest.mark.django_db(transaction=True)
+def test_publish_on_commit():
+    """model_update publishes a NOTIFY that is delivered once the transaction commits"""
+    wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+    raw = wrapper.get_new_connection(wrapper.get_connection_params())
+    raw.autocommit = True
+    raw.execute(f"LISTEN {invalidation.CHANNEL}")
+
+    setting = services.global_setting_create(
+        slug="for-test", type=constants.SettingType.BOOL, value="false"
+    )
+
+    notifies = list(raw.notifies(timeout=1, stop_after=1))
+    raw.close()
+    assert len(notifies) == 1
+    message = json.loads(notifies[0].payload)
+    assert message["model"] == "core.globalsetting"
+    assert message["pk"] == setting.pk
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+@pytest.mark.django_db(transaction=True)
+def test_publish_delete(user, org, ou):
+    """model_delete publishes the fields handlers need, since the row is gone by the
+    time they run"""
+    wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+    raw = wrapper.get_new_connection(wrapper.get_connection_params())
+    raw.autocommit = True
+    raw.execute(f"LISTEN {invalidation.CHANNEL}")
+
+    pk = ou.pk
+    services.org_user_delete(instance=ou)
+
+    notifies = list(raw.notifies(timeout=1, stop_after=1))
+    raw.close()
+    assert len(notifies) == 1
+    message = json.loads(notifies[0].payload)
+    assert message["model"] == "core.orguser"
+    assert message["pk"] == pk
+    assert message["fields"] == {"org_id": org.pk, "user_id": user.pk}
+    assert message["process"] == invalidation._process_id
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+@pytest.mark.django_db(transaction=True)
+def test_publish_user_save(user):
+    """User.save() publishes, since Django saves Users without model_update, e.g., when
+    the password changes"""
+    wrapper = connections.create_connection(DEFAULT_DB_ALIAS)
+    raw = wrapper.get_new_connection(wrapper.get_connection_params())
+    raw.autocommit = True
+    raw.execute(f"LISTEN {invalidation.CHANNEL}")
+
+    user.set_password("new-password-123")
+    user.save()
+
+    notifies = list(raw.notifies(timeout=1, stop_after=1))
+    raw.close()
+    assert len(notifies) == 1
+    message = json.loads(notifies[0].payload)
+    assert message["model"] == "core.user"
+    assert message["pk"] == user.pk
@@ -1,12 +1,19 @@
+import marshal
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
 from freezegun import freeze_time
-from django.test import override_settings
+from django.http import HttpResponse
+from django.test import AsyncClient, override_settings
 from django.utils import timezone
 from django.urls import reverse
 from django.test import Client
 from django.conf import settings
 
 from . import factories
-from .. import services, selectors
+from .. import models, services, selectors
+from .. import middleware
+from ..middleware import OrgContext, request_id_var
 
 
 def test_request_id_middleware_user(client, caplog, user):
@@ -17,6 +24,78 @@ def test_request_id_middleware_user(client, caplog, user):
     assert f"User.id={user.pk}" in caplog.text
 
 
+def test_middleware_async_capable():
+    """Every core middleware should run natively under both WSGI and ASGI."""
+
+    async def aget_response(request):
+        return HttpResponse()
+
+    for klass in (
+        middleware.FastPathMiddleware,
+        middleware.RequestIDMiddleware,
+        middleware.QueryStatsMiddleware,
+        middleware.SetRemoteAddrFromForwardedFor,
+        middleware.TimezoneMiddleware,
+        middleware.DisableClientCacheMiddleware,
+        middleware.HostUrlconfMiddleware,
+        middleware.OrgMiddleware,
+        middleware.InertiaUserMiddleware,
+        middleware.RequestProfileMiddleware,
+    ):
+        assert klass.sync_capable and klass.async_capable
+        assert iscoroutinefunction(klass(aget_response))
+        assert not iscoroutinefunction(klass(lambda request: HttpResponse()))
+
+
+def test_request_id_middleware_async(rf):
+    """Under ASGI, the request id should be set for the request's context only."""
+    request_ids = []
+
+    async def aget_response(request):
+        request_ids.append(request_id_var.get())
+        return HttpResponse()
+
+    request = rf.get("/")
+    async_to_sync(middleware.RequestIDMiddleware(aget_response))(request)
+    assert request_ids == [request.id]
+    assert request_id_var.get() == "none"
+
+
+def test_request_id_middleware_asgi_user(caplog, user):
+    """The RequestIDMiddleware should log the User.id under ASGI without loading the
+    User from the event loop."""
+    caplog.set_level("INFO")
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(user)
+    async_to_sync(client.get)(reverse("index"))
+    assert f"User.id={user.pk}" in caplog.text
+
+
+def test_query_stats_middleware(client, caplog, user):
+    """The request log line should include the request's SQL query count and time."""
+    caplog.set_level("INFO")
+    client.force_login(user)
+    response = client.get(reverse("index"))
+    query_stats = response.wsgi_request.query_stats
+    assert query_stats.count > 0
+    assert f"queries={query_stats.count} " in caplog.text
+    assert "db_ms=" in caplog.text
+    assert "Query budget exceeded" not in caplog.text
+
+
+def test_query_stats_middleware_budget(client, caplog, user):
+    """A route that runs more queries than its budget should log a warning."""
+    client.force_login(user)
+    with override_settings(QUERY_BUDGETS={"index": 0}):
+        client.get(reverse("index"))
+    assert "Query budget exceeded route=index" in caplog.text
+
+    caplog.clear()
+    with override_settings(QUERY_BUDGETS={}, QUERY_BUDGET_DEFAULT=None):
+        client.get(reverse("index"))
+    assert "Query budget exceeded" not in caplog.text
+
+
 @override_settings(HEROKU=True)
 def test_setremoteaddr_middleware(caplog):
     """An IP address passed in X-Forwarded-For header should end up in REMOTE_ADDR.
@@ -60,6 +139,38 @@ def test_health_check(client):
     assert response.status_code == 200
 
 
+def test_fast_path_middleware(client, django_assert_num_queries):
+    """health_check/ and robots.txt are served without the session or the database."""
+    with django_assert_num_queries(0):
+        response = client.get("/health_check/")
+    assert response.status_code == 200
+    assert not hasattr(response.wsgi_request, "session")
+
+    with django_assert_num_queries(0):
+        response = client.get("/robots.txt")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "text/plain"
+    assert b"User-agent: *" in response.content
+    assert not hasattr(response.wsgi_request, "session")
+
+
+def test_fast_path_middleware_security_headers(client):
+    """SecurityMiddleware still runs before the fast path."""
+    response = client.get("/health_check/")
+    assert response["X-Content-Type-Options"] == "nosniff"
+
+
+@override_settings(
+    HOST_URLCONFS={"www.example.com": "core.urls"},
+    ALLOWED_HOSTS=["testserver", "www.example.com"],
+)
+def test_fast_path_middleware_host_urlconf():
+    """Hosts with their own urlconf are not served by the fast path."""
+    client = Client(SERVER_NAME="www.example.com")
+    response = client.get("/robots.txt")
+    assert hasattr(response.wsgi_request, "session")
+
+
 @override_settings(
     HOST_URLCONFS={"www.example.com": "core.urls"},
     ALLOWED_HOSTS=["testserver", "www.example.com"],
@@ -185,3 +296,112 @@ def test_org_middleware_ou_last_accessed(client, user, org):
         ou = org2.org_users.get(user=user)
         assert ou.last_accessed_at == timezone.now()
         assert user.org_users.get(org=org).last_accessed_at != timezone.now()
+
+
+def test_org_context(user, org, django_assert_num_queries):
+    """OrgContext resolves the org, org user and available orgs in a single query."""
+    other_org = factories.org_create(domain="other.example.com")
+    services.org_user_create(org=other_org, user=user)
+    inactive_org = factories.org_create(is_active=False)
+    services.org_user_create(org=inactive_org, user=user)
+
+    with django_assert_num_queries(1):
+        context = OrgContext(
+            org_users=selectors.org_user_list(
+                user=user, org__is_active=True
+            ).select_related("org"),
+            domain="testserver",
+            slug=other_org.slug,  # On a different domain, so ignored.
+        )
+        assert context.org == org
+        assert context.org_user.user_id == user.pk
+        assert context.available_orgs == [other_org]
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["core.middleware.OrgMiddleware"])
+def test_org_middleware_org_context(client, user, org):
+    """The OrgMiddleware sets the OrgContext on the request."""
+    client.force_login(user)
+    response = client.get(reverse("index"))
+    assert response.wsgi_request.org_context.org == org
+    assert response.wsgi_request.org_context.org_user.user == user
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["core.middleware.OrgMiddleware"])
+def test_org_middleware_domain_without_orgs(client, user, org):
+    """Memberships aren't loaded on a domain without active Orgs."""
+    services.org_update(instance=org, domain="other.example.com")
+    client.force_login(user)
+    with patch.object(selectors, "org_user_list") as mock:
+        response = client.get(reverse("index"))
+    assert response.wsgi_request.org is None
+    assert response.wsgi_request.org_context is None
+    mock.assert_not_called()
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["core.middleware.OrgMiddleware"])
+def test_org_middleware_session_unchanged(client, user, org):
+    """The session is only written when the org changes."""
+    client.force_login(user)
+    response = client.get(reverse("index"))
+    assert response.wsgi_request.session.modified is True
+    assert client.session["org_slug"] == org.slug
+
+    response = client.get(reverse("index"))
+    assert response.wsgi_request.session.modified is False
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["core.middleware.OrgMiddleware"])
+def test_org_middleware_anonymous_session(client):
+    """Anonymous requests don't write a session."""
+    response = client.get(reverse("index"))
+    assert response.wsgi_request.session.modified is False
+
+
+@override_settings(MIDDLEWARE=settings.MIDDLEWARE + ["core.middleware.OrgMiddleware"])
+def test_org_middleware_available_orgs_partial_reload(client, user, org):
+    """available_orgs is only computed when the page includes it."""
+    other_org = factories.org_create()
+    services.org_user_create(org=other_org, user=user)
+    client.force_login(user)
+
+    response = client.get(reverse("user:profile"), HTTP_X_INERTIA="true")
+    assert [o["id"] for o in response.json()["props"]["available_orgs"]] == [
+        other_org.pk
+    ]
+
+    with patch.object(services, "user_get_available_orgs") as mock:
+        response = client.get(
+            reverse("user:profile"),
+            HTTP_X_INERTIA="true",
+            HTTP_X_INERTIA_PARTIAL_COMPONENT="core/Profile",
+            HTTP_X_INERTIA_PARTIAL_DATA="initial",
+        )
+    assert "available_orgs" not in response.json()["props"]
+    mock.assert_not_called()
+
+
+def test_request_profile_middleware(client):
+    """A staff user can profile a request, which is stored by its request id."""
+    user = factories.user_create(is_staff=True)
+    client.force_login(user)
+    response = client.get(reverse("index"), {settings.REQUEST_PROFILE_PARAM: "1"})
+
+    request_profile = models.RequestProfile.objects.get()
+    assert request_profile.request_id == response.wsgi_request.id
+    assert request_profile.user == user
+    assert request_profile.status_code == response.status_code
+    assert marshal.loads(request_profile.file.read())
+    assert "cumulative" in request_profile.summary
+
+    # Not profiled without the header or query parameter.
+    client.get(reverse("index"))
+    assert models.RequestProfile.objects.count() == 1
+
+
+def test_request_profile_middleware_not_staff(client, user):
+    """Only staff users can profile a request."""
+    client.force_login(user)
+    client.get(reverse("index"), headers={settings.REQUEST_PROFILE_HEADER: "1"})
+    client.get(reverse("index"), {settings.REQUEST_PROFILE_PARAM: "1"})
+    assert not models.RequestProfile.objects.exists()
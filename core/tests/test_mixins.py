@@ -1,3 +1,7 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
 from .. import mixins, services, selectors, constants
 
 
@@ -23,3 +27,91 @@ def test_org_user_setting_permission_mixin(rf, user, org):
         org_user=org_user, setting=org_user_setting, value="true"
     )
     assert mixin.test_func() is True
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=True)
+def test_org_user_setting_permission_mixin_cached(
+    rf, user, org, django_assert_num_queries
+):
+    """Permission decisions are cached and are invalidated by changes to the settings."""
+    org_user_setting = services.org_user_setting_create(
+        type=constants.SettingType.BOOL,
+        slug="test_setting",
+        default="false",
+        owner_value="true",
+    )
+    org_user_setting_default = services.org_user_setting_default_create(
+        org=org, setting=org_user_setting, value="false"
+    )
+    mixin = mixins.OrgUserSettingPermissionMixin()
+    mixin.org_user_setting = "test_setting"
+    request = rf.post("/test")
+    request.user = user
+    request.org = org
+    mixin.request = request
+    assert mixin.test_func() is False
+
+    # A new request is served from the shared cache.
+    mixin.request = rf.post("/test")
+    mixin.request.user = user
+    mixin.request.org = org
+    with django_assert_num_queries(0):
+        assert mixin.test_func() is False
+
+    services.org_user_setting_default_update(
+        instance=org_user_setting_default, value="true"
+    )
+    assert mixin.test_func() is True
+
+
+def test_org_user_setting_permission_mixin_not_shared(rf, user, org):
+    """Without a shared cache or the invalidation bus, decisions are only cached for the
+    request, since other processes could not evict them."""
+    services.org_user_setting_create(
+        type=constants.SettingType.BOOL,
+        slug="test_setting",
+        default="false",
+        owner_value="true",
+    )
+    mixin = mixins.OrgUserSettingPermissionMixin()
+    mixin.org_user_setting = "test_setting"
+    mixin.request = rf.post("/test")
+    mixin.request.user = user
+    mixin.request.org = org
+    assert mixin.test_func() is False
+
+    mixin.request = rf.post("/test")
+    mixin.request.user = user
+    mixin.request.org = org
+    with CaptureQueriesContext(connection) as queries:
+        assert mixin.test_func() is False
+    assert len(queries) > 0
+
+
+def test_org_user_setting_permission_mixin_multiple(rf, user, org):
+    """The OrgUserSettingPermissionMixin can require several OrgUserSettings to be True."""
+    services.org_user_setting_create(
+        type=constants.SettingType.BOOL,
+        slug="test_setting",
+        default="true",
+        owner_value="true",
+    )
+    other_setting = services.org_user_setting_create(
+        type=constants.SettingType.BOOL,
+        slug="other_setting",
+        default="false",
+        owner_value="true",
+    )
+    mixin = mixins.OrgUserSettingPermissionMixin()
+    mixin.org_user_settings = ["test_setting", "other_setting"]
+    request = rf.post("/test")
+    request.user = user
+    request.org = org
+    mixin.request = request
+    assert mixin.test_func() is False
+
+    org_user = selectors.org_user_list(org=org, user=user).get()
+    services.org_user_org_user_setting_create(
+        org_user=org_user, setting=other_setting, value="true"
+    )
+    assert mixin.test_func() is True
@@ -1,4 +1,6 @@
-from .. import utils
+import pytest
+
+from .. import constants, utils
 
 
 def test_get_display_name_no_name(user):
@@ -25,3 +27,15 @@ def test_get_display_name_no_name_long_email(user):
         user, "From", "example@example.com", "via Magistrate"
     )
     assert expected == actual
+
+
+def test_get_setting_caster():
+    """get_setting_caster returns a caster for each setting type and rejects unknown types"""
+    assert utils.get_setting_caster(constants.SettingType.BOOL)("True") is True
+    assert utils.get_setting_caster(constants.SettingType.INT)("5") == 5
+    assert utils.get_setting_caster(constants.SettingType.STR)("x") == "x"
+
+    with pytest.raises(ValueError):
+        utils.get_setting_caster(constants.SettingType.BOOL)("yes")
+    with pytest.raises(ValueError):
+        utils.get_setting_caster("float")
@@ -2,13 +2,18 @@ import json
 from importlib import import_module
 from typing import Callable, Optional, TYPE_CHECKING
 
+from django.conf import settings
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.forms.models import model_to_dict
 
 from inertia import render
-from . import constants
+from . import constants, invalidation
 from .exceptions import *
 
 if TYPE_CHECKING:
+    from .models import Org
     from .types import DjangoModelType
 
 
@@ -139,6 +144,21 @@ def get_snake_case(model: "DjangoModelType") -> str:
     return verbose_name.replace(" ", "_").lower()
 
 
+def cache_is_shared(alias: str = "default") -> bool:
+    """Whether a cache is shared between processes rather than held by each of them."""
+    return settings.CACHES[alias]["BACKEND"] not in (
+        "django.core.cache.backends.locmem.LocMemCache",
+        "django.core.cache.backends.dummy.DummyCache",
+    )
+
+
+def cache_invalidated_everywhere() -> bool:
+    """Whether a value evicted from the default cache is evicted for every process,
+    either because the cache is shared or because the invalidation bus repeats the
+    eviction in every process."""
+    return cache_is_shared() or invalidation.is_enabled()
+
+
 def get_function_from_path(path: str) -> Callable:
     """Get a function from a string path"""
     module_name, function_name = path.rsplit(".", 1)
@@ -146,6 +166,11 @@ def get_function_from_path(path: str) -> Callable:
     return getattr(module, function_name)
 
 
+def org_to_dict(org: "Org") -> dict:
+    """Serialize an Org for Inertia props, omitting its users."""
+    return model_to_dict(org, exclude=("users",))
+
+
 def get_value_from_subtyped_keys(d: dict, key: str) -> Optional[str]:
     """Given a dict, return the value of the first key
     that matches the subtype or its ancestors."""
@@ -173,18 +198,73 @@ def issubtype(subtype: str, type: str, inclusive=True) -> bool:
     return subtype.startswith(type + ".")
 
 
-def cast_setting(value: str, type: str) -> bool | int | str:
-    """Cast a setting's value to its type"""
-    if type == constants.SettingType.BOOL:
-        if value.lower() == "true":
-            return True
-        elif value.lower() == "false":
-            return False
-        else:
-            raise ValueError(f"Invalid boolean value: {value}")
-    elif type == constants.SettingType.INT:
-        return int(value)
-    elif type == "str":
-        return value
+def _cast_bool_setting(value: str) -> bool:
+    if value == "true" or value.lower() == "true":
+        return True
+    elif value == "false" or value.lower() == "false":
+        return False
     else:
+        raise ValueError(f"Invalid boolean value: {value}")
+
+
+def _cast_str_setting(value: str) -> str:
+    return value
+
+
+SETTING_CASTERS: dict[str, Callable[[str], bool | int | str]] = {
+    constants.SettingType.BOOL: _cast_bool_setting,
+    constants.SettingType.INT: int,
+    "str": _cast_str_setting,
+}
+
+
+def get_setting_caster(type: str) -> Callable[[str], bool | int | str]:
+    """The function that casts a setting's value to its type"""
+    try:
+        return SETTING_CASTERS[type]
+    except KeyError:
         raise ValueError(f"Invalid type: {type}")
+
+
+def cast_setting(value: str, type: str) -> bool | int | str:
+    """Cast a setting's value to its type"""
+    return get_setting_caster(type)(value)
+
+
+def get_user_cache_key(user_id) -> str:
+    """The cache key of a User loaded for authentication."""
+    return f"core:user:{user_id}"
+
+
+def user_cache_evict(user_id) -> None:
+    """Evict a User cached for authentication now, and again once the transaction
+    commits, since another request may cache the old row in the meantime."""
+    key = get_user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def get_org_setting_default_config(slug: str) -> dict[str, str]:
+    """The type and default used for an OrgSetting that doesn't exist in the database."""
+    # Check if there's a default configuration in settings
+    default_config = settings.ORG_SETTING_DEFAULTS.get(slug)
+    if default_config:
+        return default_config
+
+    # Fall back to hardcoded default
+    return {"type": constants.SettingType.BOOL, "default": "false"}
+
+
+def get_org_user_setting_default_config(slug: str) -> dict[str, str]:
+    """The type, default and owner_value used for an OrgUserSetting that doesn't exist in the database."""
+    # Check if there's a default configuration in settings
+    default_config = settings.ORG_USER_SETTING_DEFAULTS.get(slug)
+    if default_config:
+        return default_config
+
+    # Fall back to hardcoded default
+    return {
+        "type": constants.SettingType.BOOL,
+        "default": "false",
+        "owner_value": "true",
+    }
@@ -503,7 +503,7 @@ class PasswordResetView(FormView):
 class PasswordResetConfirmView(DjangoPasswordResetConfirmView):
     success_url = reverse_lazy("user:login")
     post_reset_login = True
-    post_reset_login_backend = "django.contrib.auth.backends.ModelBackend"
+    post_reset_login_backend = "core.backends.CachedModelBackend"
 
     def form_valid(self, form):
         response = super().form_valid(form)